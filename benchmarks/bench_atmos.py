@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for standard atmosphere calculations."""
+
+import numpy as np
+
+from tephrange import atmos
+
+
+class Atmos:
+    params = [5000.0, 15000.0, 30000.0]
+    param_names = ['altitude']
+
+    def setup(self, altitude):
+        self.table = atmos.AtmosphereTable(max_altitude=40000)
+
+    def time_get_atmos_state(self, altitude):
+        atmos.get_atmos_state(altitude)
+
+    def time_get_density(self, altitude):
+        atmos.get_density(altitude)
+
+    def time_get_viscosity(self, altitude):
+        atmos.get_viscosity(altitude)
+
+    def time_atmosphere_table(self, altitude):
+        self.table.get_atmos_state(altitude)
+
+
+class AtmosBatch:
+    params = [1000, 1000000]
+    param_names = ['n_altitudes']
+
+    def setup(self, n_altitudes):
+        self.altitude = np.linspace(0, 40000, n_altitudes)
+        self.table = atmos.AtmosphereTable(max_altitude=40000)
+
+    def time_get_atmos_state_batch(self, n_altitudes):
+        atmos.get_atmos_state(self.altitude)
+
+    def time_atmosphere_table_batch(self, n_altitudes):
+        self.table.get_atmos_state(self.altitude)
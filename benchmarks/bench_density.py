@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for particle density calculations."""
+
+import numpy as np
+
+from tephrange import density
+
+
+class Density:
+    params = [1e-5, 1e-3]
+    param_names = ['diameter']
+
+    def time_bp2003_scalar(self, diameter):
+        density.bp2003(diameter)
+
+
+class DensityBatch:
+    params = [1000, 100000]
+    param_names = ['n_particles']
+
+    def setup(self, n_particles):
+        self.diameter = np.logspace(-6, -2, n_particles)
+        self.density = np.linspace(500, 2300, n_particles)
+
+    def time_bp2003(self, n_particles):
+        density.bp2003(self.diameter)
+
+    def time_convert_to_solidity(self, n_particles):
+        density.convert_to_solidity(self.density)
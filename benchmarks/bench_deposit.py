@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for deposit calculations."""
+
+import numpy as np
+
+from tephrange import deposit
+
+
+class Deposit:
+    params = ([100, 10000], [10, 1000])
+    param_names = ['n_bins', 'n_heights']
+
+    def setup(self, n_bins, n_heights):
+        self.phi = np.linspace(-4, 10, n_bins)
+        self.mass_fraction = np.exp(-0.5 * ((self.phi - 3) / 2)**2)
+        self.release_height = np.linspace(1000, 20000, n_heights)
+
+    def time_deposit(self, n_bins, n_heights):
+        deposit.deposit(self.phi, self.mass_fraction, self.release_height,
+                        total_mass=1e9)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for terminal velocity calculations."""
+
+import numpy as np
+
+from tephrange import fall_velocity
+
+
+class Ganser:
+    params = [1e-6, 1e-4, 1e-2]
+    param_names = ['diameter']
+
+    def time_ganser_scalar(self, diameter):
+        fall_velocity.ganser(diameter)
+
+
+class GanserBatch:
+    params = [1000, 100000]
+    param_names = ['n_particles']
+
+    def setup(self, n_particles):
+        self.diameter = np.logspace(-7, -1, n_particles)
+        self.velocity = fall_velocity.ganser(self.diameter)
+
+    def time_ganser_batch(self, n_particles):
+        fall_velocity.ganser(self.diameter)
+
+    def time_ganser_batch_warm_start(self, n_particles):
+        fall_velocity.ganser(self.diameter, atm_density=1.1,
+                             initial_velocity=self.velocity)
+
+    def time_ganser_fast_batch(self, n_particles):
+        fall_velocity.ganser_fast(self.diameter)
+
+    def time_stokes_batch(self, n_particles):
+        fall_velocity.stokes(self.diameter)
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for ground footprint calculations."""
+
+import numpy as np
+
+from tephrange import footprint
+
+
+class Rasterise:
+    params = [10000, 1000000]
+    param_names = ['n_particles']
+
+    def setup(self, n_particles):
+        rng = np.random.default_rng(0)
+        self.x, self.y = rng.normal(scale=50, size=(2, n_particles))
+        self.mass = rng.random(n_particles)
+        self.edges = np.linspace(-200, 200, 401)
+
+    def time_rasterise(self, n_particles):
+        footprint.rasterise(self.x, self.y, self.mass, self.edges,
+                            self.edges)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for travel distance calculations."""
+
+import numpy as np
+
+from tephrange import atmos
+from tephrange.particle import Particle, ParticleEnsemble
+
+
+class CalculateDistance:
+    params = ([1, 10, 100], ['ganser', 'stokes'])
+    param_names = ['fall_step', 'velocity_function']
+
+    def time_calculate_distance(self, fall_step, velocity_function):
+        p = Particle(65e-6, sphericity=0.7, particle_density=2000)
+        p.calculate_distance(release_height=10000, windspeed=10,
+                             fall_step=fall_step,
+                             velocity_function=velocity_function)
+
+
+class CalculateDistanceBackend:
+    params = ['numpy', 'numba']
+    param_names = ['backend']
+
+    def time_calculate_distance_backend(self, backend):
+        p = Particle(65e-6, sphericity=0.7, particle_density=2000)
+        p.calculate_distance(release_height=10000, windspeed=10,
+                             fall_step=10, backend=backend)
+
+
+class CalculateDistanceAtmosphere:
+    params = ['analytic', 'table']
+    param_names = ['atmosphere']
+
+    def setup(self, atmosphere):
+        self.atmosphere = None
+        if atmosphere == 'table':
+            self.atmosphere = atmos.AtmosphereTable(max_altitude=10000)
+
+    def time_calculate_distance_atmosphere(self, atmosphere):
+        p = Particle(65e-6, sphericity=0.7, particle_density=2000)
+        p.calculate_distance(release_height=10000, windspeed=10,
+                             fall_step=10, atmosphere=self.atmosphere)
+
+
+class CalculateDistanceQuadrature:
+    params = ['ganser', 'stokes']
+    param_names = ['velocity_function']
+
+    def time_calculate_distance_quadrature(self, velocity_function):
+        p = Particle(65e-6, sphericity=0.7, particle_density=2000)
+        p.calculate_distance(release_height=10000, windspeed=10,
+                             velocity_function=velocity_function,
+                             method='quadrature')
+
+
+class EnsembleDistance:
+    params = ([100, 10000], ['ganser', 'stokes'])
+    param_names = ['n_particles', 'velocity_function']
+
+    def setup(self, n_particles, velocity_function):
+        self.diameter = np.logspace(-5, -2.5, n_particles)
+
+    def time_ensemble_calculate_distance(self, n_particles,
+                                         velocity_function):
+        ensemble = ParticleEnsemble(self.diameter, sphericity=0.7,
+                                    particle_density=2000)
+        ensemble.calculate_distance(release_height=10000, windspeed=10,
+                                    fall_step=100,
+                                    velocity_function=velocity_function)
+
+
+class EnsembleStokesQuadrature:
+    params = [10000, 1000000]
+    param_names = ['n_particles']
+
+    def setup(self, n_particles):
+        self.diameter = np.logspace(-6, -4, n_particles)
+        self.release_height = np.linspace(1000, 30000, n_particles)
+
+    def time_ensemble_stokes_quadrature(self, n_particles):
+        ensemble = ParticleEnsemble(self.diameter, sphericity=1,
+                                    particle_density=2000)
+        ensemble.calculate_distance(release_height=self.release_height,
+                                    windspeed=10, velocity_function='stokes',
+                                    method='quadrature')
+
+
+class CalculateDistanceAdaptive:
+    params = [1e-4, 1e-6, 1e-8]
+    param_names = ['tolerance']
+
+    def time_calculate_distance_adaptive(self, tolerance):
+        p = Particle(65e-6, sphericity=0.7, particle_density=2000)
+        p.calculate_distance(release_height=10000, windspeed=10,
+                             method='adaptive', tolerance=tolerance)
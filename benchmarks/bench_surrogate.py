@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for travel time table queries."""
+
+import numpy as np
+
+from tephrange.surrogate import TravelTimeTable
+
+
+class TravelTimeTableQuery:
+    params = [1, 10000]
+    param_names = ['n_queries']
+
+    def setup(self, n_queries):
+        self.table = TravelTimeTable.build(
+            diameter=np.logspace(-5, -3, 21), sphericity=[0.5, 0.7, 0.9],
+            density=[1000, 2300], release_height=np.linspace(1000, 20000, 20),
+            n_checks=10)
+        rng = np.random.default_rng(0)
+        self.diameter = 10 ** rng.uniform(-5, -3, n_queries)
+
+    def time_distance(self, n_queries):
+        self.table.distance(self.diameter, 0.7, 2000, 10000, 20)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Run the benchmark suite, optionally saving the results as a baseline or
+comparing them with a saved baseline.
+
+The benchmarks are written in the airspeed velocity (asv) style, so they
+can also be run with `asv run`.  This runner needs only the standard
+library and Numpy:
+
+    python -m benchmarks.run_benchmarks --compare benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --save benchmarks/baseline.json
+
+Baselines are machine specific; regenerate the stored baseline on the
+reference machine when the benchmarks change.
+"""
+import argparse
+import importlib
+import itertools
+import json
+import pkgutil
+import platform
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+BENCHMARK_DIR = Path(__file__).parent
+
+
+def discover(pattern=None):
+    """
+    Yield (name, function) pairs for every time_* method of every
+    parameter combination in the bench_*.py modules.  Names containing
+    pattern are kept if pattern is given.
+    """
+    for module_info in sorted(pkgutil.iter_modules([str(BENCHMARK_DIR)]),
+                              key=lambda m: m.name):
+        if not module_info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module(
+            'benchmarks.{}'.format(module_info.name))
+        for class_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            methods = sorted(m for m in vars(cls) if m.startswith('time_'))
+            for params in _param_combinations(cls):
+                for method in methods:
+                    name = '{}.{}.{}({})'.format(
+                        module_info.name, class_name, method,
+                        ', '.join(repr(p) for p in params))
+                    if pattern is None or pattern in name:
+                        yield name, _bind(cls, method, params)
+
+
+def _param_combinations(cls):
+    """Return the list of parameter tuples for an asv-style class."""
+    params = getattr(cls, 'params', [])
+    if not params:
+        return [()]
+    if len(getattr(cls, 'param_names', [])) == 1:
+        return [(p,) for p in params]
+    return list(itertools.product(*params))
+
+
+def _bind(cls, method, params):
+    """Return a function that sets up a benchmark instance and returns the
+    method to time."""
+    def prepare():
+        instance = cls()
+        if hasattr(instance, 'setup'):
+            instance.setup(*params)
+        bound = getattr(instance, method)
+        return lambda: bound(*params)
+    return prepare
+
+
+def time_benchmark(prepare, repeat=5):
+    """Return the best time per call in seconds."""
+    func = prepare()
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(pattern=None, repeat=5):
+    """Run the benchmarks and return a dict of results with metadata."""
+    results = {}
+    for name, prepare in discover(pattern):
+        seconds = time_benchmark(prepare, repeat=repeat)
+        results[name] = seconds
+        print('{:<90} {:>12}'.format(name, _format_time(seconds)))
+    return {'machine': platform.node(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results}
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    Print the ratio of each result to the baseline and return the names of
+    benchmarks that are slower by more than threshold.
+    """
+    regressions = []
+    print('\n{:<90} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline',
+                                                 'current', 'ratio'))
+    for name, seconds in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print('{:<90} {:>12} {:>12}'.format(name, '-',
+                                                _format_time(seconds)))
+            continue
+        ratio = seconds / before
+        flag = ''
+        if ratio > threshold:
+            flag = ' slower'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = ' faster'
+        print('{:<90} {:>12} {:>12} {:>8.2f}{}'.format(
+            name, _format_time(before), _format_time(seconds), ratio, flag))
+    return regressions
+
+
+def _format_time(seconds):
+    """Format a time in seconds with sensible units."""
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '{:.3g} {}'.format(seconds / scale, unit)
+    return '{:.3g} ns'.format(seconds / 1e-9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--filter', help='Run benchmarks whose name '
+                        'contains this text')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timing repeats (default 5)')
+    parser.add_argument('--save', help='Save results to this JSON file')
+    parser.add_argument('--compare', help='Compare with this JSON baseline')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown ratio reported as a regression '
+                        '(default 1.2)')
+    args = parser.parse_args(argv)
+
+    results = run(pattern=args.filter, repeat=args.repeat)
+    if args.save:
+        with open(args.save, 'w') as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)
+        regressions = compare(results, baseline, threshold=args.threshold)
+        if regressions:
+            print('\n{} benchmark(s) slower than baseline'.format(
+                len(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
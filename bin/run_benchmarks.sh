@@ -0,0 +1,5 @@
+#! /bin/bash
+
+# Compare with the stored baseline.  Extra arguments are passed on, e.g.
+# --filter ganser or --save benchmarks/baseline.json
+python -m benchmarks.run_benchmarks --compare benchmarks/baseline.json "$@"
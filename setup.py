@@ -1,4 +1,5 @@
 import pathlib
+import re
 from setuptools import setup
 
 # The directory containing this file
@@ -7,10 +8,15 @@ HERE = pathlib.Path(__file__).parent
 # The text of the README file
 README = (HERE / "README.md").read_text()
 
+# The version is defined once, in the package
+VERSION = re.search(r'^__version__ = "(.+)"$',
+                    (HERE / "tephrange" / "__init__.py").read_text(),
+                    re.MULTILINE).group(1)
+
 # This call to setup() does all the work
 setup(
     name="tephrange",
-    version="0.1.0",
+    version=VERSION,
     description="Python functions to calculate tephra terminal velocity and transport range",
     long_description=README,
     long_description_content_type="text/markdown",
@@ -30,4 +36,9 @@ setup(
     packages=["tephrange"],
     include_package_data=True,
     install_requires=["numpy"],
+    extras_require={"numba": ["numba"], "parquet": ["pyarrow"]},
+    entry_points={
+        "console_scripts": ["tephrange=tephrange.cli:main",
+                            "tephrange-service=tephrange.service:main"],
+    },
 )
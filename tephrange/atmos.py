@@ -2,14 +2,38 @@
 """Functions for calculating the properties of a standard atmosphere at
 a given altitude."""
 
+import math
+
 import numpy as np
 
+from tephrange import instrument
+
 # Define physics parameters (in SI units):
 G = 9.80665  # Acceleration due to gravity.
 ATM_GAS_CONSTANT = 287.05  # Specific gas constant for dry air.
 ATM_DENSITY = 1.2250  # Atmospheric density at sea level
 ATM_VISCOSITY = 1.7915e-5  # Atmospheric viscosity at sea level
 
+# ICAO standard atmosphere parameters
+TEMP_0KM = 288.15  # Temperature at 0km above mean sea level (K).
+TEMP_11KM = 216.65  # Temperature at 11km above mean sea level (K).
+TEMP_20KM = 216.65  # Temperature at 20km above mean sea level (K).
+LAPSE_RATE_BELOW_11KM = 0.0065  # Lapse rate from 0 to 11km above mean sea level.
+LAPSE_RATE_ABOVE_20KM = -0.001  # Lapse rate at more than 20km above mean sea level.
+PRESSURE_0KM = 101325.0  # Pressure at mean sea level (Pa).
+
+# Anchor pressure levels
+PRESSURE_11KM = PRESSURE_0KM * \
+                (1 - LAPSE_RATE_BELOW_11KM*11000 / TEMP_0KM) ** \
+                (G / (ATM_GAS_CONSTANT*LAPSE_RATE_BELOW_11KM))
+PRESSURE_20KM = PRESSURE_11KM * np.exp(-G * 9000 /
+                                       (ATM_GAS_CONSTANT*TEMP_11KM))
+
+# Altitudes at which atmospheric properties change gradient: the freezing
+# level (where the viscosity formula changes) and the ICAO layer boundaries.
+FREEZING_ALTITUDE = (TEMP_0KM - 273.15) / LAPSE_RATE_BELOW_11KM
+BREAKPOINTS = (FREEZING_ALTITUDE, 11000.0, 20000.0)
+
 
 def celcius(temperature):
     """Converts a temperature from degrees Kelvin to degrees Celcius."""
@@ -20,15 +44,7 @@ def get_viscosity(altitude):
     """Calculates the dynamic viscosity of the atmosphere at a
     given altitude (m) using the ICAO standard atmosphere."""
     temp = get_atmos_temp_press(altitude)[0]
-
-    # Dynamic viscosity calculation from NAME Physics.f90
-    if temp > 273.15:
-        viscosity = (1.718 + 0.0049*(temp - 273.15)) * 1e-5
-    else:
-        viscosity = (1.718 + 0.0049*(temp - 273.15) -
-                     1.2e-5*(temp-273.15)**2) * 1e-5
-
-    return viscosity
+    return _viscosity_from_temp(temp)
 
 
 def get_density(altitude):
@@ -39,40 +55,223 @@ def get_density(altitude):
     return atm_density
 
 
+def get_atmos_state(altitude):
+    """Calculates temperature, pressure, density and dynamic viscosity of
+    the atmosphere at a given altitude (m) using the ICAO standard
+    atmosphere.  The altitude may be a scalar or a Numpy array.
+    :param altitude: Altitude in metres
+    :return temp, pressure, density, viscosity:"""
+    temp, pressure = get_atmos_temp_press(altitude)
+    atm_density = pressure / (ATM_GAS_CONSTANT * temp)
+    viscosity = _viscosity_from_temp(temp)
+    return temp, pressure, atm_density, viscosity
+
+
 def get_atmos_temp_press(altitude):
     """Calculates temperature and pressure of the atmosphere at a given
-    altitude (m) using the ICAO standard atmosphere."""
-    # Define internal constants
-    temp0km = 288.15  # Temperature at 0km above mean sea level (K).
-    temp11km = 216.65  # Temperature at 11km above mean sea level (K).
-    temp20km = 216.65  # Temperature at 20km above mean sea level (K).
-    lapse_rate_below_11km = 0.0065  # Lapse rate from 0 to 11km above mean sea level.
-    lapse_rate_above_20km = -0.001  # Lapse rate at more than 20km above mean sea level.
-    pressure0km = 101325  # Pressure at mean sea level (Pa).
-
-    # Calculate anchor pressure levels
-    pressure11km = pressure0km * \
-                   (1 - lapse_rate_below_11km*11000 / temp0km) ** \
-                   (G / (ATM_GAS_CONSTANT*lapse_rate_below_11km))
-    pressure20km = pressure11km * np.exp(-G * 9000 /
-                                         (ATM_GAS_CONSTANT*temp11km))
-
-    # Interpolate between levels
-    if altitude < 11000:
-        pressure = pressure0km * \
-                   (1 - lapse_rate_below_11km * altitude / temp0km) ** \
-                   (G / (ATM_GAS_CONSTANT*lapse_rate_below_11km))
-        temp = temp0km - lapse_rate_below_11km * altitude
-    elif altitude < 20000:
-        pressure = pressure11km * np.exp(-G * (altitude - 11000) /
-                                         (ATM_GAS_CONSTANT*temp11km))
-        temp = temp11km
-    else:
-        pressure = pressure20km * \
-                           (1 - lapse_rate_above_20km * \
-                           (altitude - 20000) / temp20km) ** \
-                           (G / (ATM_GAS_CONSTANT*lapse_rate_above_20km)
-                           )
-        temp = temp20km - lapse_rate_above_20km * (altitude - 20000)
+    altitude (m) using the ICAO standard atmosphere.  The altitude may be
+    a scalar or a Numpy array."""
+    active_profile = instrument.ACTIVE
+    if active_profile is not None:
+        active_profile.record_atmos(np.size(altitude))
+
+    if isinstance(altitude, (int, float)):
+        # Interpolate between levels
+        if altitude < 11000:
+            return _troposphere(altitude)
+        elif altitude < 20000:
+            return _tropopause(altitude)
+        else:
+            return _stratosphere(altitude)
+
+    altitude = np.asarray(altitude, dtype=float)
+    temp = np.empty_like(altitude)
+    pressure = np.empty_like(altitude)
+    below_11km = altitude < 11000
+    above_20km = altitude >= 20000
+    between = ~(below_11km | above_20km)
+    for mask, layer in ((below_11km, _troposphere),
+                        (between, _tropopause),
+                        (above_20km, _stratosphere)):
+        temp[mask], pressure[mask] = layer(altitude[mask])
+
+    return temp[()], pressure[()]
+
 
+def _troposphere(altitude):
+    """Temperature and pressure between 0 and 11km."""
+    pressure = PRESSURE_0KM * \
+               (1 - LAPSE_RATE_BELOW_11KM * altitude / TEMP_0KM) ** \
+               (G / (ATM_GAS_CONSTANT*LAPSE_RATE_BELOW_11KM))
+    temp = TEMP_0KM - LAPSE_RATE_BELOW_11KM * altitude
     return temp, pressure
+
+
+def _tropopause(altitude):
+    """Temperature and pressure between 11 and 20km."""
+    pressure = PRESSURE_11KM * np.exp(-G * (altitude - 11000) /
+                                      (ATM_GAS_CONSTANT*TEMP_11KM))
+    temp = TEMP_11KM + 0 * altitude
+    return temp, pressure
+
+
+def _stratosphere(altitude):
+    """Temperature and pressure above 20km."""
+    pressure = PRESSURE_20KM * \
+               (1 - LAPSE_RATE_ABOVE_20KM *
+                (altitude - 20000) / TEMP_20KM) ** \
+               (G / (ATM_GAS_CONSTANT*LAPSE_RATE_ABOVE_20KM))
+    temp = TEMP_20KM - LAPSE_RATE_ABOVE_20KM * (altitude - 20000)
+    return temp, pressure
+
+
+def _viscosity_from_temp(temp):
+    """Dynamic viscosity calculation from NAME Physics.f90"""
+    if isinstance(temp, (int, float)):
+        if temp > 273.15:
+            return (1.718 + 0.0049*(temp - 273.15)) * 1e-5
+        return (1.718 + 0.0049*(temp - 273.15) -
+                1.2e-5*(temp-273.15)**2) * 1e-5
+
+    temp = np.asarray(temp, dtype=float)
+    viscosity = np.where(temp > 273.15,
+                         (1.718 + 0.0049*(temp - 273.15)) * 1e-5,
+                         (1.718 + 0.0049*(temp - 273.15) -
+                          1.2e-5*(temp-273.15)**2) * 1e-5)
+    return viscosity[()]
+
+
+class AtmosphereTable:
+    """The ICAO standard atmosphere precomputed on an altitude grid.
+    Values are interpolated linearly (logarithmically for pressure and
+    density), so that repeated evaluations at many altitudes cost a table
+    lookup instead of the layer formulas.  The grid always includes the
+    freezing level and the ICAO layer boundaries, where the properties have
+    kinks.  The relative interpolation error, estimated at the midpoints
+    between nodes, is stored in max_relative_error; it scales with the
+    square of the resolution (about 5e-8 at 10 m).  Instances can be used
+    in place of the atmos module wherever get_atmos_state is called, e.g.
+    as the atmosphere argument of Particle.calculate_distance."""
+
+    def __init__(self, max_altitude=50000, resolution=10, min_altitude=0):
+        """Build the table.
+        :param max_altitude: Top of the table in metres
+        :param resolution: Grid spacing in metres
+        :param min_altitude: Bottom of the table in metres"""
+        if max_altitude <= min_altitude:
+            raise ValueError('max_altitude ({}) must be greater than '
+                             'min_altitude ({})'.format(max_altitude,
+                                                        min_altitude))
+        n_points = int(np.ceil((max_altitude - min_altitude) / resolution))
+        grid = np.linspace(min_altitude, max_altitude, n_points + 1)
+        breakpoints = [x for x in BREAKPOINTS
+                       if min_altitude < x < max_altitude]
+        self.altitude = np.union1d(grid, breakpoints)
+        self.resolution = resolution
+
+        # Temperature, log pressure, log density and viscosity at the
+        # bottom of each interval, and their slopes with altitude
+        temp, pressure, atm_density, viscosity = get_atmos_state(
+            self.altitude)
+        values = np.array([temp, np.log(pressure), np.log(atm_density),
+                           viscosity])
+        self._values = np.ascontiguousarray(values[:, :-1])
+        self._slopes = np.diff(values) / np.diff(self.altitude)
+
+        # Intervals are found from the uniform grid cell, which contains
+        # at most one breakpoint: the interval at the bottom of the cell
+        # and the altitude of the breakpoint that splits it (or infinity)
+        self._bottom = float(min_altitude)
+        self._top = float(max_altitude)
+        self._n_cells = n_points
+        self._cells_per_metre = n_points / (self._top - self._bottom)
+        self._first = np.searchsorted(self.altitude, grid[:-1],
+                                      side='right') - 1
+        self._split = np.where(self.altitude[self._first + 1] < grid[1:],
+                               self.altitude[self._first + 1], np.inf)
+
+        # Copies as lists for fast scalar lookups
+        self._altitude_list = self.altitude.tolist()
+        self._first_list = self._first.tolist()
+        self._split_list = self._split.tolist()
+        self._values_list = self._values.T.tolist()
+        self._slopes_list = self._slopes.T.tolist()
+
+        self.max_relative_error = self._estimate_error()
+
+    def get_atmos_state(self, altitude):
+        """Interpolates temperature, pressure, density and dynamic
+        viscosity at a given altitude (m), which may be a scalar or a Numpy
+        array.  The interval containing each altitude is found once and
+        used for all four properties.
+        :param altitude: Altitude in metres
+        :return temp, pressure, density, viscosity:"""
+        active_profile = instrument.ACTIVE
+        if active_profile is not None:
+            active_profile.record_atmos(np.size(altitude))
+
+        if isinstance(altitude, (int, float)):
+            if not self._bottom <= altitude <= self._top:
+                self._raise_range_error()
+            cell = int((altitude - self._bottom) * self._cells_per_metre)
+            if cell == self._n_cells:
+                cell -= 1
+            node = self._first_list[cell]
+            if altitude >= self._split_list[cell]:
+                node += 1
+            offset = altitude - self._altitude_list[node]
+            temp, log_pressure, log_density, viscosity = \
+                self._values_list[node]
+            d_temp, d_log_pressure, d_log_density, d_viscosity = \
+                self._slopes_list[node]
+            return (temp + offset * d_temp,
+                    math.exp(log_pressure + offset * d_log_pressure),
+                    math.exp(log_density + offset * d_log_density),
+                    viscosity + offset * d_viscosity)
+
+        altitude = np.asarray(altitude, dtype=float)
+        if altitude.size and (altitude.min() < self._bottom or
+                              altitude.max() > self._top):
+            self._raise_range_error()
+        cell = ((altitude - self._bottom) *
+                self._cells_per_metre).astype(np.intp)
+        np.minimum(cell, self._n_cells - 1, out=cell)
+        node = self._first[cell]
+        node += altitude >= self._split[cell]
+        offset = altitude - self.altitude[node]
+
+        state = []
+        for values, slopes in zip(self._values, self._slopes):
+            value = np.take(slopes, node)
+            value *= offset
+            value += np.take(values, node)
+            state.append(value)
+        np.exp(state[1], out=state[1])
+        np.exp(state[2], out=state[2])
+        return tuple(value[()] for value in state)
+
+    def get_density(self, altitude):
+        """Interpolates the density of the atmosphere at a given
+        altitude (m)."""
+        return self.get_atmos_state(altitude)[2]
+
+    def get_viscosity(self, altitude):
+        """Interpolates the dynamic viscosity of the atmosphere at a given
+        altitude (m)."""
+        return self.get_atmos_state(altitude)[3]
+
+    def _raise_range_error(self):
+        """Raise ValueError for altitudes outside the table."""
+        raise ValueError(
+            'Altitude outside AtmosphereTable range ({} to {} m)'.format(
+                self.altitude[0], self.altitude[-1]))
+
+    def _estimate_error(self):
+        """Return the largest relative error in pressure, density or
+        viscosity at the midpoints between grid nodes, which is close to
+        the largest interpolation error anywhere in the table."""
+        midpoints = 0.5 * (self.altitude[1:] + self.altitude[:-1])
+        exact = get_atmos_state(midpoints)
+        table = self.get_atmos_state(midpoints)
+        return max(np.max(np.abs(t / e - 1))
+                   for t, e in zip(table[1:], exact[1:]))
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Opt-in persistent cache of calculate_distance results.  Results are only
+looked up and stored while a ResultCache is active, so the disabled path
+costs one attribute lookup per call:
+
+    with cache.ResultCache('results.sqlite'):
+        Particle(65e-6).calculate_distance()
+
+or, for a whole notebook session, cache.enable().  Entries are keyed by a
+hash of the particle properties, the run parameters and the library
+version, and are stored in an SQLite database that can be shared by many
+processes.  Runs with a wind profile, a custom atmosphere or a velocity
+cache are not cached.  Models registered under an existing name are not
+detected, so clear the cache after changing a velocity model.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import tephrange
+
+# The ResultCache that is currently active, if any
+ACTIVE = None
+
+DEFAULT_MAX_SIZE = 256 * 2**20
+
+
+class ResultCache:
+    """A size-limited store of calculation results in an SQLite database.
+    When the stored results exceed max_size bytes, the least recently used
+    are evicted.  The database uses write-ahead logging and each process
+    opens its own connection, so worker processes can share one cache.
+    Hits and misses are counted in hits and misses."""
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        """Open or create the cache.
+        :param path: Path of the database file (default is default_path())
+        :param max_size: Maximum total size of stored results in bytes"""
+        self.path = default_path() if path is None else os.fspath(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._previous = None
+        self._connection = None
+        self._pid = None
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, '
+                'value BLOB NOT NULL, size INTEGER NOT NULL, '
+                'accessed REAL NOT NULL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_accessed '
+                'ON results (accessed)')
+
+    def __enter__(self):
+        global ACTIVE
+        self._previous = ACTIVE
+        ACTIVE = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global ACTIVE
+        ACTIVE = self._previous
+        self._previous = None
+        return False
+
+    def get(self, key):
+        """Return the stored dictionary of arrays for key, or None."""
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute('UPDATE results SET accessed = ? '
+                               'WHERE key = ?', (time.time(), key))
+        self.hits += 1
+        with np.load(io.BytesIO(row[0]), allow_pickle=False) as archive:
+            return {name: archive[name] for name in archive.files}
+
+    def put(self, key, values):
+        """Store a dictionary of arrays under key, evicting the least
+        recently used results if the cache is too large."""
+        buffer = io.BytesIO()
+        np.savez(buffer, **values)
+        value = buffer.getvalue()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time()))
+            self._evict(connection)
+
+    def clear(self):
+        """Remove all stored results."""
+        with self._connect() as connection:
+            connection.execute('DELETE FROM results')
+
+    def close(self):
+        """Close this process's connection to the database."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @property
+    def size(self):
+        """Total size of the stored results in bytes."""
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def _connect(self):
+        """Return the connection for this process, opening it if needed.
+        Used as a context manager, it commits or rolls back a
+        transaction."""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60,
+                                               check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._connection
+
+    def _evict(self, connection):
+        """Delete the least recently used results until the total size is
+        within max_size."""
+        total = connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = connection.execute(
+            'SELECT key, size FROM results ORDER BY accessed').fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+    def __getstate__(self):
+        # Connections cannot be pickled; worker processes open their own
+        state = self.__dict__.copy()
+        state.update(_connection=None, _pid=None, _previous=None)
+        return state
+
+
+def default_path():
+    """Return the default database path, in the directory given by the
+    TEPHRANGE_CACHE_DIR environment variable or ~/.cache/tephrange."""
+    directory = os.environ.get('TEPHRANGE_CACHE_DIR')
+    if directory is None:
+        directory = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'tephrange')
+    return os.path.join(directory, 'results.sqlite')
+
+
+def enable(path=None, max_size=DEFAULT_MAX_SIZE):
+    """Activate a ResultCache until disable is called, and return it."""
+    global ACTIVE
+    ACTIVE = ResultCache(path, max_size)
+    return ACTIVE
+
+
+def disable():
+    """Deactivate the current ResultCache."""
+    global ACTIVE
+    ACTIVE = None
+
+
+def make_key(kind, *parts):
+    """
+    Return a hash of the kind of calculation, its parameters and the
+    library version.  Numbers are compared by value and arrays by their
+    shape and values.
+    """
+    digest = hashlib.sha256()
+    for part in (tephrange.__version__, kind) + parts:
+        if isinstance(part, (str, bool)) or part is None:
+            digest.update(repr(part).encode())
+        elif isinstance(part, (int, float, np.number)):
+            digest.update(repr(float(part)).encode())
+        else:
+            array = np.ascontiguousarray(part, dtype=float)
+            digest.update(repr(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(b'\0')
+    return digest.hexdigest()
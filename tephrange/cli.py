@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface for calculating travel distances of a catalogue of
+particles.
+
+The input is a CSV or Parquet file with a diameter column (m) and optional
+sphericity, density (kg/m3), release_height (m) and windspeed (m/s)
+columns.  Missing columns take the values given as options.  The output
+has the input columns plus distance (km) and travel_time (s); other input
+columns, e.g. sample IDs, are passed through unchanged.  Rows are
+read, calculated and written in chunks, so memory use does not depend on
+the size of the input.
+"""
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import os
+import sys
+
+import numpy as np
+
+from tephrange import density as density_models
+from tephrange.particle import ParticleEnsemble
+
+COLUMNS = ('diameter', 'sphericity', 'density', 'release_height',
+           'windspeed')
+OUTPUT_COLUMNS = ('distance', 'travel_time')
+
+
+def main(argv=None):
+    """Run the tephrange command."""
+    parser = _get_parser()
+    args = parser.parse_args(argv)
+    defaults = {'sphericity': args.sphericity,
+                'density': args.density,
+                'release_height': args.release_height,
+                'windspeed': args.windspeed}
+    settings = {'fall_step': args.fall_step,
+                'velocity_function': args.velocity_function}
+
+    try:
+        reader = _get_reader(args.input, args.chunk_size)
+        header, chunks = next(reader), reader
+        if 'diameter' not in header:
+            parser.error('Input has no diameter column')
+        writer = _get_writer(args.output, header + list(OUTPUT_COLUMNS))
+    except (ImportError, OSError) as exc:
+        parser.error(str(exc))
+
+    tasks = ((chunk, _get_task(header, chunk, defaults, settings))
+             for chunk in chunks)
+    try:
+        n_rows = _write_results(writer, tasks, args.workers)
+    except ValueError as exc:
+        # Do not leave a partial output file
+        os.remove(args.output)
+        parser.error(str(exc))
+
+    if not args.quiet:
+        print('Wrote {} rows to {}'.format(n_rows, args.output),
+              file=sys.stderr)
+    return 0
+
+
+def _write_results(writer, tasks, workers):
+    """Calculate each chunk's task and write the chunk and its results.
+    Return the number of rows written."""
+    n_rows = 0
+    with writer:
+        if workers == 1:
+            for chunk, task in tasks:
+                writer.write(chunk, calculate_chunk(task))
+                n_rows += len(chunk[0])
+        else:
+            # Keep a bounded number of chunks in flight, written in order
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = deque()
+                for chunk, task in tasks:
+                    in_flight.append(
+                        (chunk, executor.submit(calculate_chunk, task)))
+                    if len(in_flight) >= 2 * workers:
+                        chunk, future = in_flight.popleft()
+                        writer.write(chunk, future.result())
+                        n_rows += len(chunk[0])
+                while in_flight:
+                    chunk, future = in_flight.popleft()
+                    writer.write(chunk, future.result())
+                    n_rows += len(chunk[0])
+    return n_rows
+
+
+def calculate_chunk(task):
+    """
+    Return travel distance (km) and travel time (s) arrays for one chunk.
+    :param task: Tuple of diameter, sphericity, density, release_height
+        and windspeed arrays, and fall_step and velocity_function
+    """
+    diameter, sphericity, density, release_height, windspeed, fall_step, \
+        velocity_function = task
+    if isinstance(density, str):
+        density = density_models.size_dependant_density(diameter,
+                                                        model=density)
+    ensemble = ParticleEnsemble(diameter, sphericity, density)
+    return ensemble.calculate_distance(release_height=release_height,
+                                       windspeed=windspeed,
+                                       fall_step=fall_step,
+                                       velocity_function=velocity_function)
+
+
+def _get_parser():
+    """Return the argument parser."""
+    parser = argparse.ArgumentParser(
+        prog='tephrange', description=__doc__.strip().split('\n\n')[1])
+    parser.add_argument('input', help='Input .csv or .parquet file')
+    parser.add_argument('output', help='Output .csv or .parquet file')
+    parser.add_argument('--sphericity', type=float, default=0.7,
+                        help='Sphericity if there is no sphericity column '
+                        '(default 0.7)')
+    parser.add_argument('--density', type=_density, default=2300,
+                        help='Density (kg/m3) or the name of a density '
+                        'model, e.g. bp2003, if there is no density column '
+                        '(default 2300)')
+    parser.add_argument('--release-height', type=float, default=10000,
+                        help='Release height (m) if there is no '
+                        'release_height column (default 10000)')
+    parser.add_argument('--windspeed', type=float, default=10,
+                        help='Windspeed (m/s) if there is no windspeed '
+                        'column (default 10)')
+    parser.add_argument('--fall-step', type=float, default=10,
+                        help='Fall step (m) (default 10)')
+    parser.add_argument('--velocity-function', default='ganser',
+                        choices=['ganser', 'ganser_fast', 'stokes',
+                                 'stokes_sea_level'],
+                        help='Velocity function (default ganser)')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Rows per chunk (default 10000)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes (default 1)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Do not print a summary')
+    return parser
+
+
+def _density(value):
+    """Parse the --density option."""
+    if value in density_models.MODELS:
+        return value
+    return float(value)
+
+
+def _get_task(header, chunk, defaults, settings):
+    """Return the calculate_chunk arguments for a chunk of columns."""
+    columns = dict(zip(header, chunk))
+    values = [columns['diameter']]
+    values += [columns.get(name, defaults[name]) for name in COLUMNS[1:]]
+    return tuple(values) + (settings['fall_step'],
+                            settings['velocity_function'])
+
+
+def _get_reader(path, chunk_size):
+    """Yield the header and then lists of column arrays for each chunk."""
+    if path.endswith('.parquet'):
+        return _read_parquet(path, chunk_size)
+    return _read_csv(path, chunk_size)
+
+
+def _read_csv(path, chunk_size):
+    with open(path, newline='') as infile:
+        reader = csv.reader(infile)
+        header = [name.strip() for name in next(reader)]
+        yield header
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                break
+            yield _convert_columns(header, zip(*rows))
+
+
+def _read_parquet(path, chunk_size):
+    parquet = _import_parquet()
+    parquet_file = parquet.ParquetFile(path)
+    header = list(parquet_file.schema_arrow.names)
+    yield header
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield _convert_columns(header, [
+            column.to_numpy(zero_copy_only=False)
+            for column in batch.columns])
+
+
+def _convert_columns(header, columns):
+    """
+    Return a chunk's columns as arrays, converting the COLUMNS used in
+    the calculation to floats and passing the others through unchanged.
+    :raises ValueError: If a calculation column holds something other
+        than numbers
+    """
+    converted = []
+    for name, column in zip(header, columns):
+        if name in COLUMNS:
+            try:
+                column = np.asarray(column, dtype=float)
+            except (TypeError, ValueError) as exc:
+                raise ValueError('Column {} must contain only numbers '
+                                 '({})'.format(name, exc))
+        else:
+            column = np.asarray(column)
+        converted.append(column)
+    return converted
+
+
+def _get_writer(path, header):
+    if path.endswith('.parquet'):
+        return _ParquetWriter(path, header)
+    return _CSVWriter(path, header)
+
+
+class _CSVWriter:
+    """Write chunks of input columns and results to a CSV file."""
+
+    def __init__(self, path, header):
+        self.outfile = open(path, 'w', newline='')
+        self.writer = csv.writer(self.outfile)
+        self.writer.writerow(header)
+
+    def write(self, chunk, results):
+        self.writer.writerows(zip(*[column.tolist() for column in
+                                    list(chunk) + list(results)]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.outfile.close()
+        return False
+
+
+class _ParquetWriter:
+    """Write chunks of input columns and results to a Parquet file."""
+
+    def __init__(self, path, header):
+        import pyarrow
+        self.pyarrow = pyarrow
+        self.parquet = _import_parquet()
+        self.path = path
+        self.header = header
+        self.writer = None
+
+    def write(self, chunk, results):
+        table = self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array(column)
+             for column in list(chunk) + list(results)], names=self.header)
+        if self.writer is None:
+            # Passed-through columns keep the types of the first chunk
+            self.writer = self.parquet.ParquetWriter(self.path,
+                                                     table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.writer is None:
+            self.writer = self.parquet.ParquetWriter(
+                self.path, self.pyarrow.schema(
+                    [(name, self.pyarrow.float64()) for name in self.header]))
+        self.writer.close()
+        return False
+
+
+def _import_parquet():
+    """Import pyarrow.parquet, which is an optional dependency."""
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet files need pyarrow '
+                          '(pip install pyarrow)')
+    return pyarrow.parquet
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,14 +2,31 @@
 """Functions for calculating the density of an ash particle based upon the
 size and composition."""
 
+import math
+
 import numpy as np
 
+# Size-density models by name, see register_model
+MODELS = {}
+
+
+class DensityRangeError(ValueError):
+    """Raised when particle densities lie outside the range between the
+    atmosphere and solid glass.  The indices of all offending values are
+    stored in too_dense and too_light, as tuples of arrays like those
+    returned by np.nonzero."""
+
+    def __init__(self, message, too_dense, too_light):
+        super().__init__(message)
+        self.too_dense = too_dense
+        self.too_light = too_light
+
 
 def bp2003(diameter, rho_pumice=440, rho_glass=2300):
     """
     Return the density of particles of given diameter (m) based on the model
     of Bonadonna and Phillips (2003), which assumes a linear decrease (on
-    the phi scale) from lithic at 8 microns (6 phi) to pumice at 2
+    the phi scale) from lithic at 8 microns (7 phi) to pumice at 2
     millimeters (-1 phi).
 
     Example values are:
@@ -21,41 +38,98 @@ def bp2003(diameter, rho_pumice=440, rho_glass=2300):
     Andesite:
         Eruption: Hudson 1991  Pumice: 1000 kg/m3, Lithic: 2600 kg/m3
 
-    :param diameter: Numpy array of particle diameters
-    :return density: Numpy array of particle density in kg/m3.
+    :param diameter: Particle diameter(s) in metres, as a scalar or Numpy
+        array
+    :return density: Particle density in kg/m3, with the shape of diameter
     """
     diam_lithic = 7
     diam_pumice = -1
 
-    diam_phi = -np.log2(diameter * 1000)
-    if diam_phi > diam_lithic:
-        return rho_glass
-    elif diam_phi < diam_pumice:
-        return rho_pumice
+    # Position between lithic (0) and pumice (1) on the phi scale
+    if isinstance(diameter, (int, float)):
+        diam_phi = -math.log2(diameter * 1000)
+        fraction = min(max((diam_phi - diam_lithic) /
+                           (diam_pumice - diam_lithic), 0.0), 1.0)
     else:
-        diff_diam = diam_pumice - diam_lithic
-        diff_rho = abs(rho_pumice - rho_glass)
-        density = rho_glass - (((diam_phi - diam_lithic) /
-                                diff_diam) * diff_rho)
+        diam_phi = -np.log2(np.asarray(diameter, dtype=float) * 1000)
+        fraction = np.clip((diam_phi - diam_lithic) /
+                           (diam_pumice - diam_lithic), 0, 1)
+
+    density = rho_glass - fraction * (rho_glass - rho_pumice)
     return density
 
 
+def register_model(name, func):
+    """
+    Register a size-density model so that it can be used by name, e.g. by
+    size_dependant_density or as the density of sweep.sweep.
+    :param name: Name of the model
+    :param func: Vectorised function func(diameter, **kwargs) returning
+        density in kg/m3 for diameters in metres
+    """
+    MODELS[name] = func
+
+
+def size_dependant_density(diameter, model='bp2003', **kwargs):
+    """
+    Return the density (kg/m3) of particles of given diameter (m) using a
+    registered size-density model.  kwargs are passed to the model.
+    """
+    try:
+        func = MODELS[model]
+    except (KeyError, TypeError):
+        msg = 'Density model must be one of {}. {} given.'
+        raise ValueError(msg.format(', '.join(MODELS), model))
+    return func(diameter, **kwargs)
+
+
+register_model('bp2003', bp2003)
+
+
 def convert_to_solidity(density, rho_glass=2300, rho_atm=1.225):
     """
     Calculate the solidity of a particle given the bulk density (kg/m3)
     and the lithic density.  Default rho_glass corresponds to Askja
     rhyolite glass.
 
-    :density: np.array of density values
+    :density: Scalar or np.array of density values
     :return solidity: Proportion of particle volume occupied by solid.
+    :raises DensityRangeError: If any density is more than rho_glass or
+        less than rho_atm.  The message gives the number of offending
+        values and the first few indices, and the exception attributes
+        give the index of every offending value.
     """
     # density = X*rho_glass + (1-X)*rho_air
     # X = (density - rho_air) / (rho_glass - rho_air)
-    result = np.array(
-        [single_solidity(x, rho_glass=rho_glass, rho_atm=rho_atm)
-         for x in density])
+    density = np.asarray(density, dtype=float)
+    too_dense = np.nonzero(np.atleast_1d(density > rho_glass))
+    too_light = np.nonzero(np.atleast_1d(density < rho_atm))
+    if too_dense[0].size or too_light[0].size:
+        problems = []
+        if too_dense[0].size:
+            problems.append('more than glass density ({}) at {}'.format(
+                rho_glass, _format_indices(too_dense)))
+        if too_light[0].size:
+            problems.append('less than atmosphere density ({}) at {}'.format(
+                rho_atm, _format_indices(too_light)))
+        raise DensityRangeError(
+            'Particle density is {}'.format(' and '.join(problems)),
+            too_dense, too_light)
+
+    solidity = (density - rho_atm) / (rho_glass - rho_atm)
+    return solidity[()]
+
 
-    return result
+def _format_indices(indices, max_shown=5):
+    """Format a tuple of index arrays, as returned by np.nonzero, as their
+    number and a list of the first max_shown."""
+    count = indices[0].size
+    first = [axis[:max_shown].tolist() for axis in indices]
+    shown = str(first[0] if len(indices) == 1 else list(zip(*first)))
+    if count > max_shown:
+        shown = shown[:-1] + ', ...]'
+    return '{} {}: {}'.format(count, 'index' if count == 1 else 'indices',
+                              shown)
 
 
 def single_solidity(density, rho_glass=2300, rho_atm=1.225):
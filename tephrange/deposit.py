@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Functions for calculating the mass loading of a deposit along the wind
+direction from a total grain-size distribution released from a column."""
+
+import numpy as np
+
+from tephrange import atmos
+from tephrange import density as density_models
+from tephrange import fall_velocity
+from tephrange import wind
+
+
+class Deposit:
+    """Mass deposited in bins of distance along the wind direction.
+    edges are the bin edges (km), mass the mass in each bin (kg) and
+    loading the mass per km of downwind distance (kg/km).  Mass landing
+    outside the edges is stored in mass_before and mass_beyond."""
+
+    def __init__(self, edges, mass, mass_before, mass_beyond):
+        self.edges = edges
+        self.mass = mass
+        self.mass_before = mass_before
+        self.mass_beyond = mass_beyond
+
+    @property
+    def centres(self):
+        """Centres of the distance bins in km."""
+        return 0.5 * (self.edges[:-1] + self.edges[1:])
+
+    @property
+    def loading(self):
+        """Mass per km of downwind distance in kg/km."""
+        return self.mass / np.diff(self.edges)
+
+
+def deposit(phi, mass_fraction, release_height, release_fraction=None,
+            total_mass=1.0, distance_edges=None, windspeed=10,
+            sphericity=0.7, density=2300, velocity_function='ganser',
+            fall_step=1000, chunk_size=None, atmosphere=None):
+    """
+    Calculate the mass deposited along the wind direction by grains of a
+    grain-size distribution released at a range of heights.
+
+    Downwind drift is integrated up from the ground with Simpson's rule on
+    a grid of altitudes that includes the atmospheric layer boundaries,
+    for all grains of a chunk of size bins together.  The drift from every
+    release height is then interpolated from the grid by cubic Hermite
+    interpolation with the exact slope u/v, so each bin is evaluated once
+    however many release heights there are.  Mass is summed onto the
+    distance bins with np.bincount.
+
+    :param phi: Grain sizes in phi units (diameter = 2**-phi mm)
+    :param mass_fraction: Mass fraction of each grain size (normalised to
+        a total of 1)
+    :param release_height: Release heights in metres
+    :param release_fraction: Fraction of the mass released at each height
+        (normalised to a total of 1; default is equal fractions)
+    :param total_mass: Total erupted mass in kg
+    :param distance_edges: Edges of the distance bins in km (default is
+        1 km bins from 0 to 1000 km)
+    :param windspeed: Windspeed in metres per second, or a wind profile
+        (see wind.as_profile).  Distance is measured along the wind
+        direction at the highest release height.
+    :param sphericity: Particle sphericity, for all or each grain size
+    :param density: Particle density in kg/m3, for all or each grain size,
+        or the name of a registered size-density model, e.g. 'bp2003'
+    :param velocity_function: Name of a registered velocity model
+    :param fall_step: Spacing of the altitude grid in metres
+    :param chunk_size: Number of grain sizes to calculate together
+        (default keeps about 2 million release height and grain size
+        pairs in memory)
+    :param atmosphere: Object providing get_atmos_state (default atmos)
+    :return: Deposit
+    """
+    atmosphere = atmos if atmosphere is None else atmosphere
+    phi = np.atleast_1d(np.asarray(phi, dtype=float))
+    diameter = 2.0**-phi / 1000
+    mass_fraction = _normalise(np.broadcast_to(mass_fraction, phi.shape))
+    release_height = np.atleast_1d(np.asarray(release_height, dtype=float))
+    if release_fraction is None:
+        release_fraction = np.ones(release_height.shape)
+    release_fraction = _normalise(np.broadcast_to(release_fraction,
+                                                  release_height.shape))
+    if np.any(release_height < 0):
+        raise ValueError('Release heights must not be negative')
+    if distance_edges is None:
+        distance_edges = np.arange(1001.0)
+    edges = np.asarray(distance_edges, dtype=float) * 1000
+    if edges.ndim != 1 or len(edges) < 2 or np.any(np.diff(edges) <= 0):
+        raise ValueError('Distance edges must be at least two increasing '
+                         'values')
+
+    if isinstance(density, str):
+        density = density_models.size_dependant_density(diameter,
+                                                        model=density)
+    sphericity, density = [np.broadcast_to(np.asarray(x, dtype=float),
+                                           phi.shape)
+                           for x in (sphericity, density)]
+
+    top = release_height.max()
+    levels = _get_levels(top, fall_step)
+    altitude, atm_density, atm_viscosity = _get_altitude_grid(levels,
+                                                              atmosphere)
+    profile = wind.as_profile(windspeed)
+    if profile is None:
+        along = np.full(altitude.shape, float(windspeed))
+    else:
+        reference = profile.get_speed_direction(top)[1]
+        along = profile.get_along_cross(altitude, reference)[0]
+    interval, hermite = _get_hermite(levels, release_height)
+
+    if chunk_size is None:
+        chunk_size = max(1, 2000000 // len(release_height))
+    counts = np.zeros(len(edges) + 1)
+    for start in range(0, len(phi), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        distance = _release_distances(
+            diameter[chunk], sphericity[chunk], density[chunk],
+            velocity_function, altitude, atm_density, atm_viscosity, along,
+            interval, hermite)
+        mass = (total_mass * release_fraction[:, np.newaxis] *
+                mass_fraction[chunk])
+        counts += np.bincount(_bin_index(distance, edges).ravel(),
+                              weights=mass.ravel(), minlength=len(counts))
+
+    return Deposit(edges / 1000, counts[1:-1], counts[0], counts[-1])
+
+
+def _release_distances(diameter, sphericity, density, velocity_function,
+                       altitude, atm_density, atm_viscosity, along, interval,
+                       hermite):
+    """
+    Return an array of the downwind distances (m) travelled by each grain
+    (columns) from each release height (rows).  altitude holds the grid
+    levels and the midpoints between them, in ascending order.  Release
+    height i lies in grid interval[i], and hermite holds columns of the
+    weights of the drift at the top of the interval and the slopes at
+    its bottom and top.
+    """
+    if len(altitude) == 1:
+        return np.zeros((len(interval), len(diameter)))
+    drift, level_slope = _get_drift(diameter, sphericity, density,
+                                    velocity_function, altitude, atm_density,
+                                    atm_viscosity, along)
+
+    # Cubic Hermite interpolation to each release height
+    weight, lower_slope, upper_slope = hermite
+    lower = drift[interval]
+    result = drift[interval + 1]
+    result -= lower
+    result *= weight
+    result += lower
+    term = level_slope[interval]
+    term *= lower_slope
+    result += term
+    term = level_slope[interval + 1]
+    term *= upper_slope
+    result += term
+    return result
+
+
+def _get_drift(diameter, sphericity, density, velocity_function, altitude,
+               atm_density, atm_viscosity, along):
+    """
+    Return arrays of the downwind drift (m) from the ground to each grid
+    level and of its slope with altitude, u/v, at each level, with a
+    column for each grain.  Arguments are as _release_distances.
+    """
+    velocity = fall_velocity.bind_model(velocity_function, diameter,
+                                        sphericity, density)
+
+    # Slope of drift with altitude, u/v, at every level and midpoint
+    slope = np.empty((len(altitude), len(diameter)))
+    v_terminal = None
+    for level in range(len(altitude)):
+        v_terminal = velocity(atm_density[level], atm_viscosity[level],
+                              v_terminal)
+        np.divide(along[level], v_terminal, out=slope[level])
+    level_slope = slope[::2]
+
+    # Integrate drift up from the ground with Simpson's rule
+    dz = np.diff(altitude[::2])[:, np.newaxis]
+    drift = np.zeros_like(level_slope)
+    np.cumsum(dz / 6 * (level_slope[:-1] + 4*slope[1::2] +
+                        level_slope[1:]), axis=0, out=drift[1:])
+    return drift, level_slope
+
+
+def _get_levels(top, fall_step, extra=()):
+    """
+    Return the altitude grid levels (m) from the ground to top, fall_step
+    apart, with the atmospheric layer boundaries and any extra levels.
+    """
+    return np.unique(np.concatenate([
+        np.arange(0, top, fall_step), [top],
+        [b for b in atmos.BREAKPOINTS if b < top], np.ravel(extra)]))
+
+
+def _get_altitude_grid(levels, atmosphere):
+    """
+    Return the levels interleaved with the midpoints between them, and
+    the atmospheric density and viscosity there.
+    """
+    altitude = np.empty(2 * len(levels) - 1)
+    altitude[::2] = levels
+    altitude[1::2] = 0.5 * (levels[:-1] + levels[1:])
+    _, _, atm_density, atm_viscosity = atmosphere.get_atmos_state(altitude)
+    atm_density = np.broadcast_to(atm_density, altitude.shape)
+    atm_viscosity = np.broadcast_to(atm_viscosity, altitude.shape)
+    return altitude, atm_density, atm_viscosity
+
+
+def _get_hermite(levels, height):
+    """
+    Return the grid interval containing each height and the Hermite
+    weights, as columns, of the value at the top of the interval and the
+    slopes at its bottom and top.
+    """
+    interval = np.clip(np.searchsorted(levels, height) - 1, 0,
+                       max(len(levels) - 2, 0))
+    if len(levels) > 1:
+        width = levels[interval + 1] - levels[interval]
+        t = (height - levels[interval]) / width
+    else:
+        width = t = np.zeros(height.shape)
+    hermite = [x[:, np.newaxis] for x in (3*t**2 - 2*t**3,
+                                          width * (t**3 - 2*t**2 + t),
+                                          width * (t**3 - t**2))]
+    return interval, hermite
+
+
+def _bin_index(distance, edges):
+    """
+    Return the index of the bin containing each distance, shifted by one
+    so that 0 is before the first edge and len(edges) is after the last.
+    """
+    spacing = np.diff(edges)
+    if np.allclose(spacing, spacing[0]):
+        scaled = (distance - edges[0]) / spacing[0]
+        np.clip(scaled, -1, len(edges) - 1, out=scaled)
+        return np.floor(scaled, out=scaled).astype(np.intp) + 1
+    return np.searchsorted(edges, distance, side='right')
+
+
+def _normalise(weights):
+    """Return weights scaled to a total of 1."""
+    weights = np.asarray(weights, dtype=float)
+    total = weights.sum()
+    if total <= 0:
+        raise ValueError('Fractions must have a positive total')
+    return weights / total
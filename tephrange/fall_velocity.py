@@ -2,7 +2,12 @@
 """Functions for calculating terminal velocity of particles using different
 methods."""
 
+from collections import OrderedDict
+import functools
+import math
+
 from tephrange import atmos
+from tephrange import instrument
 import numpy as np
 
 GRAVITY = atmos.G
@@ -14,7 +19,8 @@ def stokes(diameter,
            density=2300, atm_density=ATM_DENSITY, atm_viscosity=ATM_VISCOSITY):
     """
     Calculates terminal velocity of a particle of given diameter using
-    Stokes' law.  Default values are for andesite at sea level.
+    Stokes' law.  Default values are for andesite at sea level.  All
+    arguments may be scalars or broadcastable Numpy arrays.
     """
 
     velocity = (1/18.0) * (density - atm_density) / atm_viscosity * \
@@ -23,35 +29,292 @@ def stokes(diameter,
 
 
 def ganser(diameter, sphericity=0.7,
-           density=2300, atm_density=ATM_DENSITY, atm_viscosity=ATM_VISCOSITY):
+           density=2300, atm_density=ATM_DENSITY, atm_viscosity=ATM_VISCOSITY,
+           initial_velocity=None, rtol=1e-10, max_iterations=50,
+           return_iterations=False):
     """
     Calculates terminal velocity of a particle of given diameter (m) and
     sphericity using the Ganser (1993) equation.  Default values are for
     andesite at sea level, as used in Stevenson et al (2015).
+
+    The force balance 2 log(v) + log(drag) = log(drag v**2) is solved for
+    log(velocity) by Newton iteration.  The derivative of the residual is
+    kept above 0.5 and each step is limited to a factor of e**2, so it
+    converges in a handful of iterations from any starting point.
+
+    All arguments may be scalars or broadcastable Numpy arrays.
+    Convergence is tracked for each element separately and converged
+    elements are dropped from the iteration.  Scalar inputs return a
+    scalar.
+
+    :param initial_velocity: First guess at the velocity, e.g. from a
+        nearby altitude (default is estimated from the Stokes and Newton
+        drag regimes)
+    :param rtol: Relative tolerance on velocity
+    :param max_iterations: Maximum number of iterations before raising
+        RuntimeError
+    :param return_iterations: Also return the number of iterations taken
+    :return velocity[, iterations]:
     """
+    k1, k2 = _ganser_shape_factors(sphericity)
+    return _ganser_solve(diameter, k1, k2, density, atm_density,
+                         atm_viscosity, initial_velocity, rtol,
+                         max_iterations, return_iterations)
 
-    # Set up internal constants
+
+def _ganser_solve(diameter, k1, k2, density, atm_density, atm_viscosity,
+                  initial_velocity, rtol, max_iterations, return_iterations):
+    """
+    Ganser (1993) terminal velocity given the shape factors k1 and k2.
+    See ganser for the arguments.
+    """
+    args = (diameter, k1, k2, density, atm_density, atm_viscosity)
+    if (all(isinstance(x, (int, float)) for x in args) and
+            isinstance(initial_velocity, (int, float, type(None)))):
+        velocity, iterations = _ganser_scalar(*args, initial_velocity,
+                                              rtol, max_iterations)
+        active_profile = instrument.ACTIVE
+        if active_profile is not None:
+            active_profile.record_ganser(1, iterations, iterations)
+        if return_iterations:
+            return velocity, iterations
+        return velocity
+
+    if initial_velocity is not None:
+        args += (initial_velocity,)
+    arrays = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in args])
+    shape = arrays[0].shape
+
+    # Work on flat copies so that active elements can be selected by index
+    diameter, k1, k2, density, atm_density, atm_viscosity = \
+        [x.ravel() for x in arrays[:6]]
+    log_target = np.log(_ganser_velocity_scale(diameter, density,
+                                               atm_density))
+
+    # Iteratively calculate log of terminal velocity
+    if initial_velocity is None:
+        log_velocity = np.log(_ganser_first_guess(
+            diameter, density, atm_density, atm_viscosity, k1, k2))
+    else:
+        log_velocity = np.log(arrays[6].ravel())
+    iterations = np.zeros(log_velocity.size, dtype=int)
+    active = np.arange(log_velocity.size)
+    for _ in range(max_iterations):
+        if active.size == 0:
+            break
+        reynolds_k = (diameter[active] * np.exp(log_velocity[active]) *
+                      atm_density[active] / atm_viscosity[active] *
+                      k1[active] * k2[active])
+        drag, slope = _ganser_drag_slope(reynolds_k)
+        residual = (2*log_velocity[active] + np.log(drag * k2[active]) -
+                    log_target[active])
+        step = np.clip(residual / np.maximum(2 + slope, 0.5), -2, 2)
+        log_velocity[active] -= step
+        iterations[active] += 1
+        active = active[np.abs(step) > rtol]
+    else:
+        if active.size > 0:
+            raise RuntimeError(
+                'Ganser velocity did not converge in {} iterations for {} '
+                'element(s)'.format(max_iterations, active.size))
+
+    active_profile = instrument.ACTIVE
+    if active_profile is not None:
+        active_profile.record_ganser(
+            iterations.size, int(iterations.sum()),
+            int(iterations.max()) if iterations.size else 0)
+
+    velocity = np.exp(log_velocity).reshape(shape)[()]
+    if return_iterations:
+        return velocity, iterations.reshape(shape)[()]
+    return velocity
+
+
+def _ganser_scalar(diameter, k1, k2, density, atm_density, atm_viscosity,
+                   initial_velocity, rtol, max_iterations):
+    """
+    Ganser (1993) terminal velocity for scalar arguments.  Uses the math
+    module to avoid the array overhead of the vectorised version when
+    stepping a single particle.
+    :return velocity, iterations:
+    """
+    scale = _ganser_velocity_scale(diameter, density, atm_density)
+    if initial_velocity is None:
+        initial_velocity = _ganser_first_guess(diameter, density,
+                                               atm_density, atm_viscosity,
+                                               k1, k2)
+    if not (scale > 0 and initial_velocity > 0):
+        # No real velocity, e.g. particles lighter than air; NaN as the
+        # vectorised version
+        return math.nan, 1
+    log_target = math.log(scale)
+    log_velocity = math.log(initial_velocity)
+
+    for iterations in range(1, max_iterations + 1):
+        reynolds_k = (diameter * math.exp(log_velocity) * atm_density /
+                      atm_viscosity * k1 * k2)
+        drag, slope = _ganser_drag_slope(reynolds_k)
+        residual = 2*log_velocity + math.log(drag * k2) - log_target
+        step = min(max(residual / max(2 + slope, 0.5), -2), 2)
+        log_velocity -= step
+        if abs(step) <= rtol:
+            return math.exp(log_velocity), iterations
+
+    raise RuntimeError('Ganser velocity did not converge in {} '
+                       'iterations'.format(max_iterations))
+
+
+def _ganser_shape_factors(sphericity):
+    """
+    Return the Stokes' (k1) and Newton's (k2) shape factors of Ganser
+    (1993) for a given sphericity.
+    """
     k1 = 3 / (1 + 2*(sphericity**-0.5))
     k2 = 10**(1.8148*((-np.log10(sphericity))**0.5743))  # Note log10 here
+    return k1, k2
 
-    # Iteratively calculate terminal velocity
-    velocity = stokes(diameter, density,
-                      atm_density, atm_viscosity)  # First guess is Stokes'
-    velocity_difference = 99999
-    while abs(velocity_difference) > 0.000001:  # Usually < 15 iterations
-        reynolds = _get_reynolds(diameter, velocity,
-                                 atm_density, atm_viscosity)
-        drag = (
-            (24/(reynolds*k1*k2) *
-            (1 + 0.1118*((reynolds*k1*k2)**0.6567))) +
-            (0.4345 / (1 + (3305/(reynolds*k1*k2))))
-            ) * k2
-        new_velocity = np.sqrt((4 * diameter * GRAVITY *
-                               (density - atm_density)) /
-                               (3 * drag * atm_density))
-        velocity_difference = velocity - new_velocity
-        velocity = new_velocity
-    return velocity
+
+def _ganser_velocity_scale(diameter, density, atm_density):
+    """
+    Return drag * velocity**2, which is fixed by the balance between
+    weight and drag.
+    """
+    return (4 * diameter * GRAVITY * (density - atm_density) /
+            (3 * atm_density))
+
+
+def _ganser_first_guess(diameter, density, atm_density, atm_viscosity,
+                        k1, k2):
+    """
+    Return the smaller of the velocities in the Stokes (drag = 24/(Re k1))
+    and Newton (drag = 0.4345 k2) regimes as a starting point for
+    iteration.
+    """
+    v_stokes = k1 * stokes(diameter, density, atm_density, atm_viscosity)
+    v_newton = (_ganser_velocity_scale(diameter, density, atm_density) /
+                (0.4345 * k2)) ** 0.5
+    return np.minimum(v_stokes, v_newton)
+
+
+def _ganser_drag_slope(reynolds_k):
+    """
+    Return the Ganser (1993) drag coefficient divided by k2, and the
+    derivative of log(drag) with respect to log(Re), given Re k1 k2.  The
+    derivative lies between -1 (Stokes regime) and about 0.
+    """
+    x = reynolds_k
+    stokes_term = 24/x * (1 + 0.1118*(x**0.6567))
+    newton_term = 0.4345 / (1 + (3305/x))
+    drag = stokes_term + newton_term
+    slope = (24/x * (-1 + 0.1118*(0.6567 - 1)*(x**0.6567)) +
+             0.4345 * (3305/x) / (1 + (3305/x))**2) / drag
+    return drag, slope
+
+
+def ganser_fast(diameter, sphericity=0.7,
+                density=2300, atm_density=ATM_DENSITY,
+                atm_viscosity=ATM_VISCOSITY):
+    """
+    Calculates terminal velocity with the Ganser (1993) equation, as
+    ganser, by interpolation in a precomputed table instead of iteration.
+
+    In terms of x = Re k1 k2, the force balance becomes
+    3/4 x**2 drag(x) = Ar k1**2 k2, where
+    Ar = d**3 g (density - atm_density) atm_density / atm_viscosity**2 is
+    the Archimedes number, so for every sphericity x is a single function
+    of Y = Ar k1**2 k2.  log(x) is tabulated against log(Y) on first use
+    and evaluated by cubic Hermite interpolation with the exact slope
+    1 / (2 + dlog(drag)/dlog(x)).  The relative difference from ganser is
+    less than 1e-6 (about 1e-11 in practice).  Values of Y outside the
+    table, 1e-15 to 1e20, are solved by iteration.
+
+    All arguments may be scalars or broadcastable Numpy arrays.  Scalar
+    inputs return a scalar.
+    """
+    k1, k2 = _ganser_shape_factors(sphericity)
+    return _ganser_fast_solve(diameter, k1, k2, density, atm_density,
+                              atm_viscosity)
+
+
+# Range and spacing in log(Y) of the ganser_fast table, see ganser_fast
+_GANSER_TABLE_START = math.log(1e-15)
+_GANSER_TABLE_STOP = math.log(1e20)
+_GANSER_TABLE_STEP = 0.02
+_GANSER_TABLE = None
+
+
+def _ganser_fast_solve(diameter, k1, k2, density, atm_density,
+                       atm_viscosity):
+    """
+    ganser_fast terminal velocity given the shape factors k1 and k2.  See
+    ganser_fast for the arguments.
+    """
+    log_x, slope, log_x_list, slope_list = _get_ganser_table()
+    args = (diameter, k1, k2, density, atm_density, atm_viscosity)
+    if all(isinstance(x, (int, float)) for x in args):
+        log_x, slope = log_x_list, slope_list
+        archimedes = (diameter**3 * GRAVITY * (density - atm_density) *
+                      atm_density / atm_viscosity**2)
+        position = ((math.log(archimedes * k1**2 * k2) - _GANSER_TABLE_START)
+                    / _GANSER_TABLE_STEP)
+        index = math.floor(position)
+        if not 0 <= index < len(log_x) - 1:
+            return _ganser_solve(*args, None, 1e-10, 50, False)
+        t = position - index
+        x = math.exp(
+            log_x[index] + t*t*(3 - 2*t) * (log_x[index + 1] - log_x[index])
+            + t*(1 - t)*((1 - t)*slope[index] - t*slope[index + 1]))
+        return x * atm_viscosity / (k1 * k2 * diameter * atm_density)
+
+    arrays = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in args])
+    diameter, k1, k2, density, atm_density, atm_viscosity = arrays
+    archimedes = (diameter**3 * GRAVITY * (density - atm_density) *
+                  atm_density / atm_viscosity**2)
+    position = ((np.log(archimedes * k1**2 * k2) - _GANSER_TABLE_START) /
+                _GANSER_TABLE_STEP)
+    inside = (position >= 0) & (position < len(log_x) - 1)
+    index = np.where(inside, position, 0).astype(int)
+    t = position - index
+    lower = log_x[index]
+    x = np.exp(lower + t*t*(3 - 2*t) * (log_x[index + 1] - lower) +
+               t*(1 - t)*((1 - t)*slope[index] - t*slope[index + 1]))
+    velocity = x * atm_viscosity / (k1 * k2 * diameter * atm_density)
+
+    if not np.all(inside):
+        outside = ~inside
+        velocity[outside] = _ganser_solve(
+            *[x[outside] for x in arrays], None, 1e-10, 50, False)
+    return velocity[()]
+
+
+def _get_ganser_table():
+    """
+    Return the ganser_fast table of log(x) and of the slope dlog(x)/dlog(Y)
+    times the table step, at equal steps of log(Y), as arrays and then as
+    lists for scalar lookups.  The table is built on the first call.
+    """
+    global _GANSER_TABLE
+    if _GANSER_TABLE is None:
+        n_points = int(round((_GANSER_TABLE_STOP - _GANSER_TABLE_START) /
+                             _GANSER_TABLE_STEP)) + 1
+        log_y = _GANSER_TABLE_START + _GANSER_TABLE_STEP * np.arange(n_points)
+
+        # Solve 3/4 x**2 drag(x) = Y for log(x) by Newton iteration from
+        # the Stokes or Newton regime solution.  The derivative, 2 + slope,
+        # lies between 1 and 2, so the iteration converges from anywhere.
+        log_x = np.minimum(log_y - math.log(18),
+                           0.5 * (log_y - math.log(0.75 * 0.4345)))
+        for _ in range(100):
+            drag, drag_slope = _ganser_drag_slope(np.exp(log_x))
+            step = ((math.log(0.75) + 2*log_x + np.log(drag) - log_y) /
+                    (2 + drag_slope))
+            log_x -= step
+            if np.max(np.abs(step)) < 1e-14:
+                break
+        drag_slope = _ganser_drag_slope(np.exp(log_x))[1]
+        slope = _GANSER_TABLE_STEP / (2 + drag_slope)
+        _GANSER_TABLE = log_x, slope, log_x.tolist(), slope.tolist()
+    return _GANSER_TABLE
 
 
 def white(diameter, density=2300, atm_density=ATM_DENSITY,
@@ -94,7 +357,212 @@ def _get_reynolds(diameter, velocity,
                   atm_density=ATM_DENSITY, atm_viscosity=ATM_VISCOSITY):
     """
     Calculates Reynolds number for a falling particle of given diameter (m)
-    and velocity.
+    and velocity.  Arguments may be scalars or broadcastable Numpy arrays.
     """
     reynolds = diameter * velocity * atm_density / atm_viscosity
     return reynolds
+
+
+# Velocity models by name, see register_model
+MODELS = {}
+
+
+def register_model(name, func=None, bind=None):
+    """
+    Register a velocity model so that it can be used by name, e.g. as the
+    velocity_function of Particle.calculate_distance.
+
+    Give either func, a vectorised function
+    func(diameter, sphericity, density, atm_density, atm_viscosity), or
+    bind, a function bind(diameter, sphericity, density) that is called
+    once per calculation and returns a function
+    velocity(atm_density, atm_viscosity, initial_velocity=None, index=None)
+    for those particles.  Constants that depend only on the particles
+    should be calculated by bind.  index selects particles from arrays of
+    particle properties and initial_velocity is the velocity of the
+    previous step, or None.
+
+    Models registered at run time are sent to the worker processes of
+    sweep.sweep, so func or bind must then be defined at module level
+    (not a lambda or nested function) for it to be pickled.
+    """
+    if (func is None) == (bind is None):
+        raise ValueError('Give one of func or bind')
+    if bind is None:
+        bind = _bind_function(func)
+    MODELS[name] = bind
+
+
+def bind_model(name, diameter, sphericity, density):
+    """
+    Return the velocity function of the named model bound to particles of
+    the given diameter (m), sphericity and density (kg/m3).  See
+    register_model.
+    """
+    try:
+        bind = MODELS[name]
+    except (KeyError, TypeError):
+        msg = 'Velocity function must be one of {}. {} given.'
+        raise ValueError(msg.format(', '.join(MODELS), name))
+    return bind(diameter, sphericity, density)
+
+
+def _bind_function(func):
+    """Return a bind function for a plain vectorised velocity function.
+    It can be pickled, and so sent to worker processes, if func can."""
+    return functools.partial(_bind_plain, func)
+
+
+def _bind_plain(func, diameter, sphericity, density):
+    """Return func bound to particles, see _bind_function."""
+    def velocity(atm_density, atm_viscosity, initial_velocity=None,
+                 index=None):
+        if index is None:
+            return func(diameter, sphericity, density, atm_density,
+                        atm_viscosity)
+        return func(diameter[index], _select(sphericity, index),
+                    density[index], atm_density, atm_viscosity)
+    return velocity
+
+
+def _select(values, index):
+    """Return values[index], or values if it is a scalar."""
+    return values[index] if np.ndim(values) else values
+
+
+def _bind_ganser(diameter, sphericity, density, rtol=1e-10,
+                 max_iterations=50):
+    """Bind the Ganser model, calculating the shape factors once."""
+    k1, k2 = _ganser_shape_factors(sphericity)
+    if isinstance(sphericity, (int, float)):
+        # Python floats keep the scalar solver off Numpy arithmetic
+        k1, k2 = float(k1), float(k2)
+
+    def velocity(atm_density, atm_viscosity, initial_velocity=None,
+                 index=None):
+        if index is None:
+            return _ganser_solve(diameter, k1, k2, density, atm_density,
+                                 atm_viscosity, initial_velocity, rtol,
+                                 max_iterations, False)
+        return _ganser_solve(diameter[index], _select(k1, index),
+                             _select(k2, index), density[index],
+                             atm_density, atm_viscosity, initial_velocity,
+                             rtol, max_iterations, False)
+    return velocity
+
+
+def _bind_ganser_fast(diameter, sphericity, density):
+    """Bind the ganser_fast model, calculating the shape factors once."""
+    k1, k2 = _ganser_shape_factors(sphericity)
+    if isinstance(sphericity, (int, float)):
+        k1, k2 = float(k1), float(k2)
+
+    def velocity(atm_density, atm_viscosity, initial_velocity=None,
+                 index=None):
+        if index is None:
+            return _ganser_fast_solve(diameter, k1, k2, density,
+                                      atm_density, atm_viscosity)
+        return _ganser_fast_solve(diameter[index], _select(k1, index),
+                                  _select(k2, index), density[index],
+                                  atm_density, atm_viscosity)
+    return velocity
+
+
+def _stokes_model(diameter, sphericity, density, atm_density,
+                  atm_viscosity):
+    return stokes(diameter=diameter, density=density,
+                  atm_density=atm_density, atm_viscosity=atm_viscosity)
+
+
+def _stokes_sea_level_model(diameter, sphericity, density, atm_density,
+                            atm_viscosity):
+    return stokes(diameter=diameter, density=density,
+                  atm_density=ATM_DENSITY, atm_viscosity=ATM_VISCOSITY)
+
+
+def _white_model(diameter, sphericity, density, atm_density, atm_viscosity):
+    return white(diameter=diameter, density=density,
+                 atm_density=atm_density, atm_viscosity=atm_viscosity)
+
+
+register_model('ganser', bind=_bind_ganser)
+register_model('ganser_fast', bind=_bind_ganser_fast)
+register_model('stokes', _stokes_model)
+register_model('stokes_sea_level', _stokes_sea_level_model)
+register_model('white', _white_model)
+
+
+class VelocityCache:
+    """A bounded, least-recently-used cache of terminal velocities.  Keys
+    are the velocity model name and the diameter, sphericity, density,
+    atmospheric density and atmospheric viscosity, each rounded to a given
+    number of significant figures so that inputs that differ only by
+    floating point noise share an entry.  Use with scalar inputs."""
+
+    def __init__(self, max_size=100000, significant_figures=10):
+        """Set up an empty cache.
+        :param max_size: Maximum number of velocities to keep
+        :param significant_figures: Precision of the cache key"""
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1 ({} given)'.format(
+                max_size))
+        self.max_size = max_size
+        self.significant_figures = significant_figures
+        self._velocities = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._velocities)
+
+    def get(self, calculate, model, diameter, sphericity, density,
+            atm_density, atm_viscosity):
+        """
+        Return the cached velocity for the given inputs, calling
+        calculate() to compute and store it on a miss.  The least recently
+        used entry is evicted when the cache is full.
+        :param calculate: Function of no arguments that returns the velocity
+        :param model: Name of the velocity model
+        :return: terminal velocity
+        """
+        key = self.make_key(model, diameter, sphericity, density,
+                            atm_density, atm_viscosity)
+        try:
+            velocity = self._velocities[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._velocities.move_to_end(key)
+            return velocity
+
+        velocity = calculate()
+        self._velocities[key] = velocity
+        if len(self._velocities) > self.max_size:
+            self._velocities.popitem(last=False)
+            self.evictions += 1
+        return velocity
+
+    def make_key(self, model, *values):
+        """Return the cache key for a model name and input values."""
+        return (model,) + tuple(
+            float('{:.{}g}'.format(x, self.significant_figures))
+            for x in values)
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        self._velocities.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Return hit, miss and eviction counts and cache size as a dict."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._velocities),
+                'max_size': self.max_size,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Functions for calculating where particles land on the ground, as east
+and north coordinates from the vent, and for accumulating the landed mass
+onto a map grid."""
+
+import numpy as np
+
+from tephrange import wind
+from tephrange.deposit import _bin_index
+from tephrange.particle import ParticleEnsemble
+
+
+class Footprint:
+    """Mass deposited on a grid of cells east (x) and north (y) of the vent.
+    x_edges and y_edges are the cell edges (km), mass[i, j] the mass in the
+    cell between x_edges[i:i+2] and y_edges[j:j+2] (kg) and loading the
+    mass per unit area (kg/km2).  Mass landing outside the grid is stored
+    in mass_outside."""
+
+    def __init__(self, x_edges, y_edges, mass, mass_outside):
+        self.x_edges = x_edges
+        self.y_edges = y_edges
+        self.mass = mass
+        self.mass_outside = mass_outside
+
+    @property
+    def x_centres(self):
+        """Centres of the cells in km east of the vent."""
+        return 0.5 * (self.x_edges[:-1] + self.x_edges[1:])
+
+    @property
+    def y_centres(self):
+        """Centres of the cells in km north of the vent."""
+        return 0.5 * (self.y_edges[:-1] + self.y_edges[1:])
+
+    @property
+    def loading(self):
+        """Mass per unit area in kg/km2."""
+        return self.mass / np.outer(np.diff(self.x_edges),
+                                    np.diff(self.y_edges))
+
+
+def landing_positions(diameter, sphericity=0.7, particle_density=2300,
+                      release_height=10000, windspeed=10, direction=270,
+                      fall_step=10, velocity_function='ganser',
+                      atmosphere=None):
+    """
+    Calculate where particles land, stepping them all down together with a
+    ParticleEnsemble.  Arguments may be scalars or arrays that broadcast to
+    a common 1-D shape.
+
+    :param diameter: Particle diameter(s) in metres
+    :param sphericity: Particle sphericity
+    :param particle_density: Particle density in kg/m3
+    :param release_height: Release height(s) in metres
+    :param windspeed: Windspeed(s) in metres per second, or a wind profile
+        given as a wind.WindProfile, a function of altitude or a tuple of
+        (altitude, speed[, direction]) arrays
+    :param direction: Direction(s) the wind blows from, in degrees
+        clockwise from north, for a constant windspeed.  Profiles carry
+        their own directions.
+    :param fall_step: Step size for fall calculation in metres
+    :param velocity_function: Function used to calculate velocity
+    :param atmosphere: Object providing get_atmos_state (default atmos)
+    :return x, y, travel_time: Arrays of the landing positions in km east
+        and north of the vent and travel times in seconds
+    """
+    ensemble = ParticleEnsemble(diameter, sphericity, particle_density)
+    n_particles = len(ensemble)
+    release_height = np.broadcast_to(release_height, n_particles)
+    profile = wind.as_profile(windspeed)
+    distance, travel_time = ensemble.calculate_distance(
+        release_height=release_height,
+        windspeed=windspeed if profile is None else profile,
+        fall_step=fall_step, velocity_function=velocity_function,
+        atmosphere=atmosphere)
+
+    if profile is None:
+        crosswind_distance = 0
+    else:
+        direction = profile.get_speed_direction(release_height)[1]
+        crosswind_distance = ensemble.current_crosswind_distance / 1000
+    x, y = to_east_north(distance, crosswind_distance, direction)
+    return x, y, travel_time
+
+
+def to_east_north(distance, crosswind_distance, direction):
+    """
+    Convert distances along and across the wind into east and north
+    coordinates.
+    :param distance: Distance(s) downwind
+    :param crosswind_distance: Distance(s) to the left of downwind
+    :param direction: Direction(s) the wind blows from, in degrees
+        clockwise from north
+    :return x, y: East and north coordinates, in the units of distance
+    """
+    radians = np.radians(direction)
+    downwind_east = -np.sin(radians)
+    downwind_north = -np.cos(radians)
+    x = distance * downwind_east - crosswind_distance * downwind_north
+    y = distance * downwind_north + crosswind_distance * downwind_east
+    return x, y
+
+
+def rasterise(x, y, mass, x_edges, y_edges):
+    """
+    Accumulate the mass of particles landing at (x, y) onto a grid.  Cell
+    indices are found for all particles together and summed with a single
+    np.bincount, so there is no loop over particles.
+
+    :param x, y: Landing positions in km east and north of the vent
+    :param mass: Mass of each particle in kg, or a single mass for all
+    :param x_edges, y_edges: Increasing cell edges in km.  As in
+        np.histogram2d, cells include their lower edges and the last
+        cells also their upper edges.
+    :return: Footprint
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                               np.asarray(y, dtype=float))
+    mass = np.broadcast_to(np.asarray(mass, dtype=float), x.shape)
+    x_edges, y_edges = [np.asarray(e, dtype=float) for e in (x_edges,
+                                                             y_edges)]
+    for edges in (x_edges, y_edges):
+        if edges.ndim != 1 or len(edges) < 2 or np.any(np.diff(edges) <= 0):
+            raise ValueError('Cell edges must be at least two increasing '
+                             'values')
+
+    # Cells are indexed on a grid padded by one cell on each side, which
+    # collects everything outside the edges
+    n_y = len(y_edges) + 1
+    index = _cell_index(x.ravel(), x_edges) * n_y
+    index += _cell_index(y.ravel(), y_edges)
+    counts = np.bincount(index, weights=mass.ravel(),
+                         minlength=(len(x_edges) + 1) * n_y)
+    counts = counts.reshape(len(x_edges) + 1, n_y)
+    inside = counts[1:-1, 1:-1]
+    return Footprint(x_edges, y_edges, inside, mass.sum() - inside.sum())
+
+
+def _cell_index(values, edges):
+    """Return the padded cell index of each value, as _bin_index, with
+    values on an edge in the cell above it and values on the last edge in
+    the last cell, as np.histogram2d counts them."""
+    index = _bin_index(values, edges)
+    # Rounding of uniform spacings can put values on an edge in the
+    # neighbouring cell
+    padded = np.concatenate([[-np.inf], edges, [np.inf]])
+    index -= values < padded[index]
+    index += values >= padded[index + 1]
+    index[values == edges[-1]] = len(edges) - 1
+    return index
+
+
+def footprint(diameter, mass, x_edges, y_edges, sphericity=0.7,
+              particle_density=2300, release_height=10000, windspeed=10,
+              direction=270, fall_step=10, velocity_function='ganser',
+              atmosphere=None):
+    """
+    Calculate the landing positions of particles and accumulate their mass
+    onto a grid.  See landing_positions and rasterise for the arguments.
+    :return: Footprint
+    """
+    x, y, _ = landing_positions(
+        diameter, sphericity=sphericity, particle_density=particle_density,
+        release_height=release_height, windspeed=windspeed,
+        direction=direction, fall_step=fall_step,
+        velocity_function=velocity_function, atmosphere=atmosphere)
+    return rasterise(x, y, mass, x_edges, y_edges)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Opt-in instrumentation of the hot paths.  Counters are only updated
+inside a Profile context, so the disabled path costs one attribute lookup
+per call:
+
+    with instrument.Profile() as profile:
+        Particle(65e-6).calculate_distance()
+    print(profile.to_json())
+"""
+
+import json
+import time
+
+# The Profile that is currently recording, if any
+ACTIVE = None
+
+
+class Profile:
+    """Counts Ganser solves and iterations and atmosphere evaluations, and
+    records the steps and wall time of each calculate_distance call, while
+    it is active as a context manager.  An optional callback is called as
+    callback(event, data) for each 'ganser', 'atmos' and
+    'calculate_distance' event."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.ganser_calls = 0
+        self.ganser_elements = 0
+        self.ganser_iterations = 0
+        self.ganser_max_iterations = 0
+        self.atmos_calls = 0
+        self.atmos_evaluations = 0
+        self.runs = []
+        self.wall_time = 0.0
+        self._previous = None
+        self._start = None
+
+    def __enter__(self):
+        global ACTIVE
+        self._previous = ACTIVE
+        ACTIVE = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global ACTIVE
+        self.wall_time += time.perf_counter() - self._start
+        ACTIVE = self._previous
+        self._previous = None
+        return False
+
+    def record_ganser(self, elements, iterations, max_iterations):
+        """Record one call of fall_velocity.ganser.
+        :param elements: Number of velocities calculated
+        :param iterations: Total iterations over all elements
+        :param max_iterations: Largest iteration count of any element"""
+        self.ganser_calls += 1
+        self.ganser_elements += elements
+        self.ganser_iterations += iterations
+        self.ganser_max_iterations = max(self.ganser_max_iterations,
+                                         max_iterations)
+        if self.callback is not None:
+            self.callback('ganser', {'elements': elements,
+                                     'iterations': iterations,
+                                     'max_iterations': max_iterations})
+
+    def record_atmos(self, elements):
+        """Record one evaluation of the atmosphere at a number of
+        altitudes."""
+        self.atmos_calls += 1
+        self.atmos_evaluations += elements
+        if self.callback is not None:
+            self.callback('atmos', {'elements': elements})
+
+    def record_run(self, **run):
+        """Record one calculate_distance call, e.g. its class, method,
+        number of steps and wall time."""
+        self.runs.append(run)
+        if self.callback is not None:
+            self.callback('calculate_distance', run)
+
+    def as_dict(self):
+        """Return the counters as a dict."""
+        return {
+            'ganser': {
+                'calls': self.ganser_calls,
+                'elements': self.ganser_elements,
+                'iterations': self.ganser_iterations,
+                'max_iterations': self.ganser_max_iterations,
+                'mean_iterations': (self.ganser_iterations /
+                                    self.ganser_elements
+                                    if self.ganser_elements else 0.0)},
+            'atmos': {
+                'calls': self.atmos_calls,
+                'evaluations': self.atmos_evaluations},
+            'calculate_distance': {
+                'calls': len(self.runs),
+                'steps': sum(run['steps'] for run in self.runs),
+                'wall_time': sum(run['wall_time'] for run in self.runs),
+                'runs': list(self.runs)},
+            'wall_time': self.wall_time}
+
+    def to_json(self, path=None, **kwargs):
+        """Return the counters as a JSON string, and write them to path if
+        given.  kwargs are passed to json.dumps."""
+        text = json.dumps(self.as_dict(), **kwargs)
+        if path is not None:
+            with open(path, 'w') as outfile:
+                outfile.write(text)
+        return text
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Functions for finding the particle size that travels a given distance,
+the inverse of Particle.calculate_distance."""
+
+import numpy as np
+
+from tephrange import density as density_models
+from tephrange.particle import ParticleEnsemble
+
+
+def max_diameter(distance, release_height=10000, windspeed=10,
+                 sphericity=0.7, density=2300, velocity_function='ganser',
+                 fall_step=10, tolerance=1e-4, bracket=(1e-7, 0.1),
+                 atmosphere=None, return_evaluations=False):
+    """
+    Return the largest diameter (m) of particle that can travel a given
+    distance (km).  Travel distance decreases monotonically with diameter,
+    so the solution is bracketed and then found by bisection on
+    log(diameter).  All targets are solved together: each forward
+    evaluation steps one ParticleEnsemble containing a particle for every
+    unconverged target.
+
+    Arguments other than the solver settings may be scalars or arrays that
+    broadcast against distance.
+
+    :param distance: Target travel distance(s) in km
+    :param release_height: Release height(s) in metres
+    :param windspeed: Windspeed(s) in metres per second
+    :param sphericity: Particle sphericity(s)
+    :param density: Particle density(s) in kg/m3, or the name of a
+        registered size-density model, e.g. 'bp2003', with default
+        parameters
+    :param velocity_function: Function used to calculate velocity
+    :param fall_step: Step size for fall calculation in metres
+    :param tolerance: Relative tolerance on diameter
+    :param bracket: Smallest and largest diameters to search (m).  Targets
+        beyond the reach of the smallest grain return nan; targets reached
+        by the largest grain return the largest.
+    :param atmosphere: Object providing get_atmos_state (default atmos)
+    :param return_evaluations: Also return the number of forward
+        evaluations
+    :return diameter[, evaluations]:
+    """
+    size_dependant = isinstance(density, str)
+    if size_dependant and density not in density_models.MODELS:
+        raise ValueError('Density model must be one of {}. {} given.'.format(
+            ', '.join(density_models.MODELS), density))
+    if bracket[0] <= 0 or bracket[1] <= bracket[0]:
+        raise ValueError('Bracket must be increasing positive diameters. '
+                         '{} given.'.format(bracket))
+
+    arrays = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in
+          (distance, release_height, windspeed, sphericity,
+           0 if size_dependant else density)])
+    shape = arrays[0].shape
+    target, release_height, windspeed, sphericity, particle_density = \
+        [x.ravel() for x in arrays]
+
+    def forward(diameter, index):
+        """Return travel distances for the targets at index."""
+        if size_dependant:
+            densities = density_models.size_dependant_density(
+                diameter, model=density)
+        else:
+            densities = particle_density[index]
+        ensemble = ParticleEnsemble(diameter, sphericity[index], densities)
+        distances, _ = ensemble.calculate_distance(
+            release_height=release_height[index],
+            windspeed=windspeed[index], fall_step=fall_step,
+            velocity_function=velocity_function, atmosphere=atmosphere)
+        return distances
+
+    # Check the bracket
+    all_targets = np.arange(target.size)
+    log_lower = np.full(target.size, np.log(bracket[0]))
+    log_upper = np.full(target.size, np.log(bracket[1]))
+    reach_smallest = forward(np.exp(log_lower), all_targets)
+    reach_largest = forward(np.exp(log_upper), all_targets)
+    evaluations = 2
+
+    result = np.full(target.size, np.nan)
+    beyond_largest = reach_largest >= target
+    result[beyond_largest] = bracket[1]
+    active = all_targets[(reach_smallest >= target) & ~beyond_largest]
+
+    # Bisect, keeping the distance at the lower bound above the target
+    log_tolerance = np.log1p(tolerance)
+    while active.size > 0:
+        log_middle = 0.5 * (log_lower[active] + log_upper[active])
+        reaches = forward(np.exp(log_middle), active) >= target[active]
+        evaluations += 1
+        log_lower[active[reaches]] = log_middle[reaches]
+        log_upper[active[~reaches]] = log_middle[~reaches]
+        converged = (log_upper[active] - log_lower[active]) <= log_tolerance
+        result[active[converged]] = np.exp(log_lower[active[converged]])
+        active = active[~converged]
+
+    result = result.reshape(shape)[()]
+    if return_evaluations:
+        return result, evaluations
+    return result
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+A compiled kernel that steps one particle to the ground, combining the
+ICAO atmosphere, the terminal velocity and the fall step in a single loop
+over scalars.  It is used by Particle.calculate_distance with
+backend='numba'.
+
+Numba is an optional dependency.  The kernel is written in plain Python
+using only the math module.  get_step_kernel imports Numba and compiles
+the kernel on first use, so importing this module does not load Numba.
+The uncompiled function, _step_kernel, gives the same results and is used
+to test the kernel without Numba.
+"""
+import math
+
+from tephrange import atmos
+from tephrange import fall_velocity
+
+# Velocity functions supported by the kernel, with their codes
+MODELS = {'ganser': 0, 'stokes': 1, 'stokes_sea_level': 2}
+
+# Constants are copied to module level, where Numba treats them as
+# compile-time constants
+_G = atmos.G
+_R = atmos.ATM_GAS_CONSTANT
+_TEMP_0KM = atmos.TEMP_0KM
+_TEMP_11KM = atmos.TEMP_11KM
+_TEMP_20KM = atmos.TEMP_20KM
+_LAPSE_BELOW_11KM = atmos.LAPSE_RATE_BELOW_11KM
+_LAPSE_ABOVE_20KM = atmos.LAPSE_RATE_ABOVE_20KM
+_PRESSURE_0KM = atmos.PRESSURE_0KM
+_PRESSURE_11KM = atmos.PRESSURE_11KM
+_PRESSURE_20KM = atmos.PRESSURE_20KM
+_GRAVITY = fall_velocity.GRAVITY
+_SEA_LEVEL_DENSITY = fall_velocity.ATM_DENSITY
+_SEA_LEVEL_VISCOSITY = fall_velocity.ATM_VISCOSITY
+
+
+def _atmos_density_viscosity(altitude):
+    """Return ICAO atmospheric density and viscosity at an altitude (m),
+    as atmos.get_atmos_state."""
+    if altitude < 11000:
+        temp = _TEMP_0KM - _LAPSE_BELOW_11KM * altitude
+        pressure = _PRESSURE_0KM * (
+            1 - _LAPSE_BELOW_11KM * altitude / _TEMP_0KM) ** (
+            _G / (_R * _LAPSE_BELOW_11KM))
+    elif altitude < 20000:
+        temp = _TEMP_11KM
+        pressure = _PRESSURE_11KM * math.exp(
+            -_G * (altitude - 11000) / (_R * _TEMP_11KM))
+    else:
+        temp = _TEMP_20KM - _LAPSE_ABOVE_20KM * (altitude - 20000)
+        pressure = _PRESSURE_20KM * (
+            1 - _LAPSE_ABOVE_20KM * (altitude - 20000) / _TEMP_20KM) ** (
+            _G / (_R * _LAPSE_ABOVE_20KM))
+
+    celsius = temp - 273.15
+    if temp > 273.15:
+        viscosity = (1.718 + 0.0049*celsius) * 1e-5
+    else:
+        viscosity = (1.718 + 0.0049*celsius - 1.2e-5*celsius**2) * 1e-5
+    return pressure / (_R * temp), viscosity
+
+
+def _stokes(diameter, density, atm_density, atm_viscosity):
+    """Stokes velocity, as fall_velocity.stokes."""
+    return ((1/18.0) * (density - atm_density) / atm_viscosity *
+            _GRAVITY * diameter**2)
+
+
+def _ganser(diameter, k1, k2, density, atm_density, atm_viscosity,
+            velocity, rtol, max_iterations):
+    """
+    Ganser velocity by the Newton iteration of fall_velocity.ganser,
+    starting from velocity, or from the Stokes/Newton estimate if velocity
+    is not positive.  Returns -1 if it does not converge.
+    """
+    scale = (4 * diameter * _GRAVITY * (density - atm_density) /
+             (3 * atm_density))
+    if velocity <= 0:
+        velocity = min(k1 * _stokes(diameter, density, atm_density,
+                                    atm_viscosity),
+                       (scale / (0.4345 * k2)) ** 0.5)
+    log_target = math.log(scale)
+    log_velocity = math.log(velocity)
+
+    for _ in range(max_iterations):
+        x = (diameter * math.exp(log_velocity) * atm_density /
+             atm_viscosity * k1 * k2)
+        drag = 24/x * (1 + 0.1118*(x**0.6567)) + 0.4345 / (1 + (3305/x))
+        slope = (24/x * (-1 + 0.1118*(0.6567 - 1)*(x**0.6567)) +
+                 0.4345 * (3305/x) / (1 + (3305/x))**2) / drag
+        residual = 2*log_velocity + math.log(drag * k2) - log_target
+        step = min(max(residual / max(2 + slope, 0.5), -2.0), 2.0)
+        log_velocity -= step
+        if abs(step) <= rtol:
+            return math.exp(log_velocity)
+    return -1.0
+
+
+def _step_kernel(diameter, k1, k2, density, release_height, travel_time,
+                 distance, crosswind_distance, fall_step, along, cross,
+                 model, record_steps, history, rtol, max_iterations):
+    """
+    Step a particle from release_height to the ground.
+    :param diameter, density: Particle diameter (m) and density (kg/m3)
+    :param k1, k2: Ganser shape factors
+    :param release_height: Release height in metres
+    :param travel_time, distance, crosswind_distance: Starting travel
+        time (s) and distances (m)
+    :param fall_step: Step size in metres
+    :param along, cross: Arrays of the along and cross-wind speeds (m/s)
+        at the top of each step
+    :param model: Velocity function code from MODELS
+    :param record_steps: Boolean array, see particle._get_record_steps.
+        Its length is one more than the number of steps, and step k
+        starts at release_height - k * fall_step.
+    :param history: 3 x n array that recorded altitude, travel time and
+        distance are written to
+    :return altitude, travel_time, distance, crosswind_distance, velocity,
+        steps, recorded: Final state, the number of steps and the number
+        of history entries written.  steps is -1 if the Ganser iteration
+        failed to converge.
+    """
+    n_steps = len(record_steps) - 1
+    altitude = release_height
+    velocity = 0.0
+    recorded = 0
+
+    for step in range(n_steps):
+        if record_steps[step]:
+            history[0, recorded] = altitude
+            history[1, recorded] = travel_time
+            history[2, recorded] = distance
+            recorded += 1
+
+        if model == 2:
+            velocity = _stokes(diameter, density, _SEA_LEVEL_DENSITY,
+                               _SEA_LEVEL_VISCOSITY)
+        else:
+            atm_density, atm_viscosity = _atmos_density_viscosity(altitude)
+            if model == 1:
+                velocity = _stokes(diameter, density, atm_density,
+                                   atm_viscosity)
+            else:
+                velocity = _ganser(diameter, k1, k2, density, atm_density,
+                                   atm_viscosity, velocity, rtol,
+                                   max_iterations)
+                if velocity < 0:
+                    return (altitude, travel_time, distance,
+                            crosswind_distance, velocity, -1, recorded)
+
+        fall_time = min(fall_step, altitude) / velocity
+        travel_time += fall_time
+        distance += along[step] * fall_time
+        crosswind_distance += cross[step] * fall_time
+        altitude = release_height - (step + 1) * fall_step
+
+    if record_steps[n_steps]:
+        history[0, recorded] = altitude
+        history[1, recorded] = travel_time
+        history[2, recorded] = distance
+        recorded += 1
+
+    return (altitude, travel_time, distance, crosswind_distance, velocity,
+            n_steps, recorded)
+
+
+_STEP_KERNEL = None
+
+
+def get_step_kernel():
+    """
+    Return the compiled step kernel, compiling it on the first call.
+    :return: Compiled kernel, or None if Numba is not installed
+    """
+    global _STEP_KERNEL, _atmos_density_viscosity, _stokes, _ganser
+    if _STEP_KERNEL is None:
+        try:
+            import numba
+        except ImportError:
+            return None
+        # The kernel calls the module-level helpers, so they are compiled
+        # in place first
+        jit = numba.njit(cache=True)
+        _atmos_density_viscosity = jit(_atmos_density_viscosity)
+        _stokes = jit(_stokes)
+        _ganser = jit(_ganser)
+        _STEP_KERNEL = jit(_step_kernel)
+    return _STEP_KERNEL
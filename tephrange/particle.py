@@ -6,14 +6,26 @@ Created on Wed Sep  2 15:00:03 2015
 
 @author: jsteven5
 """
+import math
+import time
+import warnings
+
+import numpy as np
+
 from tephrange import atmos
+from tephrange import cache
 from tephrange import density
 from tephrange import fall_velocity
+from tephrange import instrument
+from tephrange import kernel
+from tephrange import quadrature
+from tephrange import wind
 
 
 class Particle:
     """An ash particle that can calculate terminal velocity and travel
-    distance in a simple wind field."""
+    distance in a simple wind field.  The wind is either constant or
+    varies with altitude (see wind.WindProfile)."""
 
     def __init__(self, diameter, sphericity=0.7, particle_density=2300):
         """Set the particle up with internal and external parameters."""
@@ -23,12 +35,18 @@ class Particle:
         self.density = particle_density
 
         # External
-        self.altitude = []
-        self.travel_time = []
-        self.distance = []
+        self._history = _TravelHistory()
         self.current_altitude = 0
         self.current_travel_time = 0
         self.current_distance = 0
+        self.current_crosswind_distance = 0
+        self.current_velocity = None
+        self.function_evaluations = 0
+        self.steps_taken = 0
+        self.steps_rejected = 0
+        self.atmosphere = atmos
+        self.velocity_cache = None
+        self._velocity_model = None
 
     def set_size_dependant_density(self,  rho_pumice=440, rho_glass=2300):
         """Replace the default density with a size dependant function based
@@ -40,45 +58,457 @@ class Particle:
                                       rho_pumice=rho_pumice,
                                       rho_glass=rho_glass)
 
+    @property
+    def altitude(self):
+        """Read-only array of recorded altitudes in metres."""
+        return self._history.view(0)
+
+    @property
+    def travel_time(self):
+        """Read-only array of recorded travel times in seconds."""
+        return self._history.view(1)
+
+    @property
+    def distance(self):
+        """Read-only array of recorded travel distances in metres."""
+        return self._history.view(2)
+
     def _update_travel_history(self):
         """
-        Append current state to lists of past altitude, travel time and
+        Append current state to arrays of past altitude, travel time and
         distance.
         """
-        self.altitude.append(self.current_altitude)
-        self.travel_time.append(self.current_travel_time)
-        self.distance.append(self.current_distance)
+        self._history.append(self.current_altitude,
+                             self.current_travel_time,
+                             self.current_distance)
 
     def calculate_distance(self, release_height=10000, windspeed=10,
-                           fall_step=10, velocity_function='ganser'):
+                           fall_step=10, velocity_function='ganser',
+                           method='step', tolerance=1e-6, atmosphere=None,
+                           velocity_cache=None, record='full',
+                           backend='numpy'):
         """Loop through fall steps calculating travel distance with each
         step, for a given self instance.
         :param self: Particle instance
         :param release_height: Release height in metres
-        :param windspeed: Windspeed in metres per second
+        :param windspeed: Windspeed in metres per second, or a wind profile
+            given as a wind.WindProfile, a function of altitude or a tuple
+            of (altitude, speed[, direction]) arrays.  Distance is then
+            measured along the wind direction at the release height and
+            the cross-wind distance (m) is accumulated in
+            current_crosswind_distance.
         :param fall_step: Step size for fall calculation in metres
-        :param velocity_function: Function used to calculate velocity"""
+        :param velocity_function: Name of a velocity model registered with
+            fall_velocity.register_model, e.g. 'ganser' or 'stokes'
+        :param method: 'step' to move down in constant fall steps,
+            'adaptive' to adjust the step to the change in velocity
+            (fall_step is then the first step), or 'quadrature' to
+            integrate the fall time with adaptive Gauss-Kronrod quadrature
+            (fall_step is then ignored)
+        :param tolerance: Relative tolerance on travel time for the
+            adaptive and quadrature methods
+        :param atmosphere: Object providing get_atmos_state, e.g. an
+            atmos.AtmosphereTable (default is the analytic atmos module)
+        :param velocity_cache: Optional fall_velocity.VelocityCache that
+            is checked before each velocity calculation
+        :param record: Which states to append to the altitude, travel_time
+            and distance history: 'full' (every step), 'none' (final
+            values are kept in the current_* attributes only), an integer
+            N (every Nth step and the final state) or an array of
+            altitudes (the first step at or below each altitude)
+        :param backend: 'numpy' or 'numba'.  The numba backend runs the
+            step method in a compiled kernel (see kernel.py) and supports
+            the ganser, stokes and stokes_sea_level velocity functions
+            with the analytic atmosphere and no velocity cache.  If Numba
+            is not installed, a warning is issued and numpy is used.
+        :return: Travel distance in km.  The number of velocity
+            evaluations used is stored in self.function_evaluations and
+            the numbers of steps taken and rejected in self.steps_taken
+            and self.steps_rejected.  While a cache.ResultCache is active,
+            results of runs with a constant windspeed and the analytic
+            atmosphere are looked up in and stored to the cache."""
+        self.atmosphere = atmos if atmosphere is None else atmosphere
+        self.velocity_cache = velocity_cache
+        # Convert a wind profile once; the methods below reuse it
+        profile = wind.as_profile(windspeed)
+        if profile is not None:
+            windspeed = profile
+        key = None
+        if cache.ACTIVE is not None:
+            result_cache = cache.ACTIVE
+            key = self._get_cache_key(
+                release_height, windspeed, fall_step, velocity_function,
+                method, tolerance, velocity_cache, record, backend)
+            if key is not None:
+                state = result_cache.get(key)
+                if state is not None:
+                    return self._set_cache_state(state)
+                history_start = len(self._history)
+        self.current_velocity = None
+        # Read once, as a profile may be activated during the run
+        active_profile = instrument.ACTIVE
+        if active_profile is not None:
+            start = time.perf_counter()
+
+        # Resolve the velocity model once for all steps
+        self._velocity_model = fall_velocity.bind_model(
+            velocity_function, self.diameter, self.sphericity, self.density)
+        try:
+            if method == 'quadrature':
+                if profile is not None:
+                    raise ValueError('The quadrature method requires a '
+                                     'constant windspeed')
+                distance = self._integrate_distance(
+                    release_height, windspeed, velocity_function, tolerance,
+                    record)
+            elif method == 'step':
+                if self._use_kernel(backend, velocity_function):
+                    distance = self._kernel_distance(
+                        release_height, windspeed, fall_step,
+                        velocity_function, record)
+                else:
+                    distance = self._step_distance(
+                        release_height, windspeed, fall_step,
+                        velocity_function, record)
+            elif method == 'adaptive':
+                distance = self._adaptive_distance(
+                    release_height, windspeed, fall_step,
+                    velocity_function, tolerance, record)
+            else:
+                msg = 'Method must be step, adaptive or quadrature. {} given.'
+                raise ValueError(msg.format(method))
+        finally:
+            self._velocity_model = None
+
+        if active_profile is not None:
+            active_profile.record_run(
+                type='Particle', method=method, backend=backend,
+                velocity_function=velocity_function,
+                steps=self.function_evaluations,
+                steps_taken=self.steps_taken,
+                steps_rejected=self.steps_rejected,
+                wall_time=time.perf_counter() - start)
+
+        if key is not None:
+            result_cache.put(key, self._get_cache_state(distance,
+                                                        history_start))
+        return distance
+
+    def _get_cache_key(self, release_height, windspeed, fall_step,
+                       velocity_function, method, tolerance, velocity_cache,
+                       record, backend):
+        """Return the result cache key for a calculate_distance run, or
+        None if the run cannot be cached.  The key includes the starting
+        state, as a run continues from the current travel time and
+        distances."""
+        if (self.atmosphere is not atmos or velocity_cache is not None or
+                wind.as_profile(windspeed) is not None or
+                not isinstance(velocity_function, str)):
+            return None
+        return cache.make_key(
+            'Particle', self.diameter, self.sphericity, self.density,
+            release_height, windspeed, fall_step, velocity_function, method,
+            tolerance, record, backend, self.current_travel_time,
+            self.current_distance, self.current_crosswind_distance)
+
+    def _get_cache_state(self, distance, history_start):
+        """Return the results of a run, and the history it recorded, as a
+        dictionary of arrays for the result cache."""
+        state = {name: getattr(self, name) for name in _CACHED_STATE
+                 if getattr(self, name) is not None}
+        state['history'] = np.array([self._history.view(row)[history_start:]
+                                     for row in range(3)])
+        state['return_value'] = distance
+        return state
+
+    def _set_cache_state(self, state):
+        """Restore the results of a cached run and return its distance."""
+        for name in _CACHED_STATE:
+            value = state.get(name)
+            setattr(self, name, None if value is None else value.item())
+        self._history.extend(state['history'])
+        return state['return_value'].item()
+
+    def _step_distance(self, release_height, windspeed, fall_step,
+                       velocity_function, record):
+        """
+        Calculate travel distance by moving down in constant fall steps.
+        :param release_height: Release height in metres
+        :param windspeed: Windspeed in metres per second or wind profile
+        :param fall_step: Step size for fall calculation in metres
+        :param velocity_function: String name of velocity function
+        :param record: History option, see calculate_distance
+        :return: Travel distance in km
+        """
+        record_steps = _get_record_steps(record, release_height, fall_step)
+        self._history.reserve(np.count_nonzero(record_steps))
+        n_steps = len(record_steps) - 1
+
+        # Interpolate a wind profile to the top of every step in one call
+        profile = wind.as_profile(windspeed)
+        if profile is not None:
+            reference = profile.get_speed_direction(release_height)[1]
+            along, cross = profile.get_along_cross(
+                release_height - fall_step * np.arange(n_steps + 1),
+                reference)
+            along, cross = along.tolist(), cross.tolist()
 
         self.current_altitude = release_height
+        self.steps_rejected = 0
 
-        while self.current_altitude > 0:
+        for step in range(n_steps):
             # Update internal history parameters
-            self._update_travel_history()
+            if record_steps[step]:
+                self._update_travel_history()
 
             # Calculate movement in this step
+            if profile is not None:
+                windspeed = along[step]
             fall_time, horizontal_distance = self._calc_step_movement(
                 velocity_function, fall_step, windspeed)
+            if profile is not None:
+                self.current_crosswind_distance += cross[step] * fall_time
 
             # Update current parameters
-            self.current_altitude -= fall_step
+            self.current_altitude = release_height - (step + 1) * fall_step
             self.current_travel_time += fall_time
             self.current_distance += horizontal_distance
 
         # Final update of internal parameters
-        self._update_travel_history()
+        if record_steps[n_steps]:
+            self._update_travel_history()
+        self.function_evaluations = n_steps
+        self.steps_taken = n_steps
+
+        return self.current_distance / 1000.0
+
+    def _use_kernel(self, backend, velocity_function):
+        """
+        Return True if the step method should run in the compiled kernel.
+        Raises ValueError if the options are not supported by the backend.
+        """
+        if backend == 'numpy':
+            return False
+        if backend != 'numba':
+            msg = 'Backend must be numpy or numba. {} given.'
+            raise ValueError(msg.format(backend))
+        if velocity_function not in kernel.MODELS:
+            msg = ('The numba backend supports velocity functions {}. {} '
+                   'given.')
+            raise ValueError(msg.format(', '.join(kernel.MODELS),
+                                        velocity_function))
+        if self.atmosphere is not atmos or self.velocity_cache is not None:
+            raise ValueError('The numba backend requires the analytic '
+                             'atmosphere and no velocity cache')
+        if kernel.get_step_kernel() is None:
+            warnings.warn('Numba is not installed; using the numpy backend',
+                          RuntimeWarning, stacklevel=3)
+            return False
+        return True
+
+    def _kernel_distance(self, release_height, windspeed, fall_step,
+                         velocity_function, record, step_kernel=None):
+        """
+        Calculate travel distance by moving down in constant fall steps
+        in the compiled kernel.  Arguments are as _step_distance.
+        :param step_kernel: Kernel function (default the compiled kernel)
+        :return: Travel distance in km
+        """
+        if step_kernel is None:
+            step_kernel = kernel.get_step_kernel()
+        record_steps = _get_record_steps(record, release_height, fall_step)
+        n_recorded = np.count_nonzero(record_steps)
+        self._history.reserve(n_recorded)
+        history = np.empty((3, n_recorded))
+
+        profile = wind.as_profile(windspeed)
+        if profile is not None:
+            reference = profile.get_speed_direction(release_height)[1]
+            along, cross = profile.get_along_cross(
+                release_height - fall_step * np.arange(len(record_steps)),
+                reference)
+        else:
+            along = np.full(len(record_steps), float(windspeed))
+            cross = np.zeros(len(record_steps))
+
+        k1, k2 = fall_velocity._ganser_shape_factors(self.sphericity)
+        altitude, travel_time, distance, crosswind_distance, velocity, \
+            steps, recorded = step_kernel(
+                float(self.diameter), float(k1), float(k2),
+                float(self.density), float(release_height),
+                float(self.current_travel_time), float(self.current_distance),
+                float(self.current_crosswind_distance), float(fall_step),
+                along, cross,
+                kernel.MODELS[velocity_function], record_steps, history,
+                1e-10, 50)
+        if steps < 0:
+            raise RuntimeError('Ganser velocity did not converge')
+
+        self._history.extend(history[:, :recorded])
+        self.current_altitude = altitude
+        self.current_travel_time = travel_time
+        self.current_distance = distance
+        self.current_crosswind_distance = crosswind_distance
+        self.current_velocity = velocity
+        self.function_evaluations = steps
+        self.steps_taken = steps
+        self.steps_rejected = 0
+
+        return self.current_distance / 1000.0
+
+    def _integrate_distance(self, release_height, windspeed,
+                            velocity_function, tolerance, record):
+        """
+        Calculate travel distance as windspeed multiplied by the integral
+        of 1/v(z) from the ground to the release height, using adaptive
+        quadrature that is split at the atmospheric layer boundaries.
+        :param release_height: Release height in metres
+        :param windspeed: Windspeed in metres per second
+        :param velocity_function: String name of velocity function
+        :param tolerance: Relative tolerance on travel time
+        :param record: History option; anything but 'none' records the
+            release and landing states
+        :return: Travel distance in km
+        """
+        def inverse_velocity(altitude):
+            _, _, atm_density, atm_viscosity = \
+                self.atmosphere.get_atmos_state(altitude)
+            # Models that ignore the atmosphere return a scalar
+            return np.broadcast_to(
+                1 / self.get_fall_velocity(atm_density, atm_viscosity,
+                                           velocity_function),
+                np.shape(altitude))
+
+        self.current_altitude = release_height
+        if _records_history(record):
+            self._update_travel_history()
+
+        if release_height > 0:
+            fall_time, _, self.function_evaluations = \
+                quadrature.gauss_kronrod(inverse_velocity, 0, release_height,
+                                         breakpoints=atmos.BREAKPOINTS,
+                                         tolerance=tolerance)
+        else:
+            fall_time, self.function_evaluations = 0, 0
+
+        self.steps_taken = self.steps_rejected = 0
+        self.current_altitude = 0
+        self.current_travel_time += fall_time
+        self.current_distance += windspeed * fall_time
+        if _records_history(record):
+            self._update_travel_history()
+
+        return self.current_distance / 1000.0
+
+    def _adaptive_distance(self, release_height, windspeed, fall_step,
+                           velocity_function, tolerance, record):
+        """
+        Calculate travel distance with steps that grow or shrink with the
+        estimated error of integrating the fall time by the trapezium rule
+        on 1/v.  The error is estimated from the relative change in
+        terminal velocity across the step and, after the first step in
+        each layer, from the change in that rate since the previous step.
+        Steps end exactly on the atmospheric layer boundaries and on any
+        altitudes given in record.
+        :param release_height: Release height in metres
+        :param windspeed: Windspeed in metres per second or wind profile
+        :param fall_step: First step size in metres
+        :param velocity_function: String name of velocity function
+        :param tolerance: Relative tolerance on travel time
+        :param record: History option, see calculate_distance.  An
+            integer N records every Nth accepted step.
+        :return: Travel distance in km
+        """
+        interval, levels = _get_adaptive_record(record)
+        profile = wind.as_profile(windspeed)
+        if profile is not None:
+            reference = profile.get_speed_direction(release_height)[1]
+
+        def get_wind(altitude):
+            if profile is None:
+                return windspeed, 0.0
+            along, cross = profile.get_along_cross(altitude, reference)
+            return float(along), float(cross)
+
+        # Altitudes that steps must end on, highest first
+        boundaries = sorted({0.0, *atmos.BREAKPOINTS, *levels}, reverse=True)
+        boundaries = [b for b in boundaries if 0 <= b < release_height]
+
+        self.current_altitude = release_height
+        steps = rejected = 0
+        evaluations = 0
+        if release_height > 0:
+            velocity = self._velocity_at(release_height, velocity_function)
+            along, cross = get_wind(release_height)
+            evaluations = 1
+        if interval or release_height in levels:
+            self._update_travel_history()
+
+        step_size = fall_step
+        for boundary in boundaries:
+            # Velocity gradients are not continuous across boundaries
+            last_rate = last_height = None
+            while self.current_altitude > boundary:
+                altitude = self.current_altitude
+                bottom = max(altitude - step_size, boundary)
+                height = altitude - bottom
+
+                # Velocity at the bottom, started from the top
+                self.current_velocity = velocity
+                new_velocity = self._velocity_at(bottom, velocity_function)
+                evaluations += 1
+
+                # Estimate the relative error of the trapezium rule,
+                # h**2 f''/(12 f) for f = 1/v, from the relative change in
+                # velocity per metre and how fast it is changing
+                rate = (new_velocity / velocity - 1) / height
+                error = (rate * height)**2 / 12
+                if last_rate is not None:
+                    curvature = (abs(rate - last_rate) /
+                                 (0.5 * (height + last_height)))
+                    error = max(error, height**2 * curvature / 12)
+                factor = (5.0 if error == 0 else
+                          min(5.0, 0.9 * math.sqrt(tolerance / error)))
+                if error > tolerance and height > 1e-3:
+                    step_size = height * max(0.2, factor)
+                    rejected += 1
+                    continue
+
+                # Accept the step
+                new_along, new_cross = get_wind(bottom)
+                fall_time = 0.5 * height * (1/velocity + 1/new_velocity)
+                self.current_altitude = bottom
+                self.current_travel_time += fall_time
+                self.current_distance += 0.5 * height * (
+                    along/velocity + new_along/new_velocity)
+                self.current_crosswind_distance += 0.5 * height * (
+                    cross/velocity + new_cross/new_velocity)
+                velocity, along, cross = new_velocity, new_along, new_cross
+                self.current_velocity = velocity
+                last_rate, last_height = rate, height
+                steps += 1
+
+                # Resize, ignoring any shortening to reach the boundary
+                step_size = max(height * factor,
+                                step_size if bottom == boundary else 0)
+
+                if ((interval and (steps % interval == 0 or bottom == 0)) or
+                        bottom in levels):
+                    self._update_travel_history()
+
+        self.function_evaluations = evaluations
+        self.steps_taken = steps
+        self.steps_rejected = rejected
 
         return self.current_distance / 1000.0
 
+    def _velocity_at(self, altitude, velocity_function):
+        """Return the fall velocity at an altitude in metres."""
+        _, _, atm_density, atm_viscosity = self.atmosphere.get_atmos_state(
+            altitude)
+        return self.get_fall_velocity(atm_density, atm_viscosity,
+                                      velocity_function)
+
     def _calc_step_movement(self, velocity_function, fall_step,
                             windspeed):
         """
@@ -90,12 +520,13 @@ class Particle:
         :return: fall_time, horizontal distance
         """
         # Get atmosphere conditions
-        atm_density = atmos.get_density(self.current_altitude)
-        atm_viscosity = atmos.get_viscosity(self.current_altitude)
+        _, _, atm_density, atm_viscosity = self.atmosphere.get_atmos_state(
+            self.current_altitude)
 
         # Calculate terminal velocity
         v_terminal = self.get_fall_velocity(atm_density, atm_viscosity,
                                             velocity_function)
+        self.current_velocity = v_terminal
 
         # Calculate fall time and distance
         fall_time, horizontal_distance = self._calc_fall_time_and_distance(
@@ -121,37 +552,397 @@ class Particle:
 
     def get_fall_velocity(self, atm_density, atm_viscosity, velocity_function):
         """
-        Calculate fall velocity in metres per second.
+        Calculate fall velocity in metres per second.  If a velocity cache
+        has been set, scalar calculations are looked up in it first.  The
+        Ganser solver is started from the velocity of the previous step,
+        if there is one.
         :param atm_density: Atmospheric density in kg/m3
         :param atm_viscosity: Atmospheric viscosity
         :param velocity_function: Function used to calculate velocity
         :return: terminal velocity of particle
         """
-        # Get fall velocity
-        if velocity_function == 'ganser':
-            v_terminal = fall_velocity.ganser(diameter=self.diameter,
-                                              sphericity=self.sphericity,
-                                              density=self.density,
-                                              atm_density=atm_density,
-                                              atm_viscosity=atm_viscosity)
-        elif velocity_function == 'stokes':
-            v_terminal = fall_velocity.stokes(diameter=self.diameter,
-                                              density=self.density,
-                                              atm_density=atm_density,
-                                              atm_viscosity=atm_viscosity)
-        elif velocity_function == 'stokes_sea_level':
-            v_terminal = fall_velocity.stokes(
-                diameter=self.diameter, density=self.density,
-                atm_density=fall_velocity.ATM_DENSITY,
-                atm_viscosity=fall_velocity.ATM_VISCOSITY)
-        elif velocity_function == 'white':
-            v_terminal = fall_velocity.white(diameter=self.diameter,
-                                             density=self.density,
-                                             atm_density=atm_density,
-                                             atm_viscosity=atm_viscosity)
+        if (self.velocity_cache is not None and
+                isinstance(atm_density, (int, float))):
+            return self.velocity_cache.get(
+                lambda: self._calc_fall_velocity(atm_density, atm_viscosity,
+                                                 velocity_function),
+                velocity_function, self.diameter, self.sphericity,
+                self.density, atm_density, atm_viscosity)
+
+        return self._calc_fall_velocity(atm_density, atm_viscosity,
+                                        velocity_function)
+
+    def _calc_fall_velocity(self, atm_density, atm_viscosity,
+                            velocity_function):
+        """
+        Calculate fall velocity in metres per second using the named
+        velocity model, which is bound to the particle once per
+        calculate_distance call.
+        """
+        model = self._velocity_model
+        if model is None:
+            model = fall_velocity.bind_model(velocity_function,
+                                             self.diameter, self.sphericity,
+                                             self.density)
+        return model(atm_density, atm_viscosity, self.current_velocity)
+
+
+# Attributes set by calculate_distance that are stored in the result cache
+_CACHED_STATE = ('current_altitude', 'current_travel_time',
+                 'current_distance', 'current_crosswind_distance',
+                 'current_velocity', 'function_evaluations', 'steps_taken',
+                 'steps_rejected')
+_CACHED_ENSEMBLE_STATE = ('current_altitude', 'current_travel_time',
+                          'current_distance', 'current_crosswind_distance',
+                          'current_velocity')
+
+
+class _TravelHistory:
+    """Altitude, travel time and distance history stored in a preallocated
+    array that grows as needed."""
+
+    def __init__(self, capacity=0):
+        self._data = np.empty((3, capacity))
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def reserve(self, n_entries):
+        """Make room for at least n_entries more entries."""
+        required = self._size + n_entries
+        if required > self._data.shape[1]:
+            data = np.empty((3, required))
+            data[:, :self._size] = self._data[:, :self._size]
+            self._data = data
+
+    def append(self, altitude, travel_time, distance):
+        """Append a state, doubling the capacity if the array is full."""
+        if self._size == self._data.shape[1]:
+            self.reserve(max(self._size, 16))
+        self._data[:, self._size] = altitude, travel_time, distance
+        self._size += 1
+
+    def extend(self, values):
+        """Append a 3 x n array of altitudes, travel times and
+        distances."""
+        n_entries = values.shape[1]
+        self.reserve(n_entries)
+        self._data[:, self._size:self._size + n_entries] = values
+        self._size += n_entries
+
+    def view(self, row):
+        """Return a read-only view of the recorded values in a row."""
+        view = self._data[row, :self._size]
+        view.flags.writeable = False
+        return view
+
+
+def _get_n_steps(release_height, fall_step):
+    """
+    Return the number of fall steps from release_height to the ground.
+    Step k starts at release_height - k * fall_step, and the count is
+    corrected for rounding so that every step starts above the ground.
+    """
+    n_steps = max(int(np.ceil(release_height / fall_step)), 0)
+    if n_steps > 0 and release_height - (n_steps - 1) * fall_step <= 0:
+        n_steps -= 1
+    elif release_height - n_steps * fall_step > 0:
+        n_steps += 1
+    return n_steps
+
+
+def _get_record_steps(record, release_height, fall_step):
+    """
+    Return a boolean array that is True for each fall step whose starting
+    state should be recorded.  The last element is for the landing state,
+    so there are _get_n_steps + 1 elements.
+    :param record: 'full', 'none', an integer N or an array of altitudes
+    :param release_height: Release height in metres
+    :param fall_step: Step size for fall calculation in metres
+    """
+    n_steps = _get_n_steps(release_height, fall_step)
+    if isinstance(record, str):
+        if record not in ('full', 'none'):
+            msg = 'Record must be full, none, an integer or altitudes. {} given.'
+            raise ValueError(msg.format(record))
+        return np.full(n_steps + 1, record == 'full')
+
+    if isinstance(record, (int, np.integer)):
+        if record < 1:
+            raise ValueError('Record interval must be at least 1 '
+                             '({} given)'.format(record))
+        record_steps = np.zeros(n_steps + 1, dtype=bool)
+        record_steps[::record] = True
+        record_steps[-1] = True
+        return record_steps
+
+    # Record the first step at or below each requested altitude
+    levels = np.asarray(record, dtype=float)
+    steps = np.ceil((release_height - levels) / fall_step)
+    steps = np.clip(steps, 0, n_steps).astype(int)
+    record_steps = np.zeros(n_steps + 1, dtype=bool)
+    record_steps[steps[levels <= release_height]] = True
+    return record_steps
+
+
+def _get_adaptive_record(record):
+    """
+    Return the recording interval in steps (0 for none) and the list of
+    altitudes to record for the adaptive method.
+    :param record: 'full', 'none', an integer N or an array of altitudes
+    """
+    if isinstance(record, str):
+        if record not in ('full', 'none'):
+            msg = 'Record must be full, none, an integer or altitudes. {} given.'
+            raise ValueError(msg.format(record))
+        return int(record == 'full'), []
+
+    if isinstance(record, (int, np.integer)):
+        if record < 1:
+            raise ValueError('Record interval must be at least 1 '
+                             '({} given)'.format(record))
+        return int(record), []
+
+    return 0, np.asarray(record, dtype=float).ravel().tolist()
+
+
+def _records_history(record):
+    """Return True unless record is the string 'none'."""
+    return not (isinstance(record, str) and record == 'none')
+
+
+class ParticleEnsemble:
+    """A collection of ash particles, stored as arrays, that calculates
+    terminal velocities and travel distances for all particles together in
+    a simple wind field."""
+
+    def __init__(self, diameter, sphericity=0.7, particle_density=2300):
+        """Set the particles up with internal parameters.  Arguments may
+        be scalars or arrays that broadcast to a common 1-D shape."""
+        # Internal
+        self.diameter, self.sphericity, self.density = [
+            np.array(x, dtype=float) for x in np.broadcast_arrays(
+                np.atleast_1d(diameter), sphericity, particle_density)]
+
+        # External
+        n_particles = len(self.diameter)
+        self.current_altitude = np.zeros(n_particles)
+        self.current_travel_time = np.zeros(n_particles)
+        self.current_distance = np.zeros(n_particles)
+        self.current_crosswind_distance = np.zeros(n_particles)
+        self.current_velocity = None
+        self.atmosphere = atmos
+        self._velocity_model = None
+
+    def __len__(self):
+        return len(self.diameter)
+
+    def set_size_dependant_density(self, rho_pumice=440, rho_glass=2300):
+        """Replace the default density with a size dependant function based
+        on Bonadonna and Phillips (2003).  Default values correspond to
+        Askja 1875 tephra.
+        :param rho_pumice: Density of pumice in kg/m3
+        :param rho_glass: Density of solid glass in kg/m3"""
+        self.density = density.bp2003(self.diameter, rho_pumice=rho_pumice,
+                                      rho_glass=rho_glass)
+
+    def calculate_distance(self, release_height=10000, windspeed=10,
+                           fall_step=10, velocity_function='ganser',
+                           atmosphere=None, method='step'):
+        """Step all particles down through the atmosphere together,
+        calculating travel distance with each step.  Particles that reach
+        the ground are dropped from the active set.
+        :param release_height: Release height(s) in metres
+        :param windspeed: Windspeed(s) in metres per second, or a wind
+            profile given as a wind.WindProfile, a function of altitude or
+            a tuple of (altitude, speed[, direction]) arrays.  Distance is
+            then measured along the wind direction at each release height
+            and cross-wind distances (m) are stored in
+            current_crosswind_distance.  A tuple is always read as a
+            profile, so give windspeeds for each particle as an array or
+            a list.
+        :param fall_step: Step size for fall calculation in metres
+        :param velocity_function: Function used to calculate velocity
+        :param atmosphere: Object providing get_atmos_state, e.g. an
+            atmos.AtmosphereTable (default is the analytic atmos module)
+        :param method: 'step', or 'quadrature' to integrate the travel
+            time of the stokes and stokes_sea_level velocity functions
+            exactly with quadrature.stokes_travel_time, at a fixed cost
+            per particle (fall_step is then ignored).  The quadrature
+            method needs a constant windspeed and the analytic atmosphere.
+        :return distance, travel_time: Arrays of travel distance in km and
+            travel time in seconds.  While a cache.ResultCache is active,
+            results of stepped runs with a constant windspeed and the
+            analytic atmosphere are looked up in and stored to the
+            cache."""
+        self.atmosphere = atmos if atmosphere is None else atmosphere
+        profile = wind.as_profile(windspeed)
+        if profile is not None:
+            windspeed = profile
+        if method == 'quadrature':
+            return self._stokes_distance(release_height, windspeed,
+                                         velocity_function)
+        elif method != 'step':
+            msg = 'Method must be step or quadrature. {} given.'
+            raise ValueError(msg.format(method))
+        key = None
+        if cache.ACTIVE is not None:
+            result_cache = cache.ACTIVE
+            key = self._get_cache_key(release_height, windspeed, fall_step,
+                                      velocity_function)
+            if key is not None:
+                state = result_cache.get(key)
+                if state is not None:
+                    for name in _CACHED_ENSEMBLE_STATE:
+                        setattr(self, name, state.get(name))
+                    return (self.current_distance / 1000.0,
+                            self.current_travel_time)
+        active_profile = instrument.ACTIVE
+        if active_profile is not None:
+            start = time.perf_counter()
+        n_particles = len(self)
+        self.current_altitude = np.array(
+            np.broadcast_to(release_height, n_particles), dtype=float)
+        if profile is None:
+            windspeed = np.broadcast_to(windspeed, n_particles)
         else:
-            msg =('Velocity function must be ganser, stokes,'
-                  ' stokes_sea_level or white. {} given.')
-            raise ValueError(msg.format(velocity_function))
+            reference = profile.get_speed_direction(
+                self.current_altitude)[1]
+        self.current_travel_time = np.zeros(n_particles)
+        self.current_distance = np.zeros(n_particles)
+        self.current_crosswind_distance = np.zeros(n_particles)
+        self.current_velocity = None
+
+        active = np.flatnonzero(self.current_altitude > 0)
+        steps = 0
+        particle_steps = 0
+        # Resolve the velocity model once for all steps
+        self._velocity_model = fall_velocity.bind_model(
+            velocity_function, self.diameter, self.sphericity, self.density)
+        try:
+            while active.size > 0:
+                steps += 1
+                particle_steps += active.size
+                altitude = self.current_altitude[active]
+
+                # Calculate movement in this step
+                _, _, atm_density, atm_viscosity = \
+                    self.atmosphere.get_atmos_state(altitude)
+                v_terminal = self.get_fall_velocity(
+                    atm_density, atm_viscosity, velocity_function,
+                    index=active)
+                if self.current_velocity is None:
+                    self.current_velocity = np.full(n_particles, np.nan)
+                self.current_velocity[active] = v_terminal
+                fall_time = np.minimum(fall_step, altitude) / v_terminal
 
-        return v_terminal
+                # Update current parameters
+                self.current_altitude[active] = altitude - fall_step
+                self.current_travel_time[active] += fall_time
+                if profile is None:
+                    self.current_distance[active] += \
+                        windspeed[active] * fall_time
+                else:
+                    along, cross = profile.get_along_cross(altitude,
+                                                           reference[active])
+                    self.current_distance[active] += along * fall_time
+                    self.current_crosswind_distance[active] += \
+                        cross * fall_time
+
+                # Drop particles that have landed
+                active = active[self.current_altitude[active] > 0]
+        finally:
+            self._velocity_model = None
+
+        if active_profile is not None:
+            active_profile.record_run(
+                type='ParticleEnsemble', method='step',
+                velocity_function=velocity_function, steps=steps,
+                particles=n_particles, particle_steps=particle_steps,
+                wall_time=time.perf_counter() - start)
+
+        if key is not None:
+            result_cache.put(key, {name: getattr(self, name)
+                                   for name in _CACHED_ENSEMBLE_STATE
+                                   if getattr(self, name) is not None})
+        return self.current_distance / 1000.0, self.current_travel_time
+
+    def _stokes_distance(self, release_height, windspeed,
+                         velocity_function):
+        """
+        Calculate travel distance and time for Stokes velocity functions
+        by quadrature, without stepping.
+        :return distance, travel_time: See calculate_distance
+        """
+        if (self.atmosphere is not atmos or
+                wind.as_profile(windspeed) is not None):
+            raise ValueError('The quadrature method requires a constant '
+                             'windspeed and the analytic atmosphere')
+        active_profile = instrument.ACTIVE
+        if active_profile is not None:
+            start = time.perf_counter()
+        n_particles = len(self)
+        release_height = np.array(np.broadcast_to(release_height,
+                                                  n_particles), dtype=float)
+        self.current_travel_time = quadrature.stokes_travel_time(
+            self.diameter, self.density, release_height, velocity_function)
+        self.current_distance = (np.broadcast_to(windspeed, n_particles) *
+                                 self.current_travel_time)
+        self.current_altitude = np.minimum(release_height, 0)
+        self.current_crosswind_distance = np.zeros(n_particles)
+
+        # Velocity on reaching the ground
+        _, _, atm_density, atm_viscosity = atmos.get_atmos_state(0)
+        self.current_velocity = np.where(
+            release_height > 0, fall_velocity.bind_model(
+                velocity_function, self.diameter, self.sphericity,
+                self.density)(atm_density, atm_viscosity), np.nan)
+
+        if active_profile is not None:
+            active_profile.record_run(
+                type='ParticleEnsemble', method='quadrature',
+                velocity_function=velocity_function, steps=0,
+                particles=n_particles, particle_steps=0,
+                wall_time=time.perf_counter() - start)
+
+        return self.current_distance / 1000.0, self.current_travel_time
+
+    def _get_cache_key(self, release_height, windspeed, fall_step,
+                       velocity_function):
+        """Return the result cache key for a calculate_distance run, or
+        None if the run cannot be cached."""
+        if (self.atmosphere is not atmos or
+                wind.as_profile(windspeed) is not None or
+                not isinstance(velocity_function, str)):
+            return None
+        n_particles = len(self)
+        return cache.make_key(
+            'ParticleEnsemble', self.diameter, self.sphericity, self.density,
+            np.broadcast_to(release_height, n_particles),
+            np.broadcast_to(windspeed, n_particles), fall_step,
+            velocity_function)
+
+    def get_fall_velocity(self, atm_density, atm_viscosity,
+                          velocity_function, index=None):
+        """
+        Calculate fall velocities in metres per second.  The Ganser solver
+        is started from the velocities of the previous step, if there are
+        any.
+        :param atm_density: Atmospheric density in kg/m3
+        :param atm_viscosity: Atmospheric viscosity
+        :param velocity_function: Function used to calculate velocity
+        :param index: Indices of the particles to calculate (default all)
+        :return: terminal velocity of particles
+        """
+        model = self._velocity_model
+        if model is None:
+            model = fall_velocity.bind_model(velocity_function,
+                                             self.diameter, self.sphericity,
+                                             self.density)
+        initial_velocity = None
+        if self.current_velocity is not None:
+            initial_velocity = (self.current_velocity if index is None
+                                else self.current_velocity[index])
+        return model(atm_density, atm_viscosity, initial_velocity,
+                     index=index)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Adaptive Gauss-Kronrod quadrature for integrating fall times through the
+atmosphere, and fixed-node Gauss-Legendre quadrature of Stokes fall
+times."""
+
+import numpy as np
+
+from tephrange import atmos
+
+# 7-point Gauss / 15-point Kronrod nodes and weights on [-1, 1]
+KRONROD_NODES = np.array([
+    -0.991455371120812639206854697526329, -0.949107912342758524526189684047851,
+    -0.864864423359769072789712788640926, -0.741531185599394439863864773280788,
+    -0.586087235467691130294144845693013, -0.405845151377397166906606412076961,
+    -0.207784955007898467600689403773245, 0.000000000000000000000000000000000,
+    0.207784955007898467600689403773245, 0.405845151377397166906606412076961,
+    0.586087235467691130294144845693013, 0.741531185599394439863864773280788,
+    0.864864423359769072789712788640926, 0.949107912342758524526189684047851,
+    0.991455371120812639206854697526329])
+KRONROD_WEIGHTS = np.array([
+    0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+    0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+    0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+    0.204432940075298892414161999234649, 0.209482141084727828012999174891714,
+    0.204432940075298892414161999234649, 0.190350578064785409913256402421014,
+    0.169004726639267902826583426598550, 0.140653259715525918745189590510238,
+    0.104790010322250183839876322541518, 0.063092092629978553290700663189204,
+    0.022935322010529224963732008058970])
+GAUSS_WEIGHTS = np.array([
+    0, 0.129484966168869693270611432679082,
+    0, 0.279705391489276667901467771423780,
+    0, 0.381830050505118944950369775488975,
+    0, 0.417959183673469387755102040816327,
+    0, 0.381830050505118944950369775488975,
+    0, 0.279705391489276667901467771423780,
+    0, 0.129484966168869693270611432679082,
+    0])
+
+# 8-point Gauss-Legendre nodes and weights on [-1, 1], which integrate the
+# Stokes slowness over each smooth layer of the atmosphere to machine
+# precision
+LEGENDRE_NODES, LEGENDRE_WEIGHTS = np.polynomial.legendre.leggauss(8)
+
+# Velocity functions supported by stokes_travel_time
+STOKES_MODELS = ('stokes', 'stokes_sea_level')
+
+
+def gauss_kronrod(func, a, b, breakpoints=(), tolerance=1e-6,
+                  max_evaluations=10000):
+    """
+    Integrate func from a to b using globally adaptive 7/15-point
+    Gauss-Kronrod quadrature.  The interval is first split at any
+    breakpoints (e.g. where the integrand has a kink) that lie between a
+    and b.  The panel with the largest error estimate is then bisected
+    until the total error estimate is below tolerance relative to the
+    integral.  func must accept and return Numpy arrays; each call
+    evaluates all nodes of one or more panels at once.
+    :param func: Vectorised function of one variable
+    :param a: Lower limit of integration
+    :param b: Upper limit of integration
+    :param breakpoints: Points at which to split the initial interval
+    :param tolerance: Relative tolerance on the integral
+    :param max_evaluations: Maximum number of function evaluations
+    :return integral, error, n_evaluations: Integral, absolute error
+        estimate and number of function evaluations
+    """
+    edges = [a] + sorted(x for x in breakpoints if a < x < b) + [b]
+    lower = np.array(edges[:-1], dtype=float)
+    upper = np.array(edges[1:], dtype=float)
+    values, errors = _integrate_panels(func, lower, upper)
+    n_evaluations = KRONROD_NODES.size * lower.size
+
+    while errors.sum() > tolerance * abs(values.sum()):
+        if n_evaluations >= max_evaluations:
+            raise RuntimeError(
+                'Quadrature did not reach tolerance {} within {} function '
+                'evaluations'.format(tolerance, max_evaluations))
+
+        # Bisect the worst panel
+        worst = np.argmax(errors)
+        midpoint = 0.5 * (lower[worst] + upper[worst])
+        new_lower = np.array([lower[worst], midpoint])
+        new_upper = np.array([midpoint, upper[worst]])
+        new_values, new_errors = _integrate_panels(func, new_lower,
+                                                   new_upper)
+        n_evaluations += KRONROD_NODES.size * 2
+
+        lower = np.concatenate([np.delete(lower, worst), new_lower])
+        upper = np.concatenate([np.delete(upper, worst), new_upper])
+        values = np.concatenate([np.delete(values, worst), new_values])
+        errors = np.concatenate([np.delete(errors, worst), new_errors])
+
+    return values.sum(), errors.sum(), n_evaluations
+
+
+def _integrate_panels(func, lower, upper):
+    """
+    Return Kronrod estimates and error estimates of the integral of func
+    over each panel, evaluating all nodes in a single call.
+    """
+    half_width = 0.5 * (upper - lower)
+    centre = 0.5 * (upper + lower)
+    nodes = centre[:, None] + half_width[:, None] * KRONROD_NODES
+    f = func(nodes)
+    kronrod = half_width * (f @ KRONROD_WEIGHTS)
+    gauss = half_width * (f @ GAUSS_WEIGHTS)
+    return kronrod, np.abs(kronrod - gauss)
+
+
+def stokes_travel_time(diameter, density=2300, release_height=10000,
+                       velocity_function='stokes'):
+    """
+    Return the time (s) for particles to fall from release_height to the
+    ground at their Stokes velocity in the ICAO standard atmosphere.
+
+    The travel time is 18 / (g d**2) times the integral of
+    viscosity / (density - atm_density) over altitude.  The integrand is
+    smooth between the freezing level and the layer boundaries, so the
+    integral is split there and each layer is integrated with fixed
+    8-point Gauss-Legendre quadrature, which is exact to rounding error.
+    Layers below a release height are integrated at the same nodes for
+    all particles, so the cost per particle is constant.
+
+    :param diameter: Particle diameter(s) in metres
+    :param density: Particle density(s) in kg/m3
+    :param release_height: Release height(s) in metres
+    :param velocity_function: 'stokes', or 'stokes_sea_level' for the
+        sea-level velocity at all altitudes
+    :return: Travel time(s) in seconds, with the broadcast shape of the
+        arguments
+    """
+    if velocity_function not in STOKES_MODELS:
+        raise ValueError('Velocity function must be one of {}. {} '
+                         'given.'.format(', '.join(STOKES_MODELS),
+                                         velocity_function))
+    diameter, density, release_height = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (diameter, density,
+                                                release_height)])
+    height = np.maximum(release_height, 0)
+
+    if velocity_function == 'stokes_sea_level':
+        integral = height * atmos.ATM_VISCOSITY / (density -
+                                                   atmos.ATM_DENSITY)
+    else:
+        integral = np.zeros(height.shape)
+        edges = (0.0,) + atmos.BREAKPOINTS + (np.inf,)
+        for lower, upper in zip(edges[:-1], edges[1:]):
+            # Layers wholly below the release height share their nodes
+            full = height >= upper
+            if np.any(full):
+                integral[full] += _stokes_layer_integral(
+                    lower, upper, density[full])
+            part = (height > lower) & ~full
+            if np.any(part):
+                integral[part] += _stokes_layer_integral(
+                    lower, height[part], density[part])
+
+    travel_time = 18 * integral / (atmos.G * diameter**2)
+    return travel_time[()]
+
+
+def _stokes_layer_integral(lower, upper, density):
+    """
+    Return the integral of viscosity / (density - atm_density) from lower
+    to upper, which may be a scalar or an array like density.
+    """
+    upper = np.asarray(upper, dtype=float)
+    half_width = 0.5 * (upper - lower)
+    altitude = lower + np.multiply.outer(half_width, LEGENDRE_NODES + 1)
+    _, _, atm_density, atm_viscosity = atmos.get_atmos_state(altitude)
+    integrand = atm_viscosity / (density[:, np.newaxis] - atm_density)
+    return half_width * (integrand @ LEGENDRE_WEIGHTS)
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+A local HTTP/JSON service for fall velocity and travel distance queries.
+
+Requests that arrive within a short window are coalesced into a single
+vectorised calculation, so many tools making small, concurrent requests
+share one process and one batch.  Endpoints are:
+
+    POST /velocity  {"diameter": ..., "sphericity": ..., "density": ...,
+                     "altitude": ..., "velocity_function": ...}
+    POST /distance  {"diameter": ..., "sphericity": ..., "density": ...,
+                     "release_height": ..., "windspeed": ...,
+                     "fall_step": ..., "velocity_function": ...}
+    GET /metrics
+
+Values may be numbers or lists that broadcast together, and density may
+be the name of a size-density model.  Sphericities must be in (0, 1],
+densities positive and altitudes and release heights between 0 and
+MAX_ALTITUDE.  The velocity_function may be any registered model except
+those in UNSUPPORTED_MODELS.  Velocities are in m/s, distances in km and
+travel times in s; results that are not finite are returned as null.
+The service uses only the standard library:
+
+    python -m tephrange.service --port 8765 --max-latency 0.005
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+from tephrange import atmos
+from tephrange import density as density_models
+from tephrange import fall_velocity
+from tephrange.particle import ParticleEnsemble
+
+# Request fields, their defaults and the fields that split batches
+ENDPOINTS = {
+    '/velocity': dict(columns={'diameter': None, 'sphericity': 0.7,
+                               'density': 2300, 'altitude': 0},
+                      settings={'velocity_function': 'ganser'}),
+    '/distance': dict(columns={'diameter': None, 'sphericity': 0.7,
+                               'density': 2300, 'release_height': 10000,
+                               'windspeed': 10},
+                      settings={'fall_step': 10,
+                                'velocity_function': 'ganser'}),
+}
+
+# Highest altitude and release height (m) accepted
+MAX_ALTITUDE = 50000
+
+# Registered velocity models that are not implemented and always raise
+UNSUPPORTED_MODELS = ('white',)
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class Metrics:
+    """Counts of requests, particles and batches handled by a Service."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.items = 0
+        self.batches = 0
+        self.errors = 0
+        self.largest_batch = 0
+        self.latency = 0.0
+
+    def record_batch(self, n_requests, n_items, latency):
+        """Record a calculated batch and the total time its requests
+        waited for results."""
+        self.requests += n_requests
+        self.items += n_items
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, n_items)
+        self.latency += latency
+
+    def to_dict(self):
+        """Return the counts and the derived rates."""
+        uptime = time.monotonic() - self.started
+        return {'uptime': uptime,
+                'requests': self.requests,
+                'items': self.items,
+                'batches': self.batches,
+                'errors': self.errors,
+                'largest_batch': self.largest_batch,
+                'mean_batch_size': self.items / max(self.batches, 1),
+                'requests_per_second': self.requests / uptime,
+                'items_per_second': self.items / uptime,
+                'mean_latency': self.latency / max(self.requests, 1)}
+
+
+class Service:
+    """Coalesces concurrent requests into vectorised batches.  A batch is
+    calculated when it holds max_batch_size particles or when its first
+    request has waited max_latency seconds.  Requests with different
+    settings, e.g. velocity_function, are batched separately."""
+
+    def __init__(self, max_batch_size=10000, max_latency=0.005):
+        """:param max_batch_size: Number of particles that triggers a batch
+        :param max_latency: Longest wait for a batch to fill, in seconds"""
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = Metrics()
+        self._pending = {}
+        self._pending_items = {}
+        self._timers = {}
+
+    async def handle(self, method, path, body):
+        """Return the status code and JSON payload for a request."""
+        if path == '/metrics':
+            if method != 'GET':
+                return 405, {'error': 'Use GET for /metrics'}
+            return 200, self.metrics.to_dict()
+        if path not in ENDPOINTS:
+            return 404, {'error': 'Unknown path {}'.format(path)}
+        if method != 'POST':
+            return 405, {'error': 'Use POST for {}'.format(path)}
+        try:
+            columns, settings, scalar = _parse_request(path, body)
+        except ValueError as exc:
+            self.metrics.errors += 1
+            return 400, {'error': str(exc)}
+        try:
+            results = await self.submit(path, settings, columns)
+        except Exception as exc:
+            self.metrics.errors += 1
+            return 500, {'error': str(exc)}
+        return 200, {name: _to_json(values[0] if scalar else values)
+                     for name, values in results.items()}
+
+    async def submit(self, path, settings, columns):
+        """Add a request's columns to the pending batch for path and
+        settings and wait for its results."""
+        loop = asyncio.get_running_loop()
+        group = (path,) + tuple(sorted(settings.items()))
+        future = loop.create_future()
+        self._pending.setdefault(group, []).append(
+            (columns, future, time.monotonic()))
+        n_items = self._pending_items.get(group, 0) + len(columns['diameter'])
+        self._pending_items[group] = n_items
+        if n_items >= self.max_batch_size:
+            self._flush(group)
+        elif group not in self._timers:
+            self._timers[group] = loop.call_later(self.max_latency,
+                                                  self._flush, group)
+        return await future
+
+    def _flush(self, group):
+        """Start calculating the pending batch for group."""
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(group, [])
+        self._pending_items.pop(group, None)
+        if batch:
+            asyncio.ensure_future(self._calculate(group, batch))
+
+    async def _calculate(self, group, batch):
+        """Calculate a batch in a worker thread and share out the
+        results."""
+        path, settings = group[0], dict(group[1:])
+        names = list(ENDPOINTS[path]['columns'])
+        columns = {name: np.concatenate([c[name] for c, _, _ in batch])
+                   for name in names}
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                None, _CALCULATIONS[path], columns, settings)
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        now = time.monotonic()
+        self.metrics.record_batch(len(batch), len(columns['diameter']),
+                                  sum(now - start for _, _, start in batch))
+        start = 0
+        for request_columns, future, _ in batch:
+            stop = start + len(request_columns['diameter'])
+            if not future.done():
+                future.set_result({name: values[start:stop]
+                                   for name, values in results.items()})
+            start = stop
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_socket=None):
+        """Serve HTTP requests on a TCP port or a Unix socket until
+        cancelled."""
+        if unix_socket is None:
+            server = await asyncio.start_server(self._serve_connection,
+                                                host, port)
+        else:
+            server = await asyncio.start_unix_server(
+                self._serve_connection, unix_socket)
+        async with server:
+            await server.serve_forever()
+
+    async def _serve_connection(self, reader, writer):
+        """Answer HTTP/1.1 requests on a connection until it is closed."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path = request_line.decode('latin-1').split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.handle(method, path, body)
+                content = json.dumps(payload, allow_nan=False).encode()
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: '
+                             'application/json\r\nContent-Length: {}\r\n'
+                             '\r\n'.format(status, _REASONS[status],
+                                           len(content)).encode() + content)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def _parse_request(path, body):
+    """
+    Return the columns of a request as 1-D arrays of equal length, its
+    batch settings and whether all columns were scalars.
+    :raises ValueError: If the request is not valid
+    """
+    try:
+        request = json.loads(body or b'{}')
+    except json.JSONDecodeError as exc:
+        raise ValueError('Invalid JSON: {}'.format(exc))
+    if not isinstance(request, dict):
+        raise ValueError('Request must be a JSON object')
+    spec = ENDPOINTS[path]
+    unknown = set(request) - set(spec['columns']) - set(spec['settings'])
+    if unknown:
+        raise ValueError('Unknown fields: {}'.format(', '.join(
+            sorted(unknown))))
+    if 'diameter' not in request:
+        raise ValueError('diameter is required')
+
+    settings = {name: request.get(name, default)
+                for name, default in spec['settings'].items()}
+    supported = [name for name in fall_velocity.MODELS
+                 if name not in UNSUPPORTED_MODELS]
+    if (not isinstance(settings['velocity_function'], str) or
+            settings['velocity_function'] not in supported):
+        raise ValueError('velocity_function must be one of {}'.format(
+            ', '.join(supported)))
+    if 'fall_step' in settings:
+        settings['fall_step'] = _positive_number('fall_step',
+                                                 settings['fall_step'])
+
+    values = {name: request.get(name, default)
+              for name, default in spec['columns'].items()}
+    density = values['density']
+    if isinstance(density, str) and density not in density_models.MODELS:
+        raise ValueError('density must be a number or one of {}'.format(
+            ', '.join(density_models.MODELS)))
+    scalar = all(np.ndim(v) == 0 for v in values.values())
+    try:
+        arrays = {name: np.asarray(v, dtype=float)
+                  for name, v in values.items()
+                  if not (name == 'density' and isinstance(v, str))}
+        arrays = dict(zip(arrays, np.broadcast_arrays(
+            *[np.atleast_1d(a) for a in arrays.values()])))
+    except (TypeError, ValueError) as exc:
+        raise ValueError('Fields must be numbers or lists of numbers that '
+                         'broadcast together: {}'.format(exc))
+    if any(a.ndim != 1 for a in arrays.values()):
+        raise ValueError('Fields must be numbers or flat lists')
+    if not all(np.all(np.isfinite(a)) for a in arrays.values()):
+        raise ValueError('Fields must be finite numbers')
+    if np.any(arrays['diameter'] <= 0):
+        raise ValueError('diameter must be positive')
+    if np.any(arrays['sphericity'] <= 0) or np.any(arrays['sphericity'] > 1):
+        raise ValueError('sphericity must be greater than 0 and at most 1')
+    if isinstance(density, str):
+        arrays['density'] = density_models.size_dependant_density(
+            arrays['diameter'], model=density)
+    elif np.any(arrays['density'] <= 0):
+        raise ValueError('density must be positive')
+    for name in ('altitude', 'release_height'):
+        if name in arrays and (np.any(arrays[name] < 0) or
+                               np.any(arrays[name] > MAX_ALTITUDE)):
+            raise ValueError('{} must be between 0 and {} m'.format(
+                name, MAX_ALTITUDE))
+    columns = {name: np.array(arrays[name]) for name in spec['columns']}
+    return columns, settings, scalar
+
+
+def _to_json(values):
+    """Return values as a number or list, with non-finite values as None,
+    which is written as null."""
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def _positive_number(name, value):
+    """Return value as a float, or raise ValueError if it is not a
+    positive number."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = -1
+    if not value > 0:
+        raise ValueError('{} must be a positive number'.format(name))
+    return value
+
+
+def _calculate_velocity(columns, settings):
+    """Return fall velocities (m/s) for a batch."""
+    velocity = fall_velocity.bind_model(
+        settings['velocity_function'], columns['diameter'],
+        columns['sphericity'], columns['density'])
+    _, _, atm_density, atm_viscosity = atmos.get_atmos_state(
+        columns['altitude'])
+    return {'velocity': velocity(atm_density, atm_viscosity)}
+
+
+def _calculate_distance(columns, settings):
+    """Return travel distances (km) and times (s) for a batch."""
+    ensemble = ParticleEnsemble(columns['diameter'], columns['sphericity'],
+                                columns['density'])
+    distance, travel_time = ensemble.calculate_distance(
+        release_height=columns['release_height'],
+        windspeed=columns['windspeed'], fall_step=settings['fall_step'],
+        velocity_function=settings['velocity_function'])
+    return {'distance': distance, 'travel_time': travel_time}
+
+
+_CALCULATIONS = {'/velocity': _calculate_velocity,
+                 '/distance': _calculate_distance}
+
+
+def main(argv=None):
+    """Run the service until interrupted."""
+    parser = argparse.ArgumentParser(
+        prog='tephrange-service',
+        description='Serve fall velocity and travel distance queries.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Host to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Port to listen on (default 8765)')
+    parser.add_argument('--unix-socket',
+                        help='Listen on a Unix socket at this path instead')
+    parser.add_argument('--max-batch-size', type=int, default=10000,
+                        help='Particles that trigger a batch (default 10000)')
+    parser.add_argument('--max-latency', type=float, default=0.005,
+                        help='Longest wait for a batch to fill in seconds '
+                        '(default 0.005)')
+    args = parser.parse_args(argv)
+
+    service = Service(max_batch_size=args.max_batch_size,
+                      max_latency=args.max_latency)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed tables of travel time for instant distance queries.
+
+In a constant wind the travel time of a particle does not depend on the
+windspeed, so a table of travel time over diameter, sphericity, density
+and release height answers every distance query as windspeed times travel
+time.  Tables are built once, saved to an uncompressed .npz file and
+memory-mapped when loaded, so many processes can share one table and
+queries need no trajectory integration.
+"""
+import itertools
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+import tephrange
+from tephrange import atmos
+from tephrange import deposit
+
+AXES = ('diameter', 'sphericity', 'density', 'release_height')
+
+
+class TravelTimeTable:
+    """Travel time to the ground on a grid of diameter (m), sphericity,
+    density (kg/m3) and release height (m).  The table holds the log of
+    the mean slowness (travel time / release height), which is
+    interpolated multilinearly in coordinates where it is close to linear
+    (see _to_grid).  The relative error in travel time, estimated at the
+    centres of a sample of grid cells when the table is built, is stored
+    in the metadata and in max_relative_error (about 3e-3 for the default
+    grid)."""
+
+    def __init__(self, axes, log_slowness, metadata):
+        """Set the table up from its arrays, as returned by build or load.
+        :param axes: Dictionary of the grid values for each name in AXES
+        :param log_slowness: Array of the log of the mean slowness (s/m),
+            with a dimension for each axis
+        :param metadata: Dictionary of build settings and accuracy"""
+        self.axes = {name: np.asarray(axes[name], dtype=float)
+                     for name in AXES}
+        self.log_slowness = log_slowness
+        self.metadata = metadata
+        self._grid = [_to_grid(name, self.axes[name]) for name in AXES]
+
+    @property
+    def max_relative_error(self):
+        """Largest relative error in travel time found by the checks."""
+        return self.metadata['max_relative_error']
+
+    @classmethod
+    def build(cls, diameter=np.logspace(-6, -2, 81),
+              sphericity=np.linspace(0.3, 1, 29),
+              density=np.linspace(300, 3000, 28),
+              release_height=np.linspace(500, 40000, 80),
+              velocity_function='ganser', fall_step=500, n_checks=1000,
+              atmosphere=None):
+        """
+        Calculate travel times over a grid of particle properties and
+        release heights.  For each particle, the time is integrated up
+        from the ground once with Simpson's rule, giving every release
+        height at the same time.
+
+        :param diameter, sphericity, density, release_height: Increasing
+            grid values for each axis, with at least two of each.
+            Diameters, densities and release heights must be positive
+            and sphericities no more than 1.
+        :param velocity_function: Name of a registered velocity model
+        :param fall_step: Spacing of the integration grid in metres
+        :param n_checks: Number of grid cells whose centres are compared
+            with a direct calculation to estimate the accuracy
+        :param atmosphere: Object providing get_atmos_state (default atmos)
+        :return: TravelTimeTable
+        """
+        atmosphere = atmos if atmosphere is None else atmosphere
+        axes = dict(zip(AXES, [np.asarray(x, dtype=float) for x in (
+            diameter, sphericity, density, release_height)]))
+        for name in AXES:
+            values = axes[name]
+            if (values.ndim != 1 or len(values) < 2 or
+                    np.any(np.diff(values) <= 0)):
+                raise ValueError('{} must be at least two increasing '
+                                 'values'.format(name))
+        if (axes['diameter'][0] <= 0 or axes['density'][0] <= 0 or
+                axes['release_height'][0] <= 0):
+            raise ValueError('Diameters, densities and release heights '
+                             'must be positive')
+        if axes['sphericity'][0] <= 0 or axes['sphericity'][-1] > 1:
+            raise ValueError('Sphericities must be between 0 and 1')
+
+        settings = dict(velocity_function=velocity_function,
+                        fall_step=fall_step, atmosphere=atmosphere)
+        particles = np.meshgrid(*[axes[name] for name in AXES[:3]],
+                                indexing='ij')
+        log_slowness = _log_slowness(
+            *[x.ravel() for x in particles],
+            release_height=axes['release_height'], **settings)
+        shape = [len(axes[name]) for name in AXES]
+        log_slowness = log_slowness.T.reshape(shape)
+
+        metadata = dict(tephrange_version=tephrange.__version__,
+                        velocity_function=velocity_function,
+                        fall_step=float(fall_step),
+                        atmosphere=getattr(atmosphere, '__name__',
+                                           type(atmosphere).__name__))
+        table = cls(axes, log_slowness, metadata)
+        metadata.update(table._check(n_checks, settings))
+        return table
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a table saved with save.  The table array is memory-mapped
+        unless mmap is False, so loading is instant and the pages are
+        shared between processes.
+        """
+        with np.load(path) as archive:
+            axes = {name: archive[name] for name in AXES}
+            metadata = json.loads(str(archive['metadata']))
+            log_slowness = None if mmap else archive['log_slowness']
+        if mmap:
+            log_slowness = _memmap_member(path, 'log_slowness.npy')
+        return cls(axes, log_slowness, metadata)
+
+    def save(self, path):
+        """Save the table to an uncompressed .npz file."""
+        np.savez(path, log_slowness=self.log_slowness,
+                 metadata=np.array(json.dumps(self.metadata)), **self.axes)
+
+    def travel_time(self, diameter, sphericity=0.7, density=2300,
+                    release_height=10000):
+        """
+        Return the travel time (s) for particles of given diameter (m),
+        sphericity and density (kg/m3) released at release_height (m).
+        Arguments may be scalars or arrays that broadcast together.
+        :raises ValueError: If any value lies outside the table
+        """
+        values = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (
+            diameter, sphericity, density, release_height)])
+        for name, value in zip(AXES, values):
+            self._check_range(name, value)
+
+        # Multilinear interpolation from the 16 corners of each cell
+        lower, fraction = [], []
+        for grid, name, value in zip(self._grid, AXES, values):
+            value = _to_grid(name, value)
+            index = np.clip(np.searchsorted(grid, value, side='right') - 1,
+                            0, len(grid) - 2)
+            lower.append(index)
+            fraction.append((value - grid[index]) /
+                            (grid[index + 1] - grid[index]))
+        log_slowness = 0
+        for corner in itertools.product((0, 1), repeat=len(AXES)):
+            weight = 1
+            for upper, f in zip(corner, fraction):
+                weight = weight * (f if upper else 1 - f)
+            index = tuple(i + upper for i, upper in zip(lower, corner))
+            log_slowness = log_slowness + weight * self.log_slowness[index]
+
+        return (values[3] * np.exp(log_slowness))[()]
+
+    def distance(self, diameter, sphericity=0.7, density=2300,
+                 release_height=10000, windspeed=10):
+        """
+        Return the travel distance (km) in a constant windspeed (m/s).  See
+        travel_time for the other arguments.
+        """
+        return (np.asarray(windspeed) * self.travel_time(
+            diameter, sphericity, density, release_height) / 1000)[()]
+
+    def _check_range(self, name, value):
+        """Raise ValueError if any value lies outside the table."""
+        axis = self.axes[name]
+        if np.min(value) < axis[0] or np.max(value) > axis[-1]:
+            raise ValueError('{} outside TravelTimeTable range ({} to '
+                             '{})'.format(name, axis[0], axis[-1]))
+
+    def _check(self, n_checks, settings):
+        """Return the largest and root-mean-square relative errors in
+        travel time at the centres of n_checks randomly chosen cells."""
+        rng = np.random.default_rng(0)
+        centres = []
+        for grid, name in zip(self._grid, AXES):
+            cell = rng.integers(len(grid) - 1, size=n_checks)
+            centre = 0.5 * (grid[cell] + grid[cell + 1])
+            centres.append(_from_grid(name, centre))
+        exact = _paired_log_slowness(*centres, **settings)
+        error = self.travel_time(*centres) / (
+            centres[3] * np.exp(exact)) - 1
+        return dict(n_checks=n_checks,
+                    max_relative_error=float(np.max(np.abs(error))),
+                    rms_relative_error=float(np.sqrt(np.mean(error**2))))
+
+
+def _to_grid(name, value):
+    """
+    Return values in the coordinates used for interpolation.  Log slowness
+    is close to linear in log(diameter) and log(density), and in the
+    exponent of Ganser's shape factor k2, which has an infinite slope in
+    sphericity at 1.
+    """
+    if name in ('diameter', 'density'):
+        return np.log(value)
+    if name == 'sphericity':
+        return -(-np.log10(value)) ** 0.5743
+    return value
+
+
+def _from_grid(name, value):
+    """Return values from the coordinates used for interpolation."""
+    if name in ('diameter', 'density'):
+        return np.exp(value)
+    if name == 'sphericity':
+        return 10 ** -((-value) ** (1 / 0.5743))
+    return value
+
+
+def _log_slowness(diameter, sphericity, density, release_height,
+                  velocity_function, fall_step, atmosphere):
+    """
+    Return the log of the mean slowness (s/m) of each particle (columns)
+    from each release height (rows).
+    """
+    levels = deposit._get_levels(release_height.max(), fall_step,
+                                 extra=release_height)
+    altitude, atm_density, atm_viscosity = deposit._get_altitude_grid(
+        levels, atmosphere)
+    interval, hermite = deposit._get_hermite(levels, release_height)
+    along = np.ones(altitude.shape)
+
+    chunk_size = max(1, 2000000 // len(release_height))
+    result = np.empty((len(release_height), len(diameter)))
+    for start in range(0, len(diameter), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        result[:, chunk] = deposit._release_distances(
+            diameter[chunk], sphericity[chunk], density[chunk],
+            velocity_function, altitude, atm_density, atm_viscosity, along,
+            interval, hermite)
+    return np.log(result / release_height[:, np.newaxis])
+
+
+def _paired_log_slowness(diameter, sphericity, density, release_height,
+                         velocity_function, fall_step, atmosphere):
+    """
+    Return the log of the mean slowness (s/m) of each particle from its
+    own release height.  The release heights are grid levels, so the
+    travel times need no interpolation.
+    """
+    levels = deposit._get_levels(release_height.max(), fall_step,
+                                 extra=release_height)
+    altitude, atm_density, atm_viscosity = deposit._get_altitude_grid(
+        levels, atmosphere)
+    travel_time, _ = deposit._get_drift(
+        diameter, sphericity, density, velocity_function, altitude,
+        atm_density, atm_viscosity, np.ones(altitude.shape))
+    level = np.searchsorted(levels, release_height)
+    travel_time = travel_time[level, np.arange(len(diameter))]
+    return np.log(travel_time / release_height)
+
+
+def _memmap_member(path, name):
+    """Memory-map an array stored without compression in a .npz file."""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError('{} is compressed and cannot be memory-mapped'
+                         .format(name))
+    with open(path, 'rb') as infile:
+        # Skip the zip local file header to the start of the .npy data
+        infile.seek(info.header_offset)
+        header = infile.read(30)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        infile.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(infile)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(infile)
+        else:
+            header = np.lib.format.read_array_header_2_0(infile)
+        shape, fortran_order, dtype = header
+        offset = infile.tell()
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
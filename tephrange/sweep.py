@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Functions for calculating travel distances over a grid of particle and
+release parameters, split across processes."""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from tephrange import cache
+from tephrange import density as density_models
+from tephrange import fall_velocity
+from tephrange import quadrature
+from tephrange.particle import ParticleEnsemble
+
+DIMS = ('velocity_function', 'diameter', 'sphericity', 'density',
+        'release_height', 'windspeed')
+
+
+class SweepResult:
+    """Travel distance (km) and travel time (s) on a labelled grid.  dims
+    gives the name of each array axis and coords the values along it."""
+
+    def __init__(self, dims, coords, distance, travel_time):
+        self.dims = dims
+        self.coords = coords
+        self.distance = distance
+        self.travel_time = travel_time
+
+    @property
+    def shape(self):
+        return self.distance.shape
+
+    def __repr__(self):
+        sizes = ', '.join('{}: {}'.format(dim, len(self.coords[dim]))
+                          for dim in self.dims)
+        return '<SweepResult ({})>'.format(sizes)
+
+
+def sweep(diameter, sphericity=0.7, density=2300, release_height=10000,
+          windspeed=10, velocity_function='ganser', fall_step=10,
+          workers=None, chunk_size=None, method='step'):
+    """
+    Calculate travel distance and travel time for every combination of the
+    given parameters.  Each parameter may be a scalar or a sequence.  The
+    grid is split into chunks that are stepped as ParticleEnsembles in a
+    pool of worker processes.
+
+    Travel time does not depend on windspeed, so it is calculated once
+    and multiplied by each windspeed.
+
+    :param diameter: Particle diameter(s) in metres
+    :param sphericity: Particle sphericity(s)
+    :param density: Particle density(s) in kg/m3, or the name of a
+        registered size-density model (e.g. 'bp2003') or a dict of keyword
+        arguments to density.bp2003 (e.g. {'rho_pumice': 440,
+        'rho_glass': 2300}) to use size dependant density.  In that case
+        the density axis is omitted from the result.
+    :param release_height: Release height(s) in metres
+    :param windspeed: Windspeed(s) in metres per second
+    :param velocity_function: Name(s) of velocity function
+    :param fall_step: Step size for fall calculation in metres
+    :param workers: Number of worker processes (default is the number of
+        CPUs; 1 calculates in this process)
+    :param chunk_size: Maximum number of particles per chunk (default
+        gives each worker several chunks)
+    :param method: 'step', or 'quadrature' for the exact travel times of
+        the stokes and stokes_sea_level velocity functions (see
+        ParticleEnsemble.calculate_distance)
+    :return: SweepResult with distance and travel_time arrays whose axes
+        are velocity_function, diameter, sphericity, [density,]
+        release_height and windspeed
+    """
+    if method not in ('step', 'quadrature'):
+        raise ValueError('Method must be step or quadrature. {} given.'
+                         .format(method))
+    if method == 'quadrature' and not set(np.atleast_1d(
+            velocity_function)) <= set(quadrature.STOKES_MODELS):
+        raise ValueError('The quadrature method supports only the {} '
+                         'velocity functions'.format(
+                             ' and '.join(quadrature.STOKES_MODELS)))
+    coords = {
+        'velocity_function': np.atleast_1d(velocity_function),
+        'diameter': np.atleast_1d(np.asarray(diameter, dtype=float)),
+        'sphericity': np.atleast_1d(np.asarray(sphericity, dtype=float)),
+        'release_height': np.atleast_1d(np.asarray(release_height,
+                                                   dtype=float)),
+        'windspeed': np.atleast_1d(np.asarray(windspeed, dtype=float)),
+    }
+    size_dependant = isinstance(density, (str, dict))
+    if size_dependant:
+        dims = tuple(dim for dim in DIMS if dim != 'density')
+    else:
+        dims = DIMS
+        coords['density'] = np.atleast_1d(np.asarray(density, dtype=float))
+
+    # Build flat arrays over every axis except windspeed
+    grid_dims = dims[:-1]
+    grid = np.meshgrid(*[np.arange(len(coords[dim])) for dim in grid_dims],
+                       indexing='ij')
+    index = {dim: g.ravel() for dim, g in zip(grid_dims, grid)}
+    diameters = coords['diameter'][index['diameter']]
+    if size_dependant:
+        particle_density = _size_dependant_density(coords['diameter'],
+                                                   density)
+        densities = particle_density[index['diameter']]
+    else:
+        densities = coords['density'][index['density']]
+    sphericities = coords['sphericity'][index['sphericity']]
+    heights = coords['release_height'][index['release_height']]
+    functions = index['velocity_function']
+
+    # Group particles by velocity function and release height so that the
+    # particles in each chunk need a similar number of steps
+    order = np.lexsort((heights, functions))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, min(10000, -(-len(order) // (4 * workers))))
+    chunks = []
+    for function_index, name in enumerate(coords['velocity_function']):
+        members = order[functions[order] == function_index]
+        for start in range(0, len(members), chunk_size):
+            chunk = members[start:start + chunk_size]
+            chunks.append((chunk, (diameters[chunk], sphericities[chunk],
+                                   densities[chunk], heights[chunk],
+                                   fall_step, name, method)))
+
+    travel_time = np.empty(len(diameters))
+    tasks = [task for _, task in chunks]
+    if workers == 1:
+        results = map(_calculate_chunk, tasks)
+        for (chunk, _), result in zip(chunks, results):
+            travel_time[chunk] = result
+    else:
+        # Workers share the active result cache, if any, and the velocity
+        # models, which may have been registered in this process only
+        models = {name: fall_velocity.MODELS[name]
+                  for name in coords['velocity_function']
+                  if name in fall_velocity.MODELS}
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(cache.ACTIVE, models)) as executor:
+            results = executor.map(_calculate_chunk, tasks)
+            for (chunk, _), result in zip(chunks, results):
+                travel_time[chunk] = result
+
+    shape = tuple(len(coords[dim]) for dim in dims)
+    travel_time = np.broadcast_to(
+        travel_time.reshape(shape[:-1] + (1,)), shape)
+    distance = travel_time * coords['windspeed'] / 1000.0
+
+    return SweepResult(dims, {dim: coords[dim] for dim in dims},
+                       distance, travel_time)
+
+
+def _calculate_chunk(task):
+    """Return the travel times of one chunk of particles."""
+    diameter, sphericity, density, release_height, fall_step, \
+        velocity_function, method = task
+    ensemble = ParticleEnsemble(diameter, sphericity, density)
+    _, travel_time = ensemble.calculate_distance(
+        release_height=release_height, windspeed=0, fall_step=fall_step,
+        velocity_function=velocity_function, method=method)
+    return travel_time
+
+
+def _init_worker(result_cache, models):
+    """Activate a result cache and register velocity models in a worker
+    process."""
+    cache.ACTIVE = result_cache
+    fall_velocity.MODELS.update(models)
+
+
+def _size_dependant_density(diameter, spec):
+    """Return densities for diameters from a density model name or a dict
+    of bp2003 keyword arguments."""
+    if isinstance(spec, str):
+        return density_models.size_dependant_density(diameter, model=spec)
+    return density_models.bp2003(diameter, **spec)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Functions and a class for describing wind that varies with altitude."""
+
+import numpy as np
+
+
+class WindProfile:
+    """Wind speed and direction as a function of altitude, stored as
+    eastward and northward components on an altitude grid and interpolated
+    linearly.  Directions follow the meteorological convention: the
+    direction the wind blows from, in degrees clockwise from north."""
+
+    def __init__(self, altitude, speed, direction=270):
+        """Set up the profile from tabulated values.
+        :param altitude: Altitudes in metres
+        :param speed: Windspeeds in metres per second at each altitude
+        :param direction: Direction(s) the wind blows from in degrees
+            (default 270, a westerly wind blowing towards the east)"""
+        altitude, speed, direction = np.broadcast_arrays(
+            *[np.asarray(x, dtype=float) for x in
+              (altitude, speed, direction)])
+        if altitude.ndim != 1 or altitude.size < 1:
+            raise ValueError('Wind profile altitudes must be a non-empty '
+                             '1-D array')
+        order = np.argsort(altitude)
+        self.altitude = altitude[order]
+        if np.any(np.diff(self.altitude) == 0):
+            raise ValueError('Wind profile altitudes must be unique')
+        radians = np.radians(direction[order])
+        self.east = -speed[order] * np.sin(radians)
+        self.north = -speed[order] * np.cos(radians)
+
+    @classmethod
+    def from_function(cls, func, max_altitude=50000, resolution=10):
+        """Sample a function of altitude once onto a grid.
+        :param func: Vectorised function of altitude (m) returning speed,
+            or a tuple of (speed, direction)
+        :param max_altitude: Top of the grid in metres
+        :param resolution: Grid spacing in metres"""
+        n_points = int(np.ceil(max_altitude / resolution))
+        altitude = np.linspace(0, max_altitude, n_points + 1)
+        values = func(altitude)
+        if isinstance(values, tuple):
+            return cls(altitude, *values)
+        return cls(altitude, values)
+
+    def get_components(self, altitude):
+        """Return eastward and northward wind (m/s) at altitude(s) (m).
+        Values beyond the ends of the profile are held constant."""
+        east = np.interp(altitude, self.altitude, self.east)
+        north = np.interp(altitude, self.altitude, self.north)
+        return east, north
+
+    def get_speed_direction(self, altitude):
+        """Return windspeed (m/s) and the direction the wind blows from
+        (degrees) at altitude(s) (m)."""
+        east, north = self.get_components(altitude)
+        speed = np.hypot(east, north)
+        direction = np.degrees(np.arctan2(-east, -north)) % 360
+        return speed, direction
+
+    def get_along_cross(self, altitude, reference_direction):
+        """Return the wind components (m/s) along and across the downwind
+        axis of a wind blowing from reference_direction (degrees).  The
+        cross-wind component is positive to the left of downwind.
+        :param altitude: Altitude(s) in metres
+        :param reference_direction: Direction(s) in degrees
+        :return along, cross:"""
+        east, north = self.get_components(altitude)
+        radians = np.radians(reference_direction)
+        downwind_east = -np.sin(radians)
+        downwind_north = -np.cos(radians)
+        along = east * downwind_east + north * downwind_north
+        cross = north * downwind_east - east * downwind_north
+        return along, cross
+
+
+def as_profile(windspeed):
+    """
+    Return a WindProfile for windspeed given as a WindProfile, a function
+    of altitude or a tuple of (altitude, speed[, direction]) arrays, or
+    None for a constant windspeed.
+    """
+    if isinstance(windspeed, WindProfile):
+        return windspeed
+    if callable(windspeed):
+        return WindProfile.from_function(windspeed)
+    if isinstance(windspeed, tuple):
+        return WindProfile(*windspeed)
+    return None
@@ -1,4 +1,5 @@
 from mock import patch, sentinel
+import numpy as np
 import unittest
 
 from tephrange import atmos
@@ -73,6 +74,96 @@ class TestAtmos(unittest.TestCase):
             self.assertAlmostEqual(icao_values[altitude], density,
                                    2)
 
+    def test_get_atmos_state(self):
+        # Arrange
+        altitude = 8848
+
+        # Act
+        temp, pressure, density, viscosity = atmos.get_atmos_state(altitude)
+
+        # Assert
+        self.assertEqual((temp, pressure),
+                         atmos.get_atmos_temp_press(altitude))
+        self.assertEqual(density, atmos.get_density(altitude))
+        self.assertEqual(viscosity, atmos.get_viscosity(altitude))
+
+    def test_get_atmos_state_array(self):
+        # Arrange
+        altitude = np.array([[0, 5000, 10999, 11000],
+                             [15000, 20000, 32000, 45000]])
+
+        # Act
+        state = atmos.get_atmos_state(altitude)
+
+        # Assert
+        for values in state:
+            self.assertEqual(values.shape, altitude.shape)
+        for index, alt in np.ndenumerate(altitude):
+            expected = atmos.get_atmos_state(float(alt))
+            for values, e in zip(state, expected):
+                self.assertAlmostEqual(values[index] / e, 1, places=12)
+
+
+class TestAtmosphereTable(unittest.TestCase):
+    def setUp(self):
+        self.table = atmos.AtmosphereTable(max_altitude=40000, resolution=50)
+
+    def test_includes_breakpoints(self):
+        # Act, assert
+        for breakpoint in atmos.BREAKPOINTS:
+            self.assertIn(breakpoint, self.table.altitude)
+
+    def test_error_bound(self):
+        # Arrange
+        altitude = np.linspace(0, 40000, 10001)
+
+        # Act
+        table_state = self.table.get_atmos_state(altitude)
+        exact_state = atmos.get_atmos_state(altitude)
+
+        # Assert
+        self.assertLess(self.table.max_relative_error, 1e-5)
+        for table, exact in zip(table_state, exact_state):
+            error = np.max(np.abs(table / exact - 1))
+            self.assertLessEqual(error, 1.01 * self.table.max_relative_error)
+
+    def test_density_and_viscosity(self):
+        # Arrange
+        altitude = 8848
+
+        # Act
+        density = self.table.get_density(altitude)
+        viscosity = self.table.get_viscosity(altitude)
+
+        # Assert
+        self.assertAlmostEqual(density / atmos.get_density(altitude), 1,
+                               places=5)
+        self.assertAlmostEqual(viscosity / atmos.get_viscosity(altitude), 1,
+                               places=5)
+
+    def test_scalar_matches_array(self):
+        # Arrange
+        altitude = [0, 1234.5, atmos.FREEZING_ALTITUDE, 11000, 19999.9,
+                    40000]
+
+        # Act
+        array_state = self.table.get_atmos_state(np.array(altitude))
+
+        # Assert
+        for index, alt in enumerate(altitude):
+            state = self.table.get_atmos_state(alt)
+            for value, values in zip(state, array_state):
+                self.assertAlmostEqual(value / values[index], 1, places=14)
+
+    def test_out_of_range(self):
+        # Act and assert
+        with self.assertRaises(ValueError):
+            self.table.get_atmos_state(np.array([100, 40001]))
+        with self.assertRaises(ValueError):
+            self.table.get_atmos_state(-1.0)
+        with self.assertRaises(ValueError):
+            atmos.AtmosphereTable(max_altitude=0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,178 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tephrange import cache
+from tephrange import fall_velocity
+from tephrange.particle import Particle, ParticleEnsemble
+
+
+def _put_entries(args):
+    path, start = args
+    result_cache = cache.ResultCache(path)
+    for i in range(start, start + 20):
+        result_cache.put(str(i), {'value': np.full(10, i)})
+    return start
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'results.sqlite')
+
+    def tearDown(self):
+        cache.disable()
+        self.directory.cleanup()
+
+    def test_get_put(self):
+        result_cache = cache.ResultCache(self.path)
+        self.assertIsNone(result_cache.get('key'))
+
+        result_cache.put('key', {'a': np.arange(3.0), 'b': 1.5})
+        values = result_cache.get('key')
+
+        np.testing.assert_array_equal(values['a'], [0, 1, 2])
+        self.assertEqual(values['b'], 1.5)
+        self.assertEqual((result_cache.hits, result_cache.misses), (1, 1))
+        self.assertEqual(len(result_cache), 1)
+        self.assertEqual(len(cache.ResultCache(self.path)), 1)
+
+        result_cache.clear()
+        self.assertEqual(len(result_cache), 0)
+
+    def test_eviction(self):
+        # Arrange
+        result_cache = cache.ResultCache(self.path)
+        result_cache.put('first', {'a': np.zeros(1000)})
+        entry_size = result_cache.size
+        result_cache.max_size = 3 * entry_size
+        result_cache.put('second', {'a': np.ones(1000)})
+        result_cache.put('third', {'a': np.ones(1000)})
+
+        # Act
+        result_cache.get('first')
+        result_cache.put('fourth', {'a': np.ones(1000)})
+
+        # Assert
+        # second was least recently used
+        self.assertEqual(len(result_cache), 3)
+        self.assertIsNone(result_cache.get('second'))
+        self.assertIsNotNone(result_cache.get('first'))
+        self.assertLessEqual(result_cache.size, result_cache.max_size)
+
+    def test_concurrent_processes(self):
+        cache.ResultCache(self.path)
+        tasks = [(self.path, start) for start in range(0, 80, 20)]
+
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(_put_entries, tasks))
+
+        result_cache = cache.ResultCache(self.path)
+        self.assertEqual(len(result_cache), 80)
+        np.testing.assert_array_equal(result_cache.get('42')['value'], 42)
+
+    def test_make_key(self):
+        key = cache.make_key('Particle', 1e-4, 0.7, 'ganser')
+        self.assertEqual(key, cache.make_key('Particle', np.float64(1e-4),
+                                             0.7, 'ganser'))
+        self.assertNotEqual(key, cache.make_key('Particle', 1e-4, 0.7,
+                                                'stokes'))
+        self.assertNotEqual(key, cache.make_key('ParticleEnsemble', 1e-4,
+                                                0.7, 'ganser'))
+        with mock.patch('tephrange.__version__', '0.0.0'):
+            self.assertNotEqual(key, cache.make_key('Particle', 1e-4, 0.7,
+                                                    'ganser'))
+        self.assertNotEqual(cache.make_key('a', np.array([1.0, 2.0])),
+                            cache.make_key('a', np.array([[1.0], [2.0]])))
+
+    def test_default_path(self):
+        with mock.patch.dict(os.environ,
+                             {'TEPHRANGE_CACHE_DIR': self.directory.name}):
+            self.assertEqual(cache.default_path(), self.path)
+
+
+class TestParticleCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'results.sqlite')
+
+    def tearDown(self):
+        cache.disable()
+        self.directory.cleanup()
+
+    def test_particle_cache(self):
+        # Arrange
+        expected = Particle(1e-4)
+        expected_distance = expected.calculate_distance(fall_step=100)
+        result_cache = cache.enable(self.path)
+        Particle(1e-4).calculate_distance(fall_step=100)
+
+        # Act
+        particle = Particle(1e-4)
+        with mock.patch.object(fall_velocity, 'bind_model') as bind_model:
+            distance = particle.calculate_distance(fall_step=100)
+
+        # Assert
+        bind_model.assert_not_called()
+        self.assertEqual((result_cache.hits, result_cache.misses), (1, 1))
+        self.assertEqual(distance, expected_distance)
+        for name in ('current_altitude', 'current_travel_time',
+                     'current_velocity', 'steps_taken'):
+            self.assertEqual(getattr(particle, name),
+                             getattr(expected, name), msg=name)
+        np.testing.assert_array_equal(particle.travel_time,
+                                      expected.travel_time)
+
+    def test_particle_cache_continued_run(self):
+        # Arrange
+        expected = Particle(1e-4)
+        expected.calculate_distance(fall_step=100)
+        expected_distance = expected.calculate_distance(
+            release_height=5000, fall_step=100)
+        cache.enable(self.path)
+
+        # Act
+        particle = Particle(1e-4)
+        particle.calculate_distance(fall_step=100)
+        distance = particle.calculate_distance(release_height=5000,
+                                               fall_step=100)
+
+        # Assert
+        self.assertEqual(distance, expected_distance)
+        np.testing.assert_array_equal(particle.distance, expected.distance)
+
+    def test_particle_cache_not_used(self):
+        result_cache = cache.enable(self.path)
+        profile = ([0, 20000], [10, 20])
+
+        Particle(1e-4).calculate_distance(windspeed=profile)
+        Particle(1e-4).calculate_distance(
+            velocity_cache=fall_velocity.VelocityCache())
+
+        self.assertEqual(len(result_cache), 0)
+
+    def test_ensemble_cache(self):
+        # Arrange
+        diameter = np.logspace(-5, -3, 10)
+        expected, expected_time = ParticleEnsemble(
+            diameter).calculate_distance(windspeed=[5] * 10)
+        result_cache = cache.enable(self.path)
+        ParticleEnsemble(diameter).calculate_distance(windspeed=5)
+
+        # Act
+        ensemble = ParticleEnsemble(diameter)
+        distance, travel_time = ensemble.calculate_distance(
+            windspeed=[5] * 10)
+
+        # Assert
+        self.assertEqual(result_cache.hits, 1)
+        np.testing.assert_array_equal(distance, expected)
+        np.testing.assert_array_equal(travel_time, expected_time)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import csv
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tephrange import cli
+from tephrange import particle
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmpdir.name, 'input.csv')
+        self.output = os.path.join(self.tmpdir.name, 'output.csv')
+        self.rows = [(30e-6, 0.5, 1000), (100e-6, 0.7, 2300),
+                     (500e-6, 0.9, 2500), (65e-6, 0.6, 1500),
+                     (250e-6, 0.8, 2000)]
+        with open(self.input, 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(['diameter', 'sphericity', 'density'])
+            writer.writerows(self.rows)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read_output(self):
+        with open(self.output, newline='') as infile:
+            reader = csv.reader(infile)
+            header = next(reader)
+            return header, np.array(list(reader), dtype=float)
+
+    def test_matches_particle(self):
+        # Act
+        status = cli.main([self.input, self.output, '--chunk-size', '2',
+                           '--release-height', '2000', '--windspeed', '15',
+                           '--fall-step', '50', '--quiet'])
+
+        # Assert
+        self.assertEqual(status, 0)
+        header, values = self.read_output()
+        self.assertEqual(header, ['diameter', 'sphericity', 'density',
+                                  'distance', 'travel_time'])
+        self.assertEqual(len(values), len(self.rows))
+        for row, (diameter, sphericity, density) in zip(values, self.rows):
+            p = particle.Particle(diameter, sphericity=sphericity,
+                                  particle_density=density)
+            expected = p.calculate_distance(release_height=2000,
+                                            windspeed=15, fall_step=50)
+            self.assertAlmostEqual(row[3] / expected, 1, places=9)
+            self.assertAlmostEqual(row[4] / p.current_travel_time, 1,
+                                   places=9)
+
+    def test_workers_match_serial(self):
+        # Arrange
+        serial_output = os.path.join(self.tmpdir.name, 'serial.csv')
+        cli.main([self.input, serial_output, '--chunk-size', '2',
+                  '--release-height', '1000', '--quiet'])
+
+        # Act
+        cli.main([self.input, self.output, '--chunk-size', '2',
+                  '--release-height', '1000', '--workers', '2', '--quiet'])
+
+        # Assert
+        _, values = self.read_output()
+        self.output = serial_output
+        _, expected = self.read_output()
+        np.testing.assert_array_equal(values, expected)
+
+    def test_passes_through_text_columns(self):
+        # Arrange
+        with open(self.input, 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(['sample', 'diameter'])
+            writer.writerows([('A-1', 30e-6), ('B 2', 100e-6)])
+
+        # Act
+        status = cli.main([self.input, self.output, '--release-height',
+                           '1000', '--quiet'])
+
+        # Assert
+        self.assertEqual(status, 0)
+        with open(self.output, newline='') as infile:
+            rows = list(csv.reader(infile))
+        self.assertEqual(rows[0], ['sample', 'diameter', 'distance',
+                                   'travel_time'])
+        self.assertEqual([row[0] for row in rows[1:]], ['A-1', 'B 2'])
+
+    def test_text_in_calculation_column(self):
+        # Arrange
+        with open(self.input, 'w', newline='') as outfile:
+            outfile.write('diameter,density\n1e-4,2300\n1e-4,heavy\n')
+
+        # Act / Assert
+        with self.assertRaises(SystemExit):
+            cli.main([self.input, self.output, '--quiet'])
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_missing_diameter_column(self):
+        # Arrange
+        with open(self.input, 'w', newline='') as outfile:
+            outfile.write('size\n1e-4\n')
+
+        # Act / Assert
+        with self.assertRaises(SystemExit):
+            cli.main([self.input, self.output, '--quiet'])
+
+    def test_missing_input_file(self):
+        # Arrange
+        missing = os.path.join(os.path.dirname(self.input), 'missing.csv')
+
+        # Act / Assert
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit):
+                cli.main([missing, self.output, '--quiet'])
+        self.assertIn('missing.csv', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,46 @@ class TestBP2003(unittest.TestCase):
                 msg="Density for {} metres was not {} ({})".format(
                     diam, e, rho))
 
+    def test_bp2003_array(self):
+        # Arrange
+        diameter = np.array([[4, 125], [2000, 16000]]) / 1e6
+
+        # Act
+        rho = density.bp2003(diameter, rho_pumice=500, rho_glass=2500)
+
+        # Assert
+        np.testing.assert_allclose(rho, [[2500, 1500], [500, 500]])
+        for diam, value in zip(diameter.ravel(), rho.ravel()):
+            self.assertAlmostEqual(
+                density.bp2003(float(diam), rho_pumice=500, rho_glass=2500),
+                value, places=9)
+
+
+class TestDensityModels(unittest.TestCase):
+    def test_size_dependant_density(self):
+        diameter = np.logspace(-6, -2, 50)
+        np.testing.assert_array_equal(
+            density.size_dependant_density(diameter, rho_pumice=600),
+            density.bp2003(diameter, rho_pumice=600))
+
+    def test_register_model(self):
+        # Arrange
+        density.register_model('constant',
+                               lambda diameter, rho: np.full_like(
+                                   diameter, rho))
+        self.addCleanup(density.MODELS.pop, 'constant')
+
+        # Act
+        rho = density.size_dependant_density(np.array([1e-5, 1e-3]),
+                                             model='constant', rho=1234)
+
+        # Assert
+        np.testing.assert_array_equal(rho, [1234, 1234])
+
+    def test_unknown_model(self):
+        with self.assertRaises(ValueError):
+            density.size_dependant_density(1e-4, model='invalid')
+
 
 class TestConvertToSolidity(unittest.TestCase):
     def setUp(self):
@@ -34,6 +74,41 @@ class TestConvertToSolidity(unittest.TestCase):
         with self.assertRaises(ValueError):
             density.convert_to_solidity(np.array([0.1]))
 
+    def test_reports_every_index(self):
+        # Arrange
+        values = np.array([100, 3000, 0.1, 5000, 1000, 0.5])
+
+        # Act
+        with self.assertRaises(density.DensityRangeError) as context:
+            density.convert_to_solidity(values)
+
+        # Assert
+        np.testing.assert_array_equal(context.exception.too_dense[0], [1, 3])
+        np.testing.assert_array_equal(context.exception.too_light[0], [2, 5])
+        self.assertIn('2 indices: [1, 3]', str(context.exception))
+        self.assertIn('2 indices: [2, 5]', str(context.exception))
+
+    def test_range_error_message_is_short(self):
+        # Arrange
+        values = np.full((1000, 1000), 3000.0)
+
+        # Act
+        with self.assertRaises(density.DensityRangeError) as context:
+            density.convert_to_solidity(values)
+
+        # Assert
+        self.assertEqual(context.exception.too_dense[0].size, 1000000)
+        self.assertIn('1000000 indices: [(0, 0), (0, 1), (0, 2), (0, 3), '
+                      '(0, 4), ...]', str(context.exception))
+        self.assertLess(len(str(context.exception)), 200)
+
+    def test_array(self):
+        values = np.linspace(1, 2001, 11).reshape(1, 11)
+        solidity = density.convert_to_solidity(values,
+                                               rho_glass=self.rho_glass,
+                                               rho_atm=self.rho_atm)
+        np.testing.assert_allclose(solidity, [np.linspace(0, 1, 11)])
+
     def test_solid(self):
         solidity = density.convert_to_solidity(np.array([2001]), rho_glass=self.rho_glass,
                                                rho_atm=self.rho_atm)
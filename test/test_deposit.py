@@ -0,0 +1,135 @@
+import numpy as np
+import unittest
+
+from tephrange import deposit
+from tephrange.particle import Particle
+from tephrange.wind import WindProfile
+
+
+class TestDeposit(unittest.TestCase):
+    def test_deposit_conserves_mass(self):
+        # Arrange
+        phi = np.linspace(-2, 8, 200)
+        mass_fraction = np.exp(-0.5 * ((phi - 3) / 2)**2)
+        release_height = np.linspace(2000, 15000, 50)
+
+        # Act
+        result = deposit.deposit(phi, mass_fraction, release_height,
+                                 total_mass=1e9,
+                                 distance_edges=np.arange(0, 101.0))
+
+        # Assert
+        self.assertEqual(result.mass.shape, (100,))
+        self.assertAlmostEqual(
+            (result.mass.sum() + result.mass_before + result.mass_beyond) /
+            1e9, 1.0, places=12)
+        self.assertEqual(result.mass_before, 0)
+        self.assertGreater(result.mass_beyond, 0)
+        np.testing.assert_allclose(result.loading, result.mass)
+        np.testing.assert_allclose(result.centres, np.arange(0.5, 100))
+
+    def test_deposit_matches_particle(self):
+        # Arrange
+        cases = [(3, 10000, 10, 2300), (0, 15000, 5, 1000),
+                 (6, 7777, 20, 2300), (-3, 25000, 10, 500)]
+
+        for phi, release_height, windspeed, density in cases:
+            particle = Particle(2.0**-phi / 1000, particle_density=density)
+            expected = particle.calculate_distance(
+                release_height=release_height, windspeed=windspeed,
+                method='adaptive', tolerance=1e-10)
+            edges = expected + np.linspace(-0.001, 0.001, 3)
+
+            # Act
+            result = deposit.deposit(phi, 1, release_height,
+                                     distance_edges=edges,
+                                     windspeed=windspeed, density=density)
+
+            # Assert
+            msg = 'Deposit for phi {} from {} m'.format(phi, release_height)
+            self.assertAlmostEqual(result.mass.sum(), 1.0, msg=msg)
+
+    def test_deposit_release_fraction(self):
+        # Arrange
+        edges = np.arange(0, 501.0, 5)
+
+        # Act
+        low = deposit.deposit(4, 1, 5000, distance_edges=edges)
+        high = deposit.deposit(4, 1, 15000, distance_edges=edges)
+        both = deposit.deposit(4, 1, [5000, 15000], release_fraction=[1, 3],
+                               total_mass=4, distance_edges=edges)
+
+        # Assert
+        np.testing.assert_allclose(both.mass, low.mass + 3 * high.mass)
+
+    def test_deposit_chunks(self):
+        # Arrange
+        phi = np.linspace(0, 6, 25)
+        edges = np.arange(0, 201.0, 2)
+
+        # Act
+        whole = deposit.deposit(phi, 1, [3000, 9000], distance_edges=edges)
+        chunked = deposit.deposit(phi, 1, [3000, 9000], distance_edges=edges,
+                                  chunk_size=4)
+
+        # Assert
+        np.testing.assert_allclose(chunked.mass, whole.mass)
+
+    def test_deposit_size_dependant_density(self):
+        # Arrange
+        phi = np.array([-1.0, 3.0, 7.0])
+        edges = np.logspace(-1, 4, 501)
+
+        # Act
+        named = deposit.deposit(phi, 1, 10000, distance_edges=edges,
+                                density='bp2003')
+        explicit = deposit.deposit(phi, 1, 10000, distance_edges=edges,
+                                   density=[440, 1370, 2300])
+
+        # Assert
+        np.testing.assert_array_equal(named.mass, explicit.mass)
+
+    def test_deposit_wind_profile(self):
+        # Arrange
+        edges = np.arange(0, 301.0)
+        profile = WindProfile([0, 30000], [10, 10], direction=[270, 180])
+        particle = Particle(2.0**-3 / 1000)
+        expected = particle.calculate_distance(release_height=12000,
+                                               windspeed=profile,
+                                               fall_step=10)
+
+        # Act
+        result = deposit.deposit(3, 1, 12000, distance_edges=edges,
+                                 windspeed=profile)
+
+        # Assert
+        centre = result.centres[np.argmax(result.mass)]
+        self.assertAlmostEqual(centre, expected, delta=0.5)
+
+    def test_deposit_bad_input(self):
+        bad_inputs = [dict(mass_fraction=0),
+                      dict(release_height=-1),
+                      dict(distance_edges=[10]),
+                      dict(distance_edges=[10, 5]),
+                      dict(density='not_a_model')]
+        for bad_input in bad_inputs:
+            kwargs = dict(phi=3, mass_fraction=1, release_height=1000)
+            kwargs.update(bad_input)
+            with self.assertRaises(ValueError, msg=str(bad_input)):
+                deposit.deposit(**kwargs)
+
+
+class TestBinIndex(unittest.TestCase):
+    def test_bin_index(self):
+        distance = np.array([-5, 0, 0.5, 9.99, 10, 11, 1e6])
+        expected = [0, 1, 1, 10, 11, 11, 11]
+        uniform = np.arange(11.0)
+        irregular = np.array([0, 1, 2, 3, 4, 5.5, 6, 7, 8, 9, 10])
+
+        for edges in (uniform, irregular):
+            np.testing.assert_array_equal(
+                deposit._bin_index(distance, edges), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
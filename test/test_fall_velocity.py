@@ -1,3 +1,4 @@
+import numpy as np
 import unittest
 from tephrange import fall_velocity as fv
 
@@ -32,6 +33,156 @@ class TestGanser(unittest.TestCase):
                                                       expected[i]))
 
 
+    def test_array_matches_scalar(self):
+        """
+        Test that Ganser fall velocity of an array matches the scalar
+        results element by element.
+        """
+        # Arrange
+        diameter = np.logspace(-6, -2, 9)
+        expected = [fv.ganser(d, sphericity=0.6) for d in diameter]
+
+        # Act
+        velocity = fv.ganser(diameter, sphericity=0.6)
+
+        # Assert
+        self.assertEqual(velocity.shape, diameter.shape)
+        np.testing.assert_allclose(velocity, expected, rtol=1e-12)
+
+    def test_broadcasting(self):
+        """
+        Test that Ganser fall velocity broadcasts diameter, sphericity and
+        atmosphere arrays against each other.
+        """
+        # Arrange
+        diameter = np.array([10, 100, 1000]) / 1.0e6
+        sphericity = np.array([0.5, 0.7, 1.0])
+        atm_density = np.array([1.2, 0.4])
+
+        # Act
+        velocity = fv.ganser(diameter[:, None, None],
+                             sphericity=sphericity[None, :, None],
+                             atm_density=atm_density)
+
+        # Assert
+        self.assertEqual(velocity.shape, (3, 3, 2))
+        self.assertAlmostEqual(
+            velocity[1, 2, 0],
+            fv.ganser(100e-6, sphericity=1.0, atm_density=1.2), places=12)
+    def test_newton_iterations(self):
+        """
+        Test that the Newton solver converges to the force balance in a
+        few iterations across the full range of grain sizes.
+        """
+        # Arrange
+        diameter = np.logspace(-7, -1, 25)
+        k1, k2 = fv._ganser_shape_factors(0.7)
+
+        # Act
+        velocity, iterations = fv.ganser(diameter, return_iterations=True)
+
+        # Assert
+        reynolds_k = fv._get_reynolds(diameter, velocity) * k1 * k2
+        drag = fv._ganser_drag_slope(reynolds_k)[0] * k2
+        np.testing.assert_allclose(
+            drag * velocity**2,
+            fv._ganser_velocity_scale(diameter, 2300, fv.ATM_DENSITY),
+            rtol=1e-12)
+        self.assertLessEqual(iterations.max(), 6)
+
+    def test_initial_velocity(self):
+        """
+        Test that a good initial guess reduces the iteration count without
+        changing the result.
+        """
+        # Arrange
+        cold, cold_iterations = fv.ganser(1e-3, return_iterations=True)
+
+        # Act
+        warm, warm_iterations = fv.ganser(1e-3, initial_velocity=cold * 1.01,
+                                          return_iterations=True)
+
+        # Assert
+        self.assertAlmostEqual(warm / cold, 1, places=10)
+        self.assertLess(warm_iterations, cold_iterations)
+
+    def test_max_iterations(self):
+        """
+        Test that failure to converge raises an error.
+        """
+        # Act and assert
+        with self.assertRaises(RuntimeError):
+            fv.ganser(1e-3, max_iterations=1)
+        with self.assertRaises(RuntimeError):
+            fv.ganser(np.array([1e-5, 1e-3]), max_iterations=1)
+
+    def test_no_real_velocity(self):
+        """
+        Test that particles lighter than air or of zero size give NaN from
+        both the scalar and array versions.
+        """
+        # Act
+        with np.errstate(all='ignore'):
+            scalar = [fv.ganser(1e-4, density=1.0), fv.ganser(0.0)]
+            array = fv.ganser(np.array([1e-4, 0.0]),
+                              density=np.array([1.0, 2300]))
+
+        # Assert
+        self.assertTrue(np.all(np.isnan(scalar)))
+        self.assertTrue(np.all(np.isnan(array)))
+
+
+class TestGanserFast(unittest.TestCase):
+    def test_matches_ganser(self):
+        # Arrange
+        rng = np.random.default_rng(0)
+        diameter = 10**rng.uniform(-7, -1, 100000)
+        sphericity = rng.uniform(0.1, 1, 100000)
+        density = rng.uniform(200, 3500, 100000)
+        atm_density = rng.uniform(0.05, 1.3, 100000)
+        atm_viscosity = rng.uniform(1.4e-5, 1.8e-5, 100000)
+        expected = fv.ganser(diameter, sphericity, density, atm_density,
+                             atm_viscosity, rtol=1e-14)
+
+        # Act
+        velocity = fv.ganser_fast(diameter, sphericity, density,
+                                  atm_density, atm_viscosity)
+
+        # Assert
+        self.assertLess(np.max(np.abs(velocity / expected - 1)), 1e-6)
+
+    def test_scalar(self):
+        for diameter in (1e-10, 1e-5, 1e-3, 10):
+            velocity = fv.ganser_fast(diameter, 0.6)
+            self.assertIsInstance(velocity, float)
+            self.assertAlmostEqual(velocity / fv.ganser(diameter, 0.6), 1,
+                                   places=9, msg=diameter)
+            self.assertEqual(velocity, fv.ganser_fast(np.array([diameter]),
+                                                      0.6)[0])
+
+    def test_outside_table(self):
+        # Arrange
+        # Y is outside the table for the smallest and largest diameters,
+        # which are solved by iteration
+        diameter = np.array([[1e-10, 1e-4], [1e-5, 10]])
+
+        # Act
+        velocity = fv.ganser_fast(diameter, sphericity=0.8)
+
+        # Assert
+        np.testing.assert_allclose(velocity, fv.ganser(diameter, 0.8),
+                                   rtol=1e-9)
+
+    def test_registered_model(self):
+        velocity = fv.bind_model('ganser_fast', np.array([1e-5, 1e-3]),
+                                 np.array([0.5, 0.9]),
+                                 np.array([2300, 2000]))
+
+        np.testing.assert_allclose(
+            velocity(1.0, 1.7e-5, index=np.array([1])),
+            fv.ganser(1e-3, 0.9, 2000, 1.0, 1.7e-5), rtol=1e-9)
+
+
 class TestStokes(unittest.TestCase):
     def test_stokes(self):
         """
@@ -61,6 +212,65 @@ class TestStokes(unittest.TestCase):
                                                       expected[i]))
 
 
+class TestVelocityCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        # Arrange
+        cache = fv.VelocityCache()
+        calls = []
+
+        def calculate():
+            calls.append(1)
+            return fv.ganser(1e-4)
+
+        # Act
+        first = cache.get(calculate, 'ganser', 1e-4, 0.7, 2300, 1.2, 1.8e-5)
+        second = cache.get(calculate, 'ganser', 1e-4 * (1 + 1e-13), 0.7,
+                           2300, 1.2, 1.8e-5)
+        cache.get(calculate, 'stokes', 1e-4, 0.7, 2300, 1.2, 1.8e-5)
+
+        # Assert
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 2)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (1, 2, 2))
+        self.assertAlmostEqual(stats['hit_rate'], 1 / 3.0)
+
+    def test_lru_eviction(self):
+        # Arrange
+        cache = fv.VelocityCache(max_size=2)
+        args = ('ganser', 0.7, 2300, 1.2, 1.8e-5)
+
+        # Act
+        cache.get(lambda: 1, args[0], 1e-4, *args[1:])
+        cache.get(lambda: 2, args[0], 2e-4, *args[1:])
+        cache.get(lambda: 0, args[0], 1e-4, *args[1:])  # Hit, now newest
+        cache.get(lambda: 3, args[0], 3e-4, *args[1:])  # Evicts 2e-4
+
+        # Assert
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get(lambda: 9, args[0], 1e-4, *args[1:]), 1)
+        self.assertEqual(cache.get(lambda: 9, args[0], 2e-4, *args[1:]), 9)
+
+    def test_clear(self):
+        # Arrange
+        cache = fv.VelocityCache()
+        cache.get(lambda: 1, 'ganser', 1e-4, 0.7, 2300, 1.2, 1.8e-5)
+
+        # Act
+        cache.clear()
+
+        # Assert
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['misses'], 0)
+
+    def test_invalid_size(self):
+        # Act and assert
+        with self.assertRaises(ValueError):
+            fv.VelocityCache(max_size=0)
+
+
 @unittest.skip("Waiting for 'true' results to compare with")
 class TestWhite(unittest.TestCase):
     def test_stokes(self):
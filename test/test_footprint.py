@@ -0,0 +1,131 @@
+import numpy as np
+import unittest
+
+from tephrange import footprint
+from tephrange.particle import ParticleEnsemble
+from tephrange.wind import WindProfile
+
+
+class TestLandingPositions(unittest.TestCase):
+    def test_landing_positions_constant_wind(self):
+        # Arrange
+        diameter = np.array([1e-5, 1e-4, 1e-3])
+        ensemble = ParticleEnsemble(diameter)
+        distance, travel_time = ensemble.calculate_distance(
+            release_height=8000, windspeed=15)
+        directions = [270, 180, 90, 0, 225]
+        expected_x = [distance, 0, -distance, 0, distance / np.sqrt(2)]
+        expected_y = [0, distance, 0, -distance, distance / np.sqrt(2)]
+
+        for direction, e_x, e_y in zip(directions, expected_x, expected_y):
+            # Act
+            x, y, time = footprint.landing_positions(
+                diameter, release_height=8000, windspeed=15,
+                direction=direction)
+
+            # Assert
+            np.testing.assert_allclose(x, e_x, atol=1e-9)
+            np.testing.assert_allclose(y, e_y, atol=1e-9)
+            np.testing.assert_array_equal(time, travel_time)
+
+    def test_landing_positions_wind_profile(self):
+        # Arrange
+        # Wind from the south up high turning to a westerly near the ground
+        profile = WindProfile([0, 5000, 15000], [10, 10, 20],
+                              direction=[270, 270, 180])
+        diameter = np.array([5e-5, 2e-4, 1e-3])
+        ensemble = ParticleEnsemble(diameter)
+        distance, _ = ensemble.calculate_distance(release_height=12000,
+                                                  windspeed=profile)
+        crosswind = ensemble.current_crosswind_distance / 1000
+
+        # Act
+        x, y, _ = footprint.landing_positions(diameter, release_height=12000,
+                                              windspeed=profile)
+
+        # Assert
+        # Distance is measured to the north, crosswind to the west
+        direction = profile.get_speed_direction(12000)[1]
+        self.assertTrue(180 < direction < 270)
+        np.testing.assert_allclose(np.hypot(x, y),
+                                   np.hypot(distance, crosswind))
+        self.assertTrue(np.all(x > 0))
+        self.assertTrue(np.all(y > 0))
+
+    def test_to_east_north(self):
+        x, y = footprint.to_east_north(np.array([10.0, 10.0]),
+                                       np.array([2.0, -2.0]), 180)
+        np.testing.assert_allclose(x, [-2, 2], atol=1e-12)
+        np.testing.assert_allclose(y, [10, 10], atol=1e-12)
+
+
+class TestRasterise(unittest.TestCase):
+    def test_rasterise(self):
+        # Arrange
+        x = np.array([0.5, 0.5, 1.5, -3, 2.5, 1.0])
+        y = np.array([0.5, 0.6, 2.5, 0.5, 0.5, 3.0])
+        mass = np.array([1, 2, 4, 8, 16, 32.0])
+        x_edges = np.array([0, 1, 2, 3.0])
+        y_edges = np.array([0, 1, 2, 4.0])
+        expected = np.array([[3, 0, 0],
+                             [0, 0, 36],
+                             [16, 0, 0]])
+
+        # Act
+        result = footprint.rasterise(x, y, mass, x_edges, y_edges)
+
+        # Assert
+        np.testing.assert_array_equal(result.mass, expected)
+        self.assertEqual(result.mass_outside, 8)
+        np.testing.assert_array_equal(result.loading, expected /
+                                      [[1, 1, 2]])
+        np.testing.assert_array_equal(result.x_centres, [0.5, 1.5, 2.5])
+        np.testing.assert_array_equal(result.y_centres, [0.5, 1.5, 3])
+
+    def test_rasterise_matches_histogram2d(self):
+        # Arrange
+        rng = np.random.default_rng(1)
+        x, y = rng.normal(size=(2, 10000))
+        edges = np.linspace(-2, 2, 41)
+        # Include points on the first, last and inner edges
+        x[:4] = [-2, 2, 2, 0.5]
+        y[:4] = [0.5, 0.5, 2, -2]
+        mass = rng.random(10000)
+
+        # Act
+        result = footprint.rasterise(x, y, mass, edges, edges)
+
+        # Assert
+        expected, _, _ = np.histogram2d(x, y, bins=[edges, edges],
+                                        weights=mass)
+        np.testing.assert_allclose(result.mass, expected)
+        self.assertAlmostEqual(result.mass.sum() + result.mass_outside,
+                               mass.sum())
+
+    def test_rasterise_bad_edges(self):
+        for edges in ([1], [0, 2, 1], [[0, 1], [2, 3]]):
+            with self.assertRaises(ValueError, msg=str(edges)):
+                footprint.rasterise([0], [0], 1, edges, [0, 1])
+
+
+class TestFootprint(unittest.TestCase):
+    def test_footprint(self):
+        # Arrange
+        diameter = np.logspace(-4, -3, 20)
+        edges = np.arange(-50, 51.0)
+
+        # Act
+        result = footprint.footprint(diameter, 0.5, edges, edges,
+                                     release_height=6000, windspeed=5,
+                                     direction=0)
+
+        # Assert
+        # A northerly wind carries everything south of the vent
+        self.assertAlmostEqual(result.mass.sum() + result.mass_outside, 10)
+        south, north = np.split(result.mass.sum(axis=0), 2)
+        self.assertEqual(north.sum(), 0)
+        self.assertGreater(south.sum(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import numpy as np
+import unittest
+
+from tephrange import atmos
+from tephrange import fall_velocity
+from tephrange import instrument
+from tephrange import particle
+
+
+class TestProfile(unittest.TestCase):
+    def test_ganser_counts(self):
+        # Arrange
+        diameter = np.array([1e-5, 1e-4, 1e-3])
+        _, iterations = fall_velocity.ganser(diameter, return_iterations=True)
+        _, scalar_iterations = fall_velocity.ganser(1e-4,
+                                                    return_iterations=True)
+
+        # Act
+        with instrument.Profile() as profile:
+            fall_velocity.ganser(diameter)
+            fall_velocity.ganser(1e-4)
+
+        # Assert
+        self.assertEqual(profile.ganser_calls, 2)
+        self.assertEqual(profile.ganser_elements, 4)
+        self.assertEqual(profile.ganser_iterations,
+                         iterations.sum() + scalar_iterations)
+        self.assertEqual(profile.ganser_max_iterations, iterations.max())
+
+    def test_atmos_counts(self):
+        # Act
+        with instrument.Profile() as profile:
+            atmos.get_atmos_state(1000)
+            atmos.get_density(np.arange(10))
+
+        # Assert
+        self.assertEqual(profile.atmos_calls, 2)
+        self.assertEqual(profile.atmos_evaluations, 11)
+
+    def test_calculate_distance_runs(self):
+        # Act
+        with instrument.Profile() as profile:
+            particle.Particle(1e-4).calculate_distance(release_height=100)
+            particle.ParticleEnsemble([1e-4, 1e-3]).calculate_distance(
+                release_height=[100, 50])
+
+        # Assert
+        runs = profile.as_dict()['calculate_distance']['runs']
+        self.assertEqual([run['type'] for run in runs],
+                         ['Particle', 'ParticleEnsemble'])
+        self.assertEqual(runs[0]['steps'], 10)
+        self.assertEqual(runs[1]['steps'], 10)
+        self.assertEqual(runs[1]['particle_steps'], 15)
+        self.assertGreater(runs[0]['wall_time'], 0)
+
+    def test_activated_during_run(self):
+        # Arrange
+        class Atmosphere:
+            """Activates a profile on first use, as another thread
+            might."""
+            def __init__(self):
+                self.profile = instrument.Profile()
+
+            def get_atmos_state(self, altitude):
+                if instrument.ACTIVE is None:
+                    self.profile.__enter__()
+                return atmos.get_atmos_state(altitude)
+
+        for particles in (particle.Particle(1e-4),
+                          particle.ParticleEnsemble([1e-4, 1e-3])):
+            atmosphere = Atmosphere()
+            try:
+                # Act
+                particles.calculate_distance(release_height=100,
+                                             atmosphere=atmosphere)
+            finally:
+                atmosphere.profile.__exit__(None, None, None)
+
+            # Assert
+            runs = atmosphere.profile.as_dict()['calculate_distance']['runs']
+            self.assertEqual(runs, [])
+        self.assertIsNone(instrument.ACTIVE)
+
+    def test_disabled(self):
+        # Arrange
+        profile = instrument.Profile()
+
+        # Act
+        fall_velocity.ganser(1e-4)
+
+        # Assert
+        self.assertIsNone(instrument.ACTIVE)
+        self.assertEqual(profile.ganser_calls, 0)
+
+    def test_nested(self):
+        # Act
+        with instrument.Profile() as outer:
+            with instrument.Profile() as inner:
+                atmos.get_atmos_state(1000)
+            self.assertIs(instrument.ACTIVE, outer)
+            atmos.get_atmos_state(1000)
+
+        # Assert
+        self.assertIsNone(instrument.ACTIVE)
+        self.assertEqual((inner.atmos_calls, outer.atmos_calls), (1, 1))
+
+    def test_callback_and_json(self):
+        # Arrange
+        events = []
+
+        # Act
+        with instrument.Profile(
+                callback=lambda event, data: events.append(event)) as profile:
+            particle.Particle(1e-4).calculate_distance(release_height=20)
+        exported = json.loads(profile.to_json())
+
+        # Assert
+        self.assertEqual(events, ['atmos', 'ganser'] * 2 +
+                         ['calculate_distance'])
+        self.assertEqual(exported['ganser']['calls'], 2)
+        self.assertEqual(exported['calculate_distance']['steps'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import numpy as np
+import unittest
+
+from tephrange import inverse
+from tephrange import particle
+
+
+class TestMaxDiameter(unittest.TestCase):
+    def test_max_diameter(self):
+        # Arrange
+        target = np.array([50, 200, 1000])
+        tolerance = 1e-4
+
+        # Act
+        diameter, evaluations = inverse.max_diameter(
+            target, release_height=10000, windspeed=20, fall_step=100,
+            tolerance=tolerance, return_evaluations=True)
+
+        # Assert
+        self.assertEqual(diameter.shape, target.shape)
+        self.assertLessEqual(evaluations, 25)
+        for d, t in zip(diameter, target):
+            reached = particle.Particle(d).calculate_distance(
+                release_height=10000, windspeed=20, fall_step=100)
+            too_far = particle.Particle(d * (1 + 2 * tolerance)) \
+                .calculate_distance(release_height=10000, windspeed=20,
+                                    fall_step=100)
+            self.assertGreaterEqual(reached, t)
+            self.assertLess(too_far, t)
+
+    def test_broadcast_release_height(self):
+        # Act
+        diameter = inverse.max_diameter(100, release_height=[5000, 20000],
+                                        fall_step=100)
+
+        # Assert
+        self.assertEqual(diameter.shape, (2,))
+        self.assertLess(diameter[0], diameter[1])
+
+    def test_scalar(self):
+        # Act
+        diameter = inverse.max_diameter(100, fall_step=100,
+                                        density='bp2003')
+
+        # Assert
+        self.assertEqual(np.ndim(diameter), 0)
+        p = particle.Particle(diameter)
+        p.set_size_dependant_density()
+        self.assertGreaterEqual(
+            p.calculate_distance(release_height=10000, fall_step=100), 100)
+
+    def test_outside_bracket(self):
+        # Act
+        diameter = inverse.max_diameter([1e-3, 1e9], fall_step=100,
+                                        bracket=(1e-6, 1e-3))
+
+        # Assert
+        self.assertEqual(diameter[0], 1e-3)
+        self.assertTrue(np.isnan(diameter[1]))
+
+    def test_invalid(self):
+        # Act and assert
+        with self.assertRaises(ValueError):
+            inverse.max_diameter(100, density='unknown')
+        with self.assertRaises(ValueError):
+            inverse.max_diameter(100, bracket=(1e-3, 1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
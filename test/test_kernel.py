@@ -0,0 +1,135 @@
+import importlib.util
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tephrange import kernel
+from tephrange import particle
+
+
+class TestStepKernel(unittest.TestCase):
+    def setUp(self):
+        self.wind_profile = ([0, 8000, 20000], [5, 25, 40], [200, 270, 300])
+
+    def assert_matches_numpy(self, p, q):
+        self.assertEqual(q.current_distance, p.current_distance)
+        self.assertEqual(q.current_travel_time, p.current_travel_time)
+        self.assertEqual(q.current_crosswind_distance,
+                         p.current_crosswind_distance)
+        self.assertEqual(q.function_evaluations, p.function_evaluations)
+        np.testing.assert_array_equal(q.altitude, p.altitude)
+        np.testing.assert_array_equal(q.travel_time, p.travel_time)
+        np.testing.assert_array_equal(q.distance, p.distance)
+
+    def test_python_kernel_matches_numpy(self):
+        for velocity_function in kernel.MODELS:
+            for windspeed in (10, self.wind_profile):
+                with self.subTest(velocity_function=velocity_function,
+                                  windspeed=windspeed):
+                    # Arrange
+                    p = particle.Particle(65e-6, sphericity=0.6,
+                                          particle_density=1800)
+                    p.calculate_distance(
+                        release_height=12345, windspeed=windspeed,
+                        fall_step=20, velocity_function=velocity_function,
+                        record=7)
+                    q = particle.Particle(65e-6, sphericity=0.6,
+                                          particle_density=1800)
+
+                    # Act
+                    q._kernel_distance(12345, windspeed, 20,
+                                       velocity_function, 7,
+                                       step_kernel=kernel._step_kernel)
+
+                    # Assert
+                    self.assert_matches_numpy(p, q)
+
+    @unittest.skipIf(importlib.util.find_spec('numba') is None,
+                     'Numba is not installed')
+    def test_numba_backend_matches_numpy(self):
+        # Arrange
+        p = particle.Particle(500e-6, sphericity=0.8, particle_density=2500)
+        p.calculate_distance(release_height=25000,
+                             windspeed=self.wind_profile)
+        q = particle.Particle(500e-6, sphericity=0.8, particle_density=2500)
+
+        # Act
+        distance = q.calculate_distance(release_height=25000,
+                                        windspeed=self.wind_profile,
+                                        backend='numba')
+
+        # Assert
+        self.assertEqual(distance, p.current_distance / 1000)
+        self.assert_matches_numpy(p, q)
+
+    def test_fractional_fall_step(self):
+        # Repeated subtraction of these steps takes one step too many,
+        # which overran the history buffer
+        step_kernels = [kernel._step_kernel]
+        if kernel.get_step_kernel() is not None:
+            step_kernels.append(kernel.get_step_kernel())
+        for release_height, fall_step in ((1.0, 0.1), (2500, 0.1),
+                                          (5000, 0.2), (15000, 0.3)):
+            # Arrange
+            p = particle.Particle(1e-4)
+            p.calculate_distance(release_height=release_height,
+                                 fall_step=fall_step)
+            for step_kernel in step_kernels:
+                with self.subTest(release_height=release_height,
+                                  fall_step=fall_step,
+                                  step_kernel=step_kernel):
+                    q = particle.Particle(1e-4)
+
+                    # Act
+                    q._kernel_distance(release_height, 10, fall_step,
+                                       'ganser', 'full',
+                                       step_kernel=step_kernel)
+
+                    # Assert
+                    self.assertEqual(q.steps_taken, p.steps_taken)
+                    self.assertEqual(len(q.altitude), p.steps_taken + 1)
+                    self.assertEqual(q.altitude[-1], p.altitude[-1])
+
+    def test_falls_back_without_numba(self):
+        # Arrange
+        p = particle.Particle(100e-6)
+        expected = p.calculate_distance(release_height=5000)
+        q = particle.Particle(100e-6)
+
+        # Act
+        with mock.patch.object(kernel, 'get_step_kernel',
+                               return_value=None):
+            with self.assertWarns(RuntimeWarning):
+                distance = q.calculate_distance(release_height=5000,
+                                                backend='numba')
+
+        # Assert
+        self.assertEqual(distance, expected)
+
+    def test_import_does_not_load_numba(self):
+        # Act
+        result = subprocess.run(
+            [sys.executable, '-c', 'import sys, tephrange.service; '
+             'print("numba" in sys.modules)'],
+            capture_output=True, text=True, check=True)
+
+        # Assert
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_unsupported_options(self):
+        p = particle.Particle(100e-6)
+        with self.assertRaises(ValueError):
+            p.calculate_distance(backend='fortran')
+        with self.assertRaises(ValueError):
+            p.calculate_distance(velocity_function='white', backend='numba')
+        with self.assertRaises(ValueError):
+            p.calculate_distance(backend='numba',
+                                 velocity_cache=particle.fall_velocity.
+                                 VelocityCache())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
 from mock import patch, MagicMock, sentinel, call
+import numpy as np
+import os
+import tempfile
 import unittest
 from tephrange import particle
 from tephrange import fall_velocity
@@ -40,14 +43,103 @@ class TestParticle(unittest.TestCase):
         p._update_travel_history()
 
         # Assert
-        self.assertEqual(p.altitude, [1],
+        self.assertEqual(list(p.altitude), [1],
                          "Current altitude not appended to altitude list")
-        self.assertEqual(p.travel_time, [2],
+        self.assertEqual(list(p.travel_time), [2],
                          "Current travel_time not appended to travel_time"
                          " list")
-        self.assertEqual(p.distance, [4],
+        self.assertEqual(list(p.distance), [4],
                          "Current distance not appended to distance list")
 
+    def test_travel_history_read_only(self):
+        # Arrange
+        p = particle.Particle(0.0001)
+        p.calculate_distance(release_height=100)
+
+        # Act and assert
+        with self.assertRaises(ValueError):
+            p.altitude[0] = 0
+        with self.assertRaises(AttributeError):
+            p.distance = []
+
+    def test_travel_history_grows(self):
+        # Arrange
+        p = particle.Particle(0.0001)
+
+        # Act
+        for i in range(100):
+            p.current_altitude = i
+            p._update_travel_history()
+
+        # Assert
+        np.testing.assert_array_equal(p.altitude, np.arange(100))
+
+    def test_calculate_distance_record_options(self):
+        # Arrange
+        expected_distance = particle.Particle(0.0001).calculate_distance(
+            release_height=1000)
+        expected_lengths = {'full': 101, 'none': 0, 30: 5}
+
+        for record, expected_length in expected_lengths.items():
+            p = particle.Particle(0.0001)
+
+            # Act
+            distance = p.calculate_distance(release_height=1000,
+                                            record=record)
+
+            # Assert
+            self.assertEqual(distance, expected_distance)
+            self.assertEqual(len(p.altitude), expected_length,
+                             "Wrong history length for {}".format(record))
+        self.assertEqual(list(p.altitude), [1000, 700, 400, 100, 0])
+
+    def test_calculate_distance_record_altitudes(self):
+        # Arrange
+        p = particle.Particle(0.0001)
+
+        # Act
+        p.calculate_distance(release_height=1000, fall_step=10,
+                             record=[2000, 905, 500, -1])
+
+        # Assert
+        self.assertEqual(list(p.altitude), [900, 500, 0])
+
+    def test_calculate_distance_record_fractional_step(self):
+        # Repeated subtraction of these steps takes one step too many
+        for release_height, fall_step in ((1.0, 0.1), (2500, 0.1),
+                                          (5000, 0.2), (15000, 0.3)):
+            with self.subTest(release_height=release_height,
+                              fall_step=fall_step):
+                # Arrange
+                p = particle.Particle(0.0001)
+                n_steps = round(release_height / fall_step)
+
+                # Act
+                p.calculate_distance(release_height=release_height,
+                                     fall_step=fall_step)
+
+                # Assert
+                self.assertEqual(p.steps_taken, n_steps)
+                self.assertEqual(len(p.altitude), n_steps + 1)
+                self.assertAlmostEqual(p.altitude[-1], 0, places=9)
+
+        # Act
+        p = particle.Particle(0.0001)
+        p.calculate_distance(release_height=1.0, fall_step=0.1, record=5)
+
+        # Assert
+        self.assertEqual(list(p.altitude), [1.0, 0.5, 0.0])
+
+    def test_calculate_distance_record_invalid(self):
+        # Arrange
+        p = particle.Particle(0.0001)
+
+        # Act and assert
+        with self.assertRaises(ValueError):
+            p.calculate_distance(record='some')
+        with self.assertRaises(ValueError):
+            p.calculate_distance(record=0)
+
     def test_calc_fall_time_above_altitude(self):
         # Arrange
         expected_time = 1
@@ -90,7 +182,7 @@ class TestParticle(unittest.TestCase):
         with self.assertRaises(ValueError):
             p.get_fall_velocity(100, 100, 'invalid')
 
-    @patch.object(particle.fall_velocity, 'ganser')
+    @patch.object(particle.fall_velocity, '_ganser_solve')
     def test_get_fall_velocity_ganser(self, m_ganser):
         # Arrange
         m_ganser.return_value = 9999
@@ -100,6 +192,7 @@ class TestParticle(unittest.TestCase):
         p = particle.Particle(diameter)
         p.sphericity = 0.5
         p.density = 5678
+        k1, k2 = fall_velocity._ganser_shape_factors(0.5)
 
         # Act
         v_terminal = p.get_fall_velocity(atm_density=atm_density,
@@ -109,11 +202,40 @@ class TestParticle(unittest.TestCase):
         # Assert
         self.assertEqual(v_terminal, 9999,
                          "v_terminal was not 9999 ({})".format(v_terminal))
-        m_ganser.assert_called_once_with(diameter=diameter,
-                                         sphericity=0.5,
-                                         density=5678,
-                                         atm_density=atm_density,
-                                         atm_viscosity=atm_viscosity)
+        m_ganser.assert_called_once_with(diameter, k1, k2, 5678,
+                                         atm_density, atm_viscosity, None,
+                                         1e-10, 50, False)
+
+    @patch.object(particle.fall_velocity, '_ganser_shape_factors',
+                  wraps=fall_velocity._ganser_shape_factors)
+    def test_calculate_distance_binds_model_once(self, m_shape_factors):
+        # Arrange
+        p = particle.Particle(0.0001, sphericity=0.5)
+
+        # Act
+        p.calculate_distance(release_height=1000, fall_step=10)
+
+        # Assert
+        m_shape_factors.assert_called_once_with(0.5)
+        self.assertEqual(p.function_evaluations, 100)
+
+    def test_calculate_distance_custom_model(self):
+        # Arrange
+        def constant(diameter, sphericity, density, atm_density,
+                     atm_viscosity):
+            return np.full(np.shape(atm_density), 2.0)[()]
+
+        fall_velocity.register_model('constant', constant)
+        self.addCleanup(fall_velocity.MODELS.pop, 'constant')
+        p = particle.Particle(0.0001)
+
+        # Act
+        distance = p.calculate_distance(release_height=1000, windspeed=10,
+                                        velocity_function='constant')
+
+        # Assert
+        self.assertAlmostEqual(distance, 5)
+        self.assertAlmostEqual(p.current_travel_time, 500)
 
     @patch.object(particle.fall_velocity, 'stokes')
     def test_get_fall_velocity_stokes(self, m_stokes):
@@ -187,9 +309,10 @@ class TestParticle(unittest.TestCase):
                                         atm_density=atm_density,
                                         atm_viscosity=atm_viscosity)
 
-    @patch.object(particle.atmos, 'get_density', return_value=sentinel.density)
-    @patch.object(particle.atmos, 'get_viscosity', return_value=sentinel.visc)
-    def test_calc_step_movement(self, m_viscosity, m_density):
+    @patch.object(particle.atmos, 'get_atmos_state',
+                  return_value=(sentinel.temp, sentinel.press,
+                                sentinel.density, sentinel.visc))
+    def test_calc_step_movement(self, m_atmos_state):
         # Arrange
         diameter = 0.0001
         p = particle.Particle(diameter)
@@ -205,8 +328,7 @@ class TestParticle(unittest.TestCase):
                                               sentinel.windspeed)
 
         # Assert
-        m_density.assert_called_once_with(sentinel.altitude)
-        m_viscosity.assert_called_once_with(sentinel.altitude)
+        m_atmos_state.assert_called_once_with(sentinel.altitude)
         p.get_fall_velocity.assert_called_once_with(
             sentinel.density, sentinel.visc, 'ganser')
         p._calc_fall_time_and_distance.assert_called_once_with(
@@ -239,13 +361,320 @@ class TestParticle(unittest.TestCase):
         distance = p.calculate_distance(release_height=30,
                                         windspeed=sentinel.ws,
                                         fall_step=10,
-                                        velocity_function=sentinel.func)
+                                        velocity_function='stokes')
 
         # Assert
         self.assertEqual(distance, 3,
                          "Particle did not travel 3 km ({})".format(distance))
         m_step_movement.assert_has_calls(
-            [call(sentinel.func, 10, sentinel.ws)])
+            [call('stokes', 10, sentinel.ws)])
+
+    def test_calculate_distance_quadrature(self):
+        # Arrange
+        p_step = particle.Particle(65e-6, sphericity=0.7,
+                                   particle_density=2000)
+        p_quad = particle.Particle(65e-6, sphericity=0.7,
+                                   particle_density=2000)
+
+        # Act
+        expected = p_step.calculate_distance(release_height=10000,
+                                             windspeed=10, fall_step=1)
+        distance = p_quad.calculate_distance(release_height=10000,
+                                             windspeed=10,
+                                             method='quadrature')
+
+        # Assert
+        self.assertAlmostEqual(distance / expected, 1, places=4)
+        self.assertEqual(list(p_quad.altitude), [10000, 0])
+        self.assertEqual(p_quad.distance[-1], distance * 1000)
+        self.assertLessEqual(p_quad.function_evaluations, 60)
+
+    def test_calculate_distance_quadrature_all_models(self):
+        for velocity_function in particle.fall_velocity.MODELS:
+            with self.subTest(velocity_function=velocity_function):
+                # Arrange
+                p_step = particle.Particle(65e-6)
+                try:
+                    expected = p_step.calculate_distance(
+                        release_height=2000, fall_step=10,
+                        velocity_function=velocity_function)
+                except NotImplementedError:
+                    continue
+                p_quad = particle.Particle(65e-6)
+
+                # Act
+                distance = p_quad.calculate_distance(
+                    release_height=2000, method='quadrature',
+                    velocity_function=velocity_function)
+
+                # Assert
+                self.assertAlmostEqual(distance / expected, 1, places=3)
+
+    def test_calculate_distance_adaptive(self):
+        # Arrange
+        reference = particle.Particle(10e-6, sphericity=0.5,
+                                      particle_density=1000)
+        expected = reference.calculate_distance(release_height=25000,
+                                                method='quadrature',
+                                                tolerance=1e-11)
+        p = particle.Particle(10e-6, sphericity=0.5, particle_density=1000)
+
+        # Act
+        distance = p.calculate_distance(release_height=25000,
+                                        method='adaptive', tolerance=1e-6)
+
+        # Assert
+        self.assertAlmostEqual(distance / expected, 1, places=6)
+        self.assertLess(p.steps_taken, 500)
+        self.assertEqual(p.function_evaluations,
+                         p.steps_taken + p.steps_rejected + 1)
+        self.assertEqual(len(p.altitude), p.steps_taken + 1)
+        for boundary in particle.atmos.BREAKPOINTS + (0,):
+            self.assertIn(boundary, p.altitude)
+        self.assertEqual(p.distance[-1], distance * 1000)
+
+    def test_calculate_distance_adaptive_record(self):
+        # Arrange
+        p_levels = particle.Particle(65e-6)
+        p_none = particle.Particle(65e-6)
+
+        # Act
+        p_levels.calculate_distance(release_height=5000, method='adaptive',
+                                    record=[4000, 1234.5, 6000])
+        p_none.calculate_distance(release_height=5000, method='adaptive',
+                                  record='none')
+
+        # Assert
+        self.assertEqual(list(p_levels.altitude), [4000, 1234.5])
+        self.assertEqual(len(p_none.altitude), 0)
+        self.assertAlmostEqual(p_none.current_distance /
+                               p_levels.current_distance, 1, places=6)
+
+    def test_calculate_distance_adaptive_record_below_ground(self):
+        # Arrange
+        p_levels = particle.Particle(1e-4)
+        p_none = particle.Particle(1e-4)
+        p_ground = particle.Particle(1e-4)
+
+        # Act
+        p_levels.calculate_distance(method='adaptive', record=[5000, -100])
+        p_none.calculate_distance(method='adaptive', record='none')
+        distance = p_ground.calculate_distance(release_height=0,
+                                               method='adaptive',
+                                               record=[-100])
+
+        # Assert
+        self.assertEqual(list(p_levels.altitude), [5000])
+        self.assertEqual(p_levels.current_altitude, 0)
+        self.assertAlmostEqual(p_none.current_distance /
+                               p_levels.current_distance, 1, places=6)
+        self.assertEqual(distance, 0)
+
+    def test_calculate_distance_adaptive_wind_profile(self):
+        # Arrange
+        profile = ([0, 5000, 12000], [5, 20, 40], [180, 250, 290])
+        p_step = particle.Particle(100e-6)
+        p_step.calculate_distance(release_height=12000, windspeed=profile,
+                                  fall_step=0.5, record='none')
+        p = particle.Particle(100e-6)
+
+        # Act
+        p.calculate_distance(release_height=12000, windspeed=profile,
+                             method='adaptive', record='none')
+
+        # Assert
+        self.assertAlmostEqual(p.current_distance / p_step.current_distance,
+                               1, places=4)
+        self.assertAlmostEqual(p.current_crosswind_distance /
+                               p_step.current_crosswind_distance, 1,
+                               places=4)
+
+    def test_calculate_distance_atmosphere_table(self):
+        # Arrange
+        table = particle.atmos.AtmosphereTable(max_altitude=12000)
+        p_exact = particle.Particle(65e-6)
+        p_table = particle.Particle(65e-6)
+
+        # Act
+        expected = p_exact.calculate_distance(release_height=10000)
+        distance = p_table.calculate_distance(release_height=10000,
+                                              atmosphere=table)
+
+        # Assert
+        self.assertIs(p_table.atmosphere, table)
+        self.assertAlmostEqual(distance / expected, 1, places=6)
+
+    def test_calculate_distance_velocity_cache(self):
+        # Arrange
+        cache = fall_velocity.VelocityCache()
+        expected = particle.Particle(65e-6).calculate_distance(
+            release_height=2000)
+
+        # Act
+        distance = particle.Particle(65e-6).calculate_distance(
+            release_height=2000, velocity_cache=cache)
+        lower = particle.Particle(65e-6).calculate_distance(
+            release_height=1000, velocity_cache=cache)
+
+        # Assert
+        self.assertEqual(distance, expected)
+        self.assertEqual(cache.misses, 200)
+        self.assertEqual(cache.hits, 100)
+        self.assertGreater(distance, lower)
+
+    def test_calculate_distance_constant_profile(self):
+        # Arrange
+        expected = particle.Particle(1e-4).calculate_distance(
+            release_height=2000, windspeed=15)
+        p = particle.Particle(1e-4)
+
+        # Act
+        distance = p.calculate_distance(
+            release_height=2000, windspeed=([0, 3000], [15, 15], [200, 200]))
+
+        # Assert
+        self.assertAlmostEqual(distance / expected, 1, places=12)
+        self.assertAlmostEqual(p.current_crosswind_distance, 0, places=6)
+
+    def test_calculate_distance_wind_profile(self):
+        # Arrange
+        p = particle.Particle(1e-3)
+        expected_along = 0
+        expected_cross = 0
+        p.calculate_distance(release_height=1000, windspeed=0, fall_step=10)
+        step_times = np.diff(p.travel_time)
+        for altitude, fall_time in zip(p.altitude, step_times):
+            expected_along += 10 * fall_time
+            expected_cross += (1000 - altitude) / 100.0 * fall_time
+
+        # Act
+        p = particle.Particle(1e-3)
+        distance = p.calculate_distance(
+            release_height=1000, windspeed=lambda z: (z * 0 + 10, z * 0),
+            fall_step=10)
+        p_cross = particle.Particle(1e-3)
+        p_cross.calculate_distance(
+            release_height=1000, fall_step=10,
+            windspeed=([0, 1000], [np.hypot(10, 10), 10], [315, 0]))
+
+        # Assert
+        self.assertAlmostEqual(distance * 1000 / expected_along, 1, places=9)
+        self.assertAlmostEqual(p_cross.current_distance / expected_along, 1,
+                               places=9)
+        self.assertAlmostEqual(p_cross.current_crosswind_distance /
+                               expected_cross, 1, places=9)
+
+    def test_calculate_distance_quadrature_profile(self):
+        # Arrange
+        p = particle.Particle(0.0001)
+
+        # Act and assert
+        with self.assertRaises(ValueError):
+            p.calculate_distance(windspeed=([0, 1000], [10, 20]),
+                                 method='quadrature')
+
+    def test_calculate_distance_profile_function_sampled_once(self):
+        # Arrange
+        p = particle.Particle(0.0001)
+        from_function = particle.wind.WindProfile.from_function
+
+        # Act
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                particle.cache.ResultCache(os.path.join(tmpdir, 'cache')), \
+                patch.object(particle.wind.WindProfile, 'from_function',
+                             side_effect=from_function) as mock_from_function:
+            p.calculate_distance(release_height=1000,
+                                 windspeed=lambda altitude: 10 + 0 * altitude)
+
+        # Assert
+        mock_from_function.assert_called_once()
+
+    def test_calculate_distance_invalid_method(self):
+        # Arrange
+        p = particle.Particle(0.0001)
+
+        # Act and assert
+        with self.assertRaises(ValueError):
+            p.calculate_distance(method='invalid')
+
+
+class TestParticleEnsemble(unittest.TestCase):
+    def test_calculate_distance_matches_particle(self):
+        # Arrange
+        diameter = np.array([10, 65, 250, 1000]) / 1.0e6
+        sphericity = np.array([0.5, 0.7, 0.9, 1.0])
+        release_height = np.array([3000, 10000, 15000, 25005])
+        ensemble = particle.ParticleEnsemble(diameter, sphericity, 2000)
+
+        # Act
+        distance, travel_time = ensemble.calculate_distance(
+            release_height=release_height, windspeed=15, fall_step=50)
+
+        # Assert
+        for i, diam in enumerate(diameter):
+            p = particle.Particle(diam, sphericity=sphericity[i],
+                                  particle_density=2000)
+            expected = p.calculate_distance(release_height=release_height[i],
+                                            windspeed=15, fall_step=50)
+            self.assertAlmostEqual(distance[i] / expected, 1, places=9)
+            self.assertAlmostEqual(travel_time[i] / p.current_travel_time, 1,
+                                   places=9)
+
+    def test_calculate_distance_atmosphere_table(self):
+        # Arrange
+        table = particle.atmos.AtmosphereTable(max_altitude=12000)
+        ensemble = particle.ParticleEnsemble([1e-5, 1e-4, 1e-3])
+
+        # Act
+        expected, _ = ensemble.calculate_distance(release_height=10000)
+        distance, _ = ensemble.calculate_distance(release_height=10000,
+                                                  atmosphere=table)
+
+        # Assert
+        np.testing.assert_allclose(distance, expected, rtol=1e-6)
+
+    def test_calculate_distance_wind_profile(self):
+        # Arrange
+        diameter = [1e-4, 1e-3]
+        release_height = [3000, 8000]
+        profile = particle.wind.WindProfile([0, 4000, 8000], [5, 20, 30],
+                                            direction=[300, 270, 250])
+        ensemble = particle.ParticleEnsemble(diameter)
+
+        # Act
+        distance, _ = ensemble.calculate_distance(
+            release_height=release_height, windspeed=profile, fall_step=50)
+
+        # Assert
+        for i, diam in enumerate(diameter):
+            p = particle.Particle(diam)
+            expected = p.calculate_distance(release_height=release_height[i],
+                                            windspeed=profile, fall_step=50)
+            self.assertAlmostEqual(distance[i] / expected, 1, places=9)
+            self.assertAlmostEqual(
+                ensemble.current_crosswind_distance[i] /
+                p.current_crosswind_distance, 1, places=9)
+
+    def test_calculate_distance_landed(self):
+        # Arrange
+        ensemble = particle.ParticleEnsemble([0.0001, 0.001])
+
+        # Act
+        distance, travel_time = ensemble.calculate_distance(
+            release_height=[0, 100], windspeed=10, fall_step=10)
+
+        # Assert
+        self.assertEqual(distance[0], 0)
+        self.assertEqual(travel_time[0], 0)
+        self.assertGreater(distance[1], 0)
+
+    def test_get_fall_velocity_invalid(self):
+        # Arrange
+        ensemble = particle.ParticleEnsemble([0.0001, 0.001])
+
+        # Act and assert
+        with self.assertRaises(ValueError):
+            ensemble.get_fall_velocity(100, 100, 'invalid')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,115 @@
+import numpy as np
+import unittest
+
+from tephrange import fall_velocity
+from tephrange import quadrature
+from tephrange.particle import Particle, ParticleEnsemble
+
+
+class TestGaussKronrod(unittest.TestCase):
+    def test_polynomial_exact(self):
+        # Arrange, act
+        integral, error, n_evaluations = quadrature.gauss_kronrod(
+            lambda x: x**5 - 3*x**2, 0, 2)
+
+        # Assert
+        self.assertAlmostEqual(integral, 2**6 / 6.0 - 8, places=12)
+        self.assertEqual(n_evaluations, 15)
+
+    def test_breakpoints(self):
+        # Arrange
+        def kinked(x):
+            return np.abs(x - 1)
+
+        # Act
+        integral, error, n_evaluations = quadrature.gauss_kronrod(
+            kinked, 0, 3, breakpoints=(-1, 1, 5))
+
+        # Assert
+        self.assertAlmostEqual(integral, 2.5, places=12)
+        self.assertEqual(n_evaluations, 30)
+
+    def test_adaptive_tolerance(self):
+        # Arrange
+        tolerance = 1e-10
+
+        # Act
+        integral, error, n_evaluations = quadrature.gauss_kronrod(
+            lambda x: 1 / np.sqrt(x), 1e-6, 1, tolerance=tolerance)
+
+        # Assert
+        expected = 2 - 2 * np.sqrt(1e-6)
+        self.assertLess(abs(integral / expected - 1), tolerance)
+        self.assertGreater(n_evaluations, 15)
+
+    def test_max_evaluations(self):
+        # Act and assert
+        with self.assertRaises(RuntimeError):
+            quadrature.gauss_kronrod(lambda x: 1 / np.sqrt(x), 1e-12, 1,
+                                     tolerance=1e-14, max_evaluations=100)
+
+
+class TestStokesTravelTime(unittest.TestCase):
+    def test_matches_adaptive_quadrature(self):
+        # Arrange
+        expected = []
+        for release_height in (5000, 11000, 30000):
+            particle = Particle(65e-6, particle_density=2000)
+            particle.calculate_distance(release_height=release_height,
+                                        velocity_function='stokes',
+                                        method='quadrature', tolerance=1e-12)
+            expected.append(particle.current_travel_time)
+
+        # Act
+        travel_time = quadrature.stokes_travel_time(
+            65e-6, 2000, [5000, 11000, 30000])
+
+        # Assert
+        np.testing.assert_allclose(travel_time, expected, rtol=1e-10)
+
+    def test_sea_level(self):
+        # Act
+        travel_time = quadrature.stokes_travel_time(
+            1e-5, 2300, 1000, velocity_function='stokes_sea_level')
+
+        # Assert
+        velocity = fall_velocity.stokes(1e-5, density=2300)
+        self.assertAlmostEqual(travel_time, 1000 / velocity, places=6)
+
+    def test_zero_height(self):
+        # Act
+        travel_time = quadrature.stokes_travel_time([1e-5, 2e-5], 2300, 0)
+
+        # Assert
+        np.testing.assert_array_equal(travel_time, [0, 0])
+
+    def test_other_model(self):
+        # Act and assert
+        with self.assertRaises(ValueError):
+            quadrature.stokes_travel_time(1e-5, velocity_function='ganser')
+
+    def test_ensemble_quadrature(self):
+        # Arrange
+        diameter = np.array([1e-5, 3e-5, 6e-5])
+        stepped = ParticleEnsemble(diameter, 1, 2300)
+        distance, travel_time = stepped.calculate_distance(
+            release_height=12000, windspeed=5, fall_step=1,
+            velocity_function='stokes')
+
+        # Act
+        ensemble = ParticleEnsemble(diameter, 1, 2300)
+        result = ensemble.calculate_distance(
+            release_height=12000, windspeed=5, velocity_function='stokes',
+            method='quadrature')
+
+        # Assert
+        np.testing.assert_allclose(result[1], travel_time, rtol=1e-4)
+        np.testing.assert_allclose(result[0], distance, rtol=1e-4)
+        np.testing.assert_array_equal(ensemble.current_altitude, 0)
+        with self.assertRaises(ValueError):
+            ensemble.calculate_distance(velocity_function='ganser',
+                                        method='quadrature')
+
+
+if __name__ == '__main__':
+    unittest.main()
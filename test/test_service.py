@@ -0,0 +1,152 @@
+import asyncio
+import json
+import unittest
+import warnings
+
+import numpy as np
+
+from tephrange import atmos
+from tephrange import fall_velocity
+from tephrange.particle import ParticleEnsemble
+from tephrange.service import Service
+
+
+class TestService(unittest.IsolatedAsyncioTestCase):
+    async def test_distance_batches_requests(self):
+        # Arrange
+        service = Service(max_batch_size=1000, max_latency=0.05)
+        diameter = np.logspace(-4, -3, 20)
+        expected, expected_time = ParticleEnsemble(
+            diameter).calculate_distance(release_height=2000, fall_step=100)
+
+        # Act
+        responses = await asyncio.gather(*[
+            service.handle('POST', '/distance', json.dumps(
+                {'diameter': d, 'release_height': 2000,
+                 'fall_step': 100}).encode())
+            for d in diameter])
+
+        # Assert
+        self.assertEqual([status for status, _ in responses], [200] * 20)
+        np.testing.assert_allclose(
+            [payload['distance'] for _, payload in responses], expected)
+        np.testing.assert_allclose(
+            [payload['travel_time'] for _, payload in responses],
+            expected_time)
+        metrics = service.metrics.to_dict()
+        self.assertEqual(metrics['batches'], 1)
+        self.assertEqual(metrics['requests'], 20)
+        self.assertEqual(metrics['mean_batch_size'], 20)
+
+    async def test_batch_size_and_settings(self):
+        # Arrange
+        service = Service(max_batch_size=4, max_latency=10)
+        bodies = [{'diameter': [1e-4, 2e-4]}, {'diameter': [3e-4, 4e-4]},
+                  {'diameter': 1e-4, 'velocity_function': 'stokes'}]
+
+        # Act
+        # The first two fill a batch; the stokes request is batched
+        # separately and waits for the latency limit
+        tasks = [asyncio.ensure_future(service.handle(
+            'POST', '/velocity', json.dumps(body).encode()))
+            for body in bodies]
+        first, second = await asyncio.gather(*tasks[:2])
+
+        # Assert
+        self.assertEqual(first[0], 200)
+        np.testing.assert_allclose(
+            first[1]['velocity'] + second[1]['velocity'],
+            fall_velocity.ganser(np.array([1e-4, 2e-4, 3e-4, 4e-4]), 0.7,
+                                 2300, *atmos.get_atmos_state(0)[2:]),
+            rtol=1e-6)
+        self.assertFalse(tasks[2].done())
+        self.assertEqual(service.metrics.batches, 1)
+        service._flush(('/velocity', ('velocity_function', 'stokes')))
+        status, payload = await tasks[2]
+        self.assertEqual(status, 200)
+        self.assertIsInstance(payload['velocity'], float)
+
+    async def test_bad_requests(self):
+        service = Service()
+        requests = [('POST', '/velocity', b'not json', 400),
+                    ('POST', '/velocity', b'{"sphericity": 0.7}', 400),
+                    ('POST', '/velocity', b'{"diameter": -1}', 400),
+                    ('POST', '/velocity', b'{"diameter": 1, "x": 1}', 400),
+                    ('POST', '/distance',
+                     b'{"diameter": 1, "fall_step": 0}', 400),
+                    ('POST', '/distance',
+                     b'{"diameter": [1, 2], "windspeed": [1, 2, 3]}', 400),
+                    ('POST', '/velocity',
+                     b'{"diameter": 1, "velocity_function": "x"}', 400),
+                    ('POST', '/velocity',
+                     b'{"diameter": 1e-4, "sphericity": 5}', 400),
+                    ('POST', '/velocity',
+                     b'{"diameter": 1e-4, "density": -5}', 400),
+                    ('POST', '/velocity',
+                     b'{"diameter": 1e-4, "altitude": 1e6}', 400),
+                    ('POST', '/distance',
+                     b'{"diameter": 1e-4, "release_height": 1e7}', 400),
+                    ('POST', '/velocity',
+                     b'{"diameter": 1e-4, "velocity_function": "white"}',
+                     400),
+                    ('POST', '/distance',
+                     b'{"diameter": 1e-4, "windspeed": NaN}', 400),
+                    ('GET', '/velocity', b'', 405),
+                    ('POST', '/unknown', b'', 404)]
+
+        for method, path, body, expected in requests:
+            status, payload = await service.handle(method, path, body)
+            self.assertEqual(status, expected, msg=body)
+            self.assertIn('error', payload)
+        self.assertEqual(service.metrics.errors, 13)
+
+    async def test_non_finite_results(self):
+        # Arrange
+        service = Service(max_latency=0.001)
+
+        # Act
+        # Particles lighter than air have no fall velocity
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            status, payload = await service.handle(
+                'POST', '/velocity', b'{"diameter": [1e-4, 1e-4], '
+                b'"density": [2300, 1]}')
+
+        # Assert
+        self.assertEqual(status, 200)
+        self.assertIsInstance(payload['velocity'][0], float)
+        self.assertIsNone(payload['velocity'][1])
+        json.dumps(payload, allow_nan=False)
+
+    async def test_http(self):
+        # Arrange
+        service = Service(max_latency=0.01)
+        server = await asyncio.start_server(service._serve_connection,
+                                            '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        body = json.dumps({'diameter': 1e-4, 'density': 'bp2003',
+                           'altitude': 10000}).encode()
+
+        # Act
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            for request in ['POST /velocity HTTP/1.1\r\nContent-Length: '
+                            '{}\r\n\r\n'.format(len(body)).encode() + body,
+                            b'GET /metrics HTTP/1.1\r\nConnection: close'
+                            b'\r\n\r\n']:
+                writer.write(request)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+
+        # Assert
+        first, second = response.split(b'HTTP/1.1 ')[1:]
+        self.assertTrue(first.startswith(b'200 OK'))
+        velocity = json.loads(first.partition(b'\r\n\r\n')[2])['velocity']
+        self.assertAlmostEqual(velocity, 0.3775951, places=6)
+        metrics = json.loads(second.partition(b'\r\n\r\n')[2])
+        self.assertEqual(metrics['requests'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
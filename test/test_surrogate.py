@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from tephrange import surrogate
+from tephrange.particle import Particle
+from tephrange.surrogate import TravelTimeTable
+
+GRID = dict(diameter=np.logspace(-5, -3, 41),
+            sphericity=np.linspace(0.5, 1, 11),
+            density=np.linspace(1000, 2500, 7),
+            release_height=np.linspace(1000, 20000, 39))
+
+
+class TestTravelTimeTable(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.table = TravelTimeTable.build(**GRID, n_checks=200)
+
+    def test_build_metadata(self):
+        metadata = self.table.metadata
+        self.assertEqual(metadata['velocity_function'], 'ganser')
+        self.assertEqual(metadata['n_checks'], 200)
+        self.assertLess(self.table.max_relative_error, 1e-2)
+        self.assertLessEqual(metadata['rms_relative_error'],
+                             metadata['max_relative_error'])
+        self.assertEqual(self.table.log_slowness.shape, (41, 11, 7, 39))
+
+    def test_paired_log_slowness(self):
+        # Arrange
+        diameter = np.array([2e-5, 1e-4, 5e-4])
+        sphericity = np.array([0.6, 0.8, 1.0])
+        density = np.array([1200, 2000, 2400.0])
+        release_height = np.array([1500, 9000, 17250.0])
+        settings = dict(velocity_function='ganser', fall_step=500,
+                        atmosphere=surrogate.atmos)
+
+        # Act
+        paired = surrogate._paired_log_slowness(
+            diameter, sphericity, density, release_height, **settings)
+
+        # Assert
+        expected = np.diagonal(surrogate._log_slowness(
+            diameter, sphericity, density, release_height=release_height,
+            **settings))
+        np.testing.assert_allclose(paired, expected, rtol=1e-12)
+
+    def test_travel_time_on_grid(self):
+        # Arrange
+        diameter, sphericity, density, height = [
+            GRID[name][i] for name, i in zip(GRID, [10, 3, 2, 18])]
+        particle = Particle(diameter, sphericity, density)
+        particle.calculate_distance(release_height=height, method='adaptive',
+                                    tolerance=1e-10)
+        expected = particle.current_travel_time
+
+        # Act
+        travel_time = self.table.travel_time(diameter, sphericity, density,
+                                             height)
+
+        # Assert
+        self.assertAlmostEqual(travel_time / expected, 1, places=6)
+
+    def test_distance_off_grid(self):
+        # Arrange
+        cases = [(3.3e-5, 0.55, 1234, 7777, 10), (2e-4, 0.9, 2300, 15000, 25),
+                 (8e-4, 0.7, 1100, 2500, 5)]
+        for diameter, sphericity, density, height, windspeed in cases:
+            particle = Particle(diameter, sphericity, density)
+            expected = particle.calculate_distance(
+                release_height=height, windspeed=windspeed,
+                method='adaptive', tolerance=1e-10)
+
+            # Act
+            distance = self.table.distance(diameter, sphericity, density,
+                                           height, windspeed)
+
+            # Assert
+            self.assertLess(abs(distance / expected - 1),
+                            self.table.max_relative_error)
+
+    def test_travel_time_array(self):
+        # Arrange
+        diameter = np.array([[2e-5, 1e-4], [3e-4, 9e-4]])
+
+        # Act
+        travel_time = self.table.travel_time(diameter, 0.7, 2000, 12000)
+
+        # Assert
+        self.assertEqual(travel_time.shape, (2, 2))
+        for index in np.ndindex(2, 2):
+            self.assertEqual(travel_time[index], self.table.travel_time(
+                diameter[index], 0.7, 2000, 12000))
+
+    def test_travel_time_out_of_range(self):
+        bad_inputs = [dict(diameter=1e-6), dict(sphericity=0.4),
+                      dict(density=3000), dict(release_height=[500, 2000])]
+        for bad_input in bad_inputs:
+            kwargs = dict(diameter=1e-4, sphericity=0.7, density=2000,
+                          release_height=10000)
+            kwargs.update(bad_input)
+            with self.assertRaises(ValueError, msg=str(bad_input)):
+                self.table.travel_time(**kwargs)
+
+    def test_save_load(self):
+        query = (np.logspace(-5, -3, 50), 0.8, 1500, 9000)
+        expected = self.table.travel_time(*query)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'table.npz')
+            self.table.save(path)
+            for mmap in (True, False):
+                # Act
+                table = TravelTimeTable.load(path, mmap=mmap)
+
+                # Assert
+                self.assertEqual(isinstance(table.log_slowness, np.memmap),
+                                 mmap)
+                self.assertEqual(table.metadata, self.table.metadata)
+                np.testing.assert_array_equal(table.travel_time(*query),
+                                              expected)
+                del table
+
+    def test_build_bad_grid(self):
+        bad_inputs = [dict(diameter=[1e-4]), dict(density=[2000, 1000]),
+                      dict(diameter=[0, 1e-4]), dict(sphericity=[0.5, 1.1])]
+        for bad_input in bad_inputs:
+            kwargs = dict(GRID)
+            kwargs.update(bad_input)
+            with self.assertRaises(ValueError, msg=str(bad_input)):
+                TravelTimeTable.build(**kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import multiprocessing
+import numpy as np
+import unittest
+from unittest import mock
+
+from tephrange import fall_velocity
+from tephrange import particle
+from tephrange import sweep
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.diameter = np.array([30, 100, 500]) / 1.0e6
+        self.release_height = [1000, 2500]
+        self.windspeed = [5, 20]
+
+    def test_labelled_result(self):
+        # Act
+        result = sweep.sweep(self.diameter, sphericity=[0.5, 0.9],
+                             density=[1000, 2000],
+                             release_height=self.release_height,
+                             windspeed=self.windspeed,
+                             velocity_function=['ganser', 'stokes'],
+                             fall_step=50, workers=1)
+
+        # Assert
+        self.assertEqual(result.dims, sweep.DIMS)
+        self.assertEqual(result.shape, (2, 3, 2, 2, 2, 2))
+        self.assertEqual(result.travel_time.shape, result.shape)
+        for dim, size in zip(result.dims, result.shape):
+            self.assertEqual(len(result.coords[dim]), size)
+
+        # Check one point against a single particle
+        p = particle.Particle(self.diameter[1], sphericity=0.9,
+                              particle_density=1000)
+        expected = p.calculate_distance(release_height=2500, windspeed=20,
+                                        fall_step=50,
+                                        velocity_function='stokes')
+        self.assertAlmostEqual(result.distance[1, 1, 1, 0, 1, 1] / expected,
+                               1, places=9)
+        self.assertAlmostEqual(result.travel_time[1, 1, 1, 0, 1, 0] /
+                               p.current_travel_time, 1, places=9)
+
+    def test_size_dependant_density(self):
+        # Act
+        result = sweep.sweep(self.diameter, density={'rho_pumice': 500},
+                             release_height=1000, fall_step=50, workers=1)
+
+        # Assert
+        self.assertNotIn('density', result.dims)
+        self.assertEqual(result.shape, (1, 3, 1, 1, 1))
+        p = particle.Particle(self.diameter[2])
+        p.set_size_dependant_density(rho_pumice=500)
+        expected = p.calculate_distance(release_height=1000, fall_step=50)
+        self.assertAlmostEqual(result.distance[0, 2, 0, 0, 0] / expected, 1,
+                               places=9)
+
+    def test_invalid_density_model(self):
+        # Act and assert
+        with self.assertRaises(ValueError):
+            sweep.sweep(self.diameter, density='unknown', workers=1)
+
+    def test_workers(self):
+        # Arrange
+        kwargs = dict(sphericity=[0.6, 0.8], release_height=self.release_height,
+                      windspeed=self.windspeed, fall_step=100)
+        expected = sweep.sweep(self.diameter, workers=1, **kwargs)
+
+        # Act
+        result = sweep.sweep(self.diameter, workers=2, chunk_size=3, **kwargs)
+
+        # Assert
+        np.testing.assert_array_equal(result.distance, expected.distance)
+
+    def test_workers_registered_model(self):
+        # Arrange
+        # A model registered at run time does not exist in workers that
+        # are spawned rather than forked
+        fall_velocity.register_model('stokes_copy',
+                                     fall_velocity._stokes_model)
+        self.addCleanup(fall_velocity.MODELS.pop, 'stokes_copy')
+        kwargs = dict(release_height=self.release_height,
+                      windspeed=self.windspeed, fall_step=100)
+        expected = sweep.sweep(self.diameter, velocity_function='stokes',
+                               workers=1, **kwargs)
+        executor = functools.partial(
+            ProcessPoolExecutor,
+            mp_context=multiprocessing.get_context('spawn'))
+
+        # Act
+        with mock.patch.object(sweep, 'ProcessPoolExecutor', executor):
+            result = sweep.sweep(self.diameter,
+                                 velocity_function='stokes_copy', workers=2,
+                                 chunk_size=3, **kwargs)
+
+        # Assert
+        np.testing.assert_array_equal(result.distance, expected.distance)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import numpy as np
+import unittest
+
+from tephrange import wind
+
+
+class TestWindProfile(unittest.TestCase):
+    def test_components(self):
+        # Arrange
+        profile = wind.WindProfile([0, 1000], [10, 20], direction=[270, 180])
+
+        # Act
+        east, north = profile.get_components(np.array([0, 1000, 2000]))
+
+        # Assert
+        np.testing.assert_allclose(east, [10, 0, 0], atol=1e-12)
+        np.testing.assert_allclose(north, [0, 20, 20], atol=1e-12)
+
+    def test_speed_direction(self):
+        # Arrange
+        profile = wind.WindProfile([1000, 0], [20, 10], direction=[45, 315])
+
+        # Act
+        speed, direction = profile.get_speed_direction([0, 1000])
+
+        # Assert
+        np.testing.assert_allclose(speed, [10, 20])
+        np.testing.assert_allclose(direction, [315, 45])
+
+    def test_along_cross(self):
+        # Arrange
+        profile = wind.WindProfile([0, 1000], 10, direction=[180, 270])
+
+        # Act
+        along, cross = profile.get_along_cross([0, 1000], 270)
+
+        # Assert
+        np.testing.assert_allclose(along, [0, 10], atol=1e-12)
+        np.testing.assert_allclose(cross, [10, 0], atol=1e-12)
+
+    def test_from_function(self):
+        # Act
+        profile = wind.WindProfile.from_function(
+            lambda z: (z / 1000.0, 90 + 0 * z), max_altitude=20000,
+            resolution=100)
+
+        # Assert
+        speed, direction = profile.get_speed_direction(12345)
+        self.assertAlmostEqual(speed, 12.345)
+        self.assertAlmostEqual(direction, 90)
+
+    def test_as_profile(self):
+        # Arrange
+        profile = wind.WindProfile([0, 1000], [10, 20])
+
+        # Act, assert
+        self.assertIs(wind.as_profile(profile), profile)
+        self.assertIsNone(wind.as_profile(10))
+        self.assertIsNone(wind.as_profile(np.array([10, 20])))
+        self.assertIsInstance(wind.as_profile(([0, 1000], [10, 20])),
+                              wind.WindProfile)
+        self.assertIsInstance(wind.as_profile(lambda z: 10 + 0 * z),
+                              wind.WindProfile)
+
+    def test_invalid(self):
+        # Act and assert
+        with self.assertRaises(ValueError):
+            wind.WindProfile([0, 0], [10, 20])
+        with self.assertRaises(ValueError):
+            wind.WindProfile([], [])
+
+
+if __name__ == '__main__':
+    unittest.main()